@@ -0,0 +1,56 @@
+import argparse
+import json
+import shutil
+from src.constants import *
+from tqdm import tqdm
+from src.scripts.driver_preferences import TOP_K_ROUTES
+from src.scripts.driver_shards import NUM_DRIVER_SHARDS, DriverShardRunner
+from src.scripts.perfect_route import PerfectRouteSolver
+from src.scripts.route_io import write_routes_json
+
+
+parser = argparse.ArgumentParser(description="Compute the per-driver outputs (preferred standard routes and perfect "
+                                             "routes) shard by shard, in parallel.")
+parser.add_argument("--input", default=ACT_ROUTES_FILE,
+                    help="actual routes file (.json, .ndjson, optionally compressed)")
+parser.add_argument("--drivers-output", default=DRIVERS_FILE, help="preferred standard routes file")
+parser.add_argument("--perfect-output", default=PERFECT_ROUTES_FILE, help="perfect routes file")
+parser.add_argument("--shards", type=int, default=NUM_DRIVER_SHARDS,
+                    help="number of driver shards (more shards: less memory per worker)")
+parser.add_argument("--workers", type=int, default=0, help="number of worker processes (default: 0, one per core)")
+parser.add_argument("--top-k", type=int, default=TOP_K_ROUTES, help="preferred standard routes per driver")
+parser.add_argument("--beam-width", type=int, default=32, help="partial routes kept at each step of the search")
+parser.add_argument("--time-budget", type=float, default=1.0, help="search time budget per driver, in seconds")
+parser.add_argument("--work-dir", default=SHARDS_DIR, help="directory of the shards and of their results")
+parser.add_argument("--restart", action="store_true", help="discard the shards and results of a previous run")
+args = parser.parse_args()
+
+if args.restart:
+    shutil.rmtree(args.work_dir, ignore_errors=True)
+
+solver = PerfectRouteSolver(beam_width=args.beam_width, time_budget=args.time_budget)
+runner = DriverShardRunner(args.work_dir, args.shards, solver, args.top_k)
+
+# Partition the actual routes by driver, unless a previous run already partitioned the same file
+if runner.partition(args.input):
+    print("{} routes of {} drivers partitioned into {} shards in {}".format(
+        sum(runner.manifest["routes"]), runner.manifest["drivers"], args.shards, args.work_dir))
+else:
+    print("resuming from the partition in {}".format(args.work_dir))
+
+# Process the shards without a result yet (all of them, unless a previous run was interrupted), in parallel
+pending = runner.pending_shards()
+print("{} of {} shards to process".format(len(pending), args.shards))
+with tqdm(total=sum(runner.manifest["routes"][shard] for shard in pending), desc="shards", unit=" routes",
+          unit_scale=True, disable=None) as progress:
+    for shard, num_routes, num_drivers in runner.process(args.workers):
+        progress.update(num_routes)
+
+# Merge the results of the shards in the order of the drivers
+drivers, perfect_routes = runner.merge()
+with open(args.drivers_output, "w") as f:
+    json.dump(drivers, f, indent=4)
+write_routes_json(perfect_routes, args.perfect_output)
+
+print("preferred routes of {} drivers written to {} and perfect routes written to {}".format(
+    len(drivers), args.drivers_output, args.perfect_output))
@@ -0,0 +1,72 @@
+"""
+Benchmark of the RouteClustering: quality against exact K-Medoids (PAM on the full distance matrix) on the bundled
+actual routes dataset, then time and peak memory on a larger generated dataset, which exact K-Medoids could not
+cluster (its distance matrix alone would take N^2 * 4 bytes).
+
+Quality is the cost ratio (sum of the distances of the routes to their medoid, relative to exact K-Medoids; 1 is
+optimal) and the adjusted Rand index of the labels against the exact labels.
+
+Usage (from the repository root):
+    python -m src.benchmarks.bench_clustering [--routes 1000000] [--clusters 30]
+"""
+import argparse
+import itertools
+import random
+import resource
+import time
+
+from src.constants import *
+from src.scripts.clustering import CLUSTERING_METHODS, RouteClustering, kernel_route_distance, kmedoids
+from src.scripts.gen_routes import generate_standard_routes, iter_actual_routes
+from src.scripts.route_table import RouteTable
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--routes", type=int, default=1000000, help="routes of the scaling run (0 to skip it)")
+    parser.add_argument("--clusters", type=int, default=NUM_STD_ROUTES)
+    args = parser.parse_args()
+
+    from sklearn.metrics import adjusted_rand_score
+
+    table = RouteTable.from_file(ACT_ROUTES_FILE)
+    start = time.perf_counter()
+    distances = kernel_route_distance(table, table)
+    medoids = kmedoids(distances, args.clusters)
+    exact_s = time.perf_counter() - start
+    exact_cost = distances[:, medoids].min(axis=1).sum()
+    exact_labels = distances[:, medoids].argmin(axis=1)
+
+    print(f"quality on {len(table)} routes, {args.clusters} clusters (exact K-Medoids: {exact_s:.2f}s)")
+    print(f"{'method':>10} {'time s':>8} {'cost ratio':>11} {'ARI':>6}")
+    for method in CLUSTERING_METHODS:
+        start = time.perf_counter()
+        clustering = RouteClustering(args.clusters, method, pool_size=len(table)).fit(table)
+        elapsed = time.perf_counter() - start
+        ari = adjusted_rand_score(exact_labels, clustering.labels_)
+        print(f"{method:>10} {elapsed:8.2f} {clustering.inertia_ / exact_cost:11.4f} {ari:6.3f}")
+
+    if not args.routes:
+        return
+
+    rng = random.Random(0)
+    standard_routes = generate_standard_routes(args.routes // 20 + 1, MIN_TRIPS, MAX_TRIPS, rng)
+    actual_routes = iter_actual_routes(standard_routes, DRIVERS, MIN_ACT_ROUTE_VARIATIONS_PER_DRIVER,
+                                       MAX_ACT_ROUTE_VARIATIONS_PER_DRIVER, seed=0)
+    table = RouteTable.from_routes(itertools.islice(actual_routes, args.routes))
+    del standard_routes, actual_routes
+
+    print(f"\nscaling on {len(table)} routes ({table.nbytes / 2 ** 20:.0f} MiB table, exact distance matrix would "
+          f"take {len(table) ** 2 * 4 / 2 ** 30:.0f} GiB)")
+    print(f"{'method':>10} {'time s':>8} {'peak RSS MiB':>13}")
+    for method in CLUSTERING_METHODS:
+        start = time.perf_counter()
+        RouteClustering(args.clusters, method).fit(table)
+        elapsed = time.perf_counter() - start
+        # ru_maxrss is in KiB on Linux
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        print(f"{method:>10} {elapsed:8.2f} {peak:13.0f}")
+
+
+if __name__ == "__main__":
+    main()
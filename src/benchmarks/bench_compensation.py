@@ -0,0 +1,48 @@
+"""
+Benchmark of the CompensationScorer: routes scored per second with and without the alignment cache (the same
+variations being generated again and again, most alignments are cache hits) and the wall time with several worker
+processes.
+
+Usage (from the repository root):
+    python -m src.benchmarks.bench_compensation [--routes 200000] [--workers 1 2 4]
+"""
+import argparse
+import itertools
+import random
+import time
+
+from src.constants import *
+from src.scripts.compensation import CompensationScorer
+from src.scripts.gen_routes import generate_standard_routes, iter_actual_routes
+from src.scripts.route_table import RouteTable
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--routes", type=int, default=200000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    args = parser.parse_args()
+
+    standard_routes = generate_standard_routes(args.routes // 25 + 1, MIN_TRIPS, MAX_TRIPS, random.Random(0))
+    actual_routes = iter_actual_routes(standard_routes, DRIVERS, MIN_ACT_ROUTE_VARIATIONS_PER_DRIVER,
+                                       MAX_ACT_ROUTE_VARIATIONS_PER_DRIVER, seed=0)
+    table = RouteTable.from_routes(itertools.islice(actual_routes, args.routes))
+    print(f"{len(table)} routes of {len(standard_routes)} standard routes")
+
+    print(f"{'cache size':>10} {'routes/s':>10} {'alignments':>10}")
+    for cache_size in (0, 100000):
+        scorer = CompensationScorer(standard_routes, cache_size=cache_size)
+        start = time.perf_counter()
+        scorer.score(table)
+        elapsed = time.perf_counter() - start
+        print(f"{cache_size:10d} {len(table) / elapsed:10.0f} {len(scorer._alignments):10d}")
+
+    print(f"\n{'workers':>7} {'wall s':>8}")
+    for workers in args.workers:
+        start = time.perf_counter()
+        CompensationScorer(standard_routes).score(table, workers=workers)
+        print(f"{workers:7d} {time.perf_counter() - start:8.2f}")
+
+
+if __name__ == "__main__":
+    main()
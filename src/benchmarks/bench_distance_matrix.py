@@ -0,0 +1,96 @@
+"""
+Benchmark of the distance matrix generation: the per-pair calculate_distance() loop (DataFrame filters + geopy for
+every pair) against the vectorized pairwise_distances() engine.
+
+The per-pair loop is far too slow to run to completion on thousands of cities, so it is timed on a sample of pairs
+and extrapolated to the N * (N - 1) pairs that gen_cities_distance_matrix() used to compute.
+
+Usage (from the repository root):
+    python -m src.benchmarks.bench_distance_matrix [--sizes 46 500 5000] [--sample-pairs 200]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from src.scripts import utils
+from src.scripts.data_context import DataContext, get_data_context, set_data_context
+
+
+def _synthetic_cities_df(num_cities, seed=0):
+    """
+    Build a cities dataframe with random coordinates inside Italy's bounding box, for sizes larger than the database.
+    """
+    rng = np.random.default_rng(seed)
+    coords = rng.uniform([36.6, 6.6], [47.1, 18.5], size=(num_cities, 2))
+    return pd.DataFrame({"city": [f"city{i}" for i in range(num_cities)], "lat": coords[:, 0], "lng": coords[:, 1]})
+
+
+def time_per_pair_loop(cities_df, sample_pairs, seed=0):
+    """
+    Time calculate_distance() on a random sample of pairs and extrapolate to the full N * (N - 1) matrix.
+
+    :return: the estimated seconds for the whole matrix
+    """
+    rng = np.random.default_rng(seed)
+    cities = cities_df["city"].tolist()
+    pairs = rng.choice(len(cities), size=(sample_pairs, 2))
+    pairs = pairs[pairs[:, 0] != pairs[:, 1]]
+
+    # calculate_distance() reads the cities dataframe of the data context
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cities_csv = os.path.join(tmp_dir, "cities.csv")
+        cities_df.to_csv(cities_csv, index=False)
+        data_context = DataContext(cities=cities, cities_csv=cities_csv, matrix_path=None)
+        data_context.cities_df
+
+        previous = set_data_context(data_context)
+        try:
+            start = time.perf_counter()
+            for i, j in pairs:
+                utils.calculate_distance(cities[i], cities[j])
+            elapsed = time.perf_counter() - start
+        finally:
+            set_data_context(previous)
+
+    return elapsed / len(pairs) * len(cities) * (len(cities) - 1)
+
+
+def time_vectorized(cities_df, method):
+    """
+    Time pairwise_distances() on the whole matrix, including the coordinates lookup.
+
+    :return: the measured seconds
+    """
+    start = time.perf_counter()
+    coords = utils.get_cities_coordinates(cities_df["city"].tolist(), cities_df)
+    utils.pairwise_distances(coords, method=method)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[46, 500, 5000])
+    parser.add_argument("--sample-pairs", type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{'cities':>8} {'per-pair (est.)':>16} {'haversine':>12} {'ellipsoidal':>12} {'speed-up':>10}")
+    for num_cities in args.sizes:
+        if num_cities <= len(utils.CITIES):
+            it_cities_df = get_data_context().cities_df
+            cities_df = it_cities_df[it_cities_df["city"].isin(utils.CITIES[:num_cities])]
+        else:
+            cities_df = _synthetic_cities_df(num_cities)
+
+        loop_s = time_per_pair_loop(cities_df, args.sample_pairs)
+        haversine_s = time_vectorized(cities_df, "haversine")
+        ellipsoidal_s = time_vectorized(cities_df, "ellipsoidal")
+        print(f"{num_cities:>8} {loop_s:>15.2f}s {haversine_s:>11.4f}s {ellipsoidal_s:>11.4f}s "
+              f"{loop_s / ellipsoidal_s:>9.0f}x")
+
+
+if __name__ == "__main__":
+    main()
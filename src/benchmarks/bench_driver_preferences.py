@@ -0,0 +1,84 @@
+"""
+Benchmark of the DriverPreferenceModel: ingestion rate of actual routes, latency of a driver's top-5 query, and the
+cost of the full recomputation it replaces (grouping all the routes seen so far by driver and standard route, then
+ranking every driver's routes), which would otherwise be paid whenever drivers.json has to reflect new routes.
+
+The stream of (driver, standard route) pairs is synthetic: each driver follows the standard routes with its own skewed
+preferences, like the drivers of the generated datasets.
+
+Usage (from the repository root):
+    python -m src.benchmarks.bench_driver_preferences [--routes 1000000] [--standard-routes 1000] [--half-life 3600]
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from collections import Counter
+
+from src.constants import *
+from src.scripts.driver_preferences import DriverPreferenceModel
+
+
+def full_recompute(events, k=5):
+    """
+    Rank the standard routes of every driver from all the routes, as the batch computation does.
+    """
+    counts = Counter((driver, sroute) for driver, sroute, _ in events)
+    per_driver = {}
+    for (driver, sroute), count in counts.items():
+        per_driver.setdefault(driver, []).append((count, sroute))
+
+    return {driver: [sroute for _, sroute in sorted(routes, reverse=True)[:k]] for driver, routes in per_driver.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--routes", type=int, default=1000000)
+    parser.add_argument("--standard-routes", type=int, default=1000)
+    parser.add_argument("--half-life", type=float, default=3600.0, help="decay half-life in seconds (0: no decay)")
+    parser.add_argument("--queries", type=int, default=100000)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    sroutes = [f"s{i + 1}" for i in range(args.standard_routes)]
+    preferences = {driver: rng.sample(sroutes, len(sroutes)) for driver in DRIVERS}
+    # one route per second, each driver mostly sticking to the first routes of its preference order
+    events = []
+    for t in range(args.routes):
+        driver = rng.choice(DRIVERS)
+        events.append((driver, preferences[driver][min(int(rng.expovariate(0.05)), len(sroutes) - 1)], float(t)))
+
+    model = DriverPreferenceModel(half_life=args.half_life or None)
+    start = time.perf_counter()
+    for driver, sroute, timestamp in events:
+        model.update(driver, sroute, 1.0, timestamp)
+    ingest_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for i in range(args.queries):
+        model.top_routes(DRIVERS[i % len(DRIVERS)])
+    query_s = (time.perf_counter() - start) / args.queries
+
+    start = time.perf_counter()
+    full_recompute(events)
+    recompute_s = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "preferences.json.gz")
+        start = time.perf_counter()
+        model.snapshot(path)
+        snapshot_s = time.perf_counter() - start
+        start = time.perf_counter()
+        DriverPreferenceModel.restore(path)
+        restore_s = time.perf_counter() - start
+
+    print(f"routes: {args.routes}, drivers: {len(model)}, standard routes: {args.standard_routes}")
+    print(f"ingestion:          {args.routes / ingest_s:12.0f} routes/s ({ingest_s / args.routes * 1e6:.2f} us/route)")
+    print(f"top-5 query:        {query_s * 1e6:12.2f} us")
+    print(f"full recomputation: {recompute_s:12.2f} s ({recompute_s / ingest_s * args.routes:.0f}x one update)")
+    print(f"snapshot / restore: {snapshot_s:8.3f} s / {restore_s:.3f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+Throughput benchmark of the actual-route generator: routes generated per second by iter_actual_routes() on one core,
+and the memory allocated while generating them (tracemalloc, measured in a second, separate pass).
+
+Usage (from the repository root):
+    python -m src.benchmarks.bench_generation_throughput [--std-routes 2000] [--seed 0]
+"""
+import argparse
+import random
+import time
+import tracemalloc
+
+from src.constants import *
+from src.scripts.data_context import get_data_context
+from src.scripts.gen_routes import generate_standard_routes, iter_actual_routes
+
+
+def generate(standard_routes, seed):
+    """
+    Generate (and drop) the actual routes of the standard routes.
+
+    :return: (number of routes, number of trips)
+    """
+    num_routes = num_trips = 0
+    for actual_route in iter_actual_routes(standard_routes, DRIVERS, MIN_ACT_ROUTE_VARIATIONS_PER_DRIVER,
+                                           MAX_ACT_ROUTE_VARIATIONS_PER_DRIVER, seed=seed, workers=1):
+        num_routes += 1
+        num_trips += len(actual_route["route"])
+
+    return num_routes, num_trips
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--std-routes", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    get_data_context().warm()
+    standard_routes = generate_standard_routes(args.std_routes, MIN_TRIPS, MAX_TRIPS, random.Random(args.seed))
+
+    start = time.perf_counter()
+    num_routes, num_trips = generate(standard_routes, args.seed)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    generate(standard_routes, args.seed)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"standard routes: {args.std_routes}, actual routes: {num_routes}, trips: {num_trips}")
+    print(f"throughput: {num_routes / elapsed:.0f} routes/s ({num_trips / elapsed:.0f} trips/s, {elapsed:.2f}s)")
+    print(f"peak traced memory while streaming: {peak / 2 ** 20:.2f} MiB")
+
+
+if __name__ == "__main__":
+    main()
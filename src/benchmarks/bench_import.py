@@ -0,0 +1,58 @@
+"""
+Cold-start benchmark of the route generator: time to import the packages in a fresh interpreter (which must not read
+any data file), then time of the first access to the data context (cities database, distance matrix, neighbour index).
+
+Usage (from the repository root):
+    python -m src.benchmarks.bench_import [--runs 10]
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+from src.constants import HOME
+
+# timed in a fresh interpreter, prints a JSON dict of durations in seconds
+_COLD_START_SNIPPET = """
+import json, time
+start = time.perf_counter()
+import src.scripts
+package_s = time.perf_counter() - start
+import src.scripts.gen_routes
+gen_routes_s = time.perf_counter() - start
+src.scripts.get_data_context().warm()
+warm_s = time.perf_counter() - start
+print(json.dumps({"import src.scripts": package_s, "import src.scripts.gen_routes": gen_routes_s,
+                  "first data access": warm_s}))
+"""
+
+
+def cold_start(runs):
+    """
+    Run the cold-start snippet in `runs` fresh interpreters.
+
+    :return: dictionary mapping each step to the list of its durations in seconds
+    """
+    timings = {}
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-c", _COLD_START_SNIPPET], cwd=HOME, check=True,
+                                capture_output=True, text=True).stdout
+        for step, seconds in json.loads(output.strip().splitlines()[-1]).items():
+            timings.setdefault(step, []).append(seconds)
+
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    print(f"{'step (cumulative)':<32} {'median':>10} {'min':>10}")
+    for step, seconds in cold_start(args.runs).items():
+        print(f"{step:<32} {statistics.median(seconds) * 1000:>8.1f}ms {min(seconds) * 1000:>8.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
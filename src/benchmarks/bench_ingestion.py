@@ -0,0 +1,88 @@
+"""
+Load generator of the RouteIngestionService: client processes send actual routes generated by
+generate_actual_routes() over local TCP connections, as fast as possible or at a target rate, to a service feeding a
+DriverPreferenceModel. Reports the sustained throughput, the p50 / p99 latency (reception to end of the micro-batch)
+and the largest queue depth, which stays bounded by the queue size under overload (backpressure).
+
+Usage (from the repository root):
+    python -m src.benchmarks.bench_ingestion [--routes 200000] [--clients 2] [--rates 0 5000 20000]
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import random
+import socket
+import time
+
+from src.constants import *
+from src.scripts.driver_preferences import DriverPreferenceModel
+from src.scripts.gen_routes import generate_actual_routes, generate_standard_routes
+from src.scripts.ingestion import RouteIngestionService
+
+
+def send_routes(port, lines, rate, chunk_size=64):
+    """
+    Client process: send NDJSON lines to the service, in chunks paced to a rate (routes per second, 0 for no limit),
+    then read the error lines until the service closes the connection.
+    """
+    with socket.create_connection(("127.0.0.1", port)) as connection:
+        start = time.perf_counter()
+        for i in range(0, len(lines), chunk_size):
+            if rate:
+                delay = start + i / rate - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            connection.sendall(b"".join(lines[i:i + chunk_size]))
+
+        connection.shutdown(socket.SHUT_WR)
+        while connection.recv(65536):
+            pass
+
+
+async def run_load(lines, clients, rate, queue_size, batch_size):
+    model = DriverPreferenceModel()
+    service = RouteIngestionService(model.add_routes, batch_size=batch_size, queue_size=queue_size)
+    await service.start()
+    port = await service.serve_tcp()
+
+    # the clients are separate processes, so that they do not share the event loop with the service
+    loop = asyncio.get_running_loop()
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(target=send_routes, args=(port, lines[i::clients], rate / clients if rate else 0))
+        for i in range(clients)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        await loop.run_in_executor(None, process.join)
+
+    await service.close()
+    return service.stats()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--routes", type=int, default=200000)
+    parser.add_argument("--clients", type=int, default=2)
+    parser.add_argument("--rates", type=int, nargs="+", default=[0, 5000, 20000], help="routes/s (0: no limit)")
+    parser.add_argument("--queue-size", type=int, default=8192)
+    parser.add_argument("--batch-size", type=int, default=256)
+    args = parser.parse_args()
+
+    standard_routes = generate_standard_routes(args.routes // 25 + 1, MIN_TRIPS, MAX_TRIPS, random.Random(0))
+    routes = generate_actual_routes(standard_routes, DRIVERS, MIN_ACT_ROUTE_VARIATIONS_PER_DRIVER,
+                                    MAX_ACT_ROUTE_VARIATIONS_PER_DRIVER, seed=0)[:args.routes]
+    lines = [json.dumps(route, separators=(",", ":")).encode("utf-8") + b"\n" for route in routes]
+
+    print(f"{'target/s':>9} {'routes/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'mean batch':>10} {'max queued':>10} "
+          f"{'invalid':>7}")
+    for rate in args.rates:
+        stats = asyncio.run(run_load(lines, args.clients, rate, args.queue_size, args.batch_size))
+        print(f"{rate or 'max':>9} {stats['routes_per_s']:9.0f} {stats['p50_ms']:8.2f} {stats['p99_ms']:8.2f} "
+              f"{stats['mean_batch']:10.1f} {stats['max_queued']:10d} {stats['invalid']:7d}")
+
+
+if __name__ == "__main__":
+    main()
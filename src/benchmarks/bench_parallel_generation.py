@@ -0,0 +1,64 @@
+"""
+Benchmark of the process-pool mode of generate_actual_routes(): time to generate the actual routes of many standard
+routes with 1, 2, 4, ... workers (up to the number of CPU cores), and check that the output is identical whatever the
+number of workers.
+
+Usage (from the repository root):
+    python -m src.benchmarks.bench_parallel_generation [--std-routes 10000] [--seed 0]
+"""
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import os
+import random
+import time
+
+from src.constants import *
+from src.scripts.data_context import get_data_context
+from src.scripts.gen_routes import generate_actual_routes, generate_standard_routes
+
+
+def worker_counts(max_workers):
+    """
+    1, 2, 4, ... up to max_workers (included).
+    """
+    counts = [1]
+    while counts[-1] * 2 < max_workers:
+        counts.append(counts[-1] * 2)
+    if max_workers > 1:
+        counts.append(max_workers)
+
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--std-routes", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    get_data_context().warm()
+    standard_routes = generate_standard_routes(args.std_routes, MIN_TRIPS, MAX_TRIPS, random.Random(args.seed))
+
+    print(f"{'workers':>8} {'routes':>10} {'seconds':>9} {'routes/s':>10} {'speed-up':>9}  digest")
+    baseline_s = None
+    for workers in worker_counts(args.max_workers):
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            actual_routes = generate_actual_routes(
+                standard_routes, DRIVERS, MIN_ACT_ROUTE_VARIATIONS_PER_DRIVER, MAX_ACT_ROUTE_VARIATIONS_PER_DRIVER,
+                seed=args.seed, workers=workers
+            )
+        elapsed = time.perf_counter() - start
+        baseline_s = baseline_s or elapsed
+
+        digest = hashlib.sha256(json.dumps(actual_routes).encode("utf-8")).hexdigest()[:16]
+        print(f"{workers:>8} {len(actual_routes):>10} {elapsed:>9.2f} {len(actual_routes) / elapsed:>10.0f} "
+              f"{baseline_s / elapsed:>8.2f}x  {digest}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+Benchmark of the PerfectRouteSolver: search time per driver and mean route score (log-likelihood of the transitions
+minus the distance penalty, higher is better) for several beam widths, a beam width of 1 being a greedy search, and
+the wall time of all the drivers with several worker processes.
+
+The actual routes are the bundled dataset, or generated ones with --routes (more routes per driver, so more observed
+transitions to search).
+
+Usage (from the repository root):
+    python -m src.benchmarks.bench_perfect_routes [--routes 100000] [--beam-widths 1 8 32 128] [--workers 1 2 4]
+"""
+import argparse
+import itertools
+import random
+import time
+
+from src.constants import *
+from src.scripts.gen_routes import generate_standard_routes, iter_actual_routes
+from src.scripts.perfect_route import PerfectRouteSolver, driver_profiles, generate_perfect_routes
+from src.scripts.route_table import RouteTable
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--routes", type=int, default=0, help="generated actual routes (default: bundled dataset)")
+    parser.add_argument("--beam-widths", type=int, nargs="+", default=[1, 8, 32, 128])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--time-budget", type=float, default=None, help="time budget per driver, in seconds")
+    args = parser.parse_args()
+
+    if args.routes:
+        standard_routes = generate_standard_routes(args.routes // 20 + 1, MIN_TRIPS, MAX_TRIPS, random.Random(0))
+        actual_routes = iter_actual_routes(standard_routes, DRIVERS, MIN_ACT_ROUTE_VARIATIONS_PER_DRIVER,
+                                           MAX_ACT_ROUTE_VARIATIONS_PER_DRIVER, seed=0)
+        table = RouteTable.from_routes(itertools.islice(actual_routes, args.routes))
+    else:
+        table = RouteTable.from_file(ACT_ROUTES_FILE)
+
+    start = time.perf_counter()
+    profiles = driver_profiles(table)
+    print(f"{len(table)} routes, {len(profiles)} driver profiles built in {time.perf_counter() - start:.2f}s")
+
+    print(f"{'beam width':>10} {'ms/driver':>10} {'mean score':>11} {'complete':>9}")
+    for beam_width in args.beam_widths:
+        solver = PerfectRouteSolver(beam_width=beam_width, time_budget=args.time_budget)
+        start = time.perf_counter()
+        results = [solver.solve(profile) for profile in profiles]
+        elapsed = (time.perf_counter() - start) / len(profiles)
+        mean_score = sum(score for _, score, _ in results) / len(results)
+        complete = sum(complete for _, _, complete in results)
+        print(f"{beam_width:10d} {elapsed * 1000:10.2f} {mean_score:11.3f} {complete:6d}/{len(results)}")
+
+    print(f"\n{'workers':>7} {'wall s':>8}")
+    for workers in args.workers:
+        start = time.perf_counter()
+        generate_perfect_routes(table, PerfectRouteSolver(time_budget=args.time_budget), workers)
+        print(f"{workers:7d} {time.perf_counter() - start:8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Benchmark of the RouteDistanceKernel: throughput (route pairs per second) of the chunked sparse kernel computing the
+distances between R actual routes and S standard routes, against a per-pair Python loop over the route dictionaries
+computing the same distance on a sample of the pairs.
+
+The full matrix is only kept up to --matrix-limit pairs; larger sizes reduce every chunk to the closest standard route,
+so the memory stays bounded by the chunk size.
+
+Usage (from the repository root):
+    python -m src.benchmarks.bench_route_distance [--sizes 1000x30 100000x1000 1000000x10000] [--chunk-size 4096]
+"""
+import argparse
+import itertools
+import math
+import random
+import time
+from collections import Counter
+
+from src.constants import *
+from src.scripts.gen_routes import generate_standard_routes, iter_actual_routes
+from src.scripts.route_distance import RouteDistanceKernel
+from src.scripts.route_table import RouteTable
+
+
+def python_distance(actual_route, standard_route, city_weight=0.5, quantity_step=5):
+    """
+    Reference implementation of the kernel distance on two route dictionaries.
+    """
+    def merchandise(route):
+        quantities = Counter()
+        for trip in route["route"]:
+            for item, quantity in trip["merchandise"].items():
+                quantities[trip["from"], trip["to"], item] += quantity
+        return {key: math.ceil(quantity / quantity_step) for key, quantity in quantities.items()}
+
+    actual_pairs = {(trip["from"], trip["to"]) for trip in actual_route["route"]}
+    standard_pairs = {(trip["from"], trip["to"]) for trip in standard_route["route"]}
+    city_distance = 1 - len(actual_pairs & standard_pairs) / len(actual_pairs | standard_pairs)
+
+    actual_merchandise, standard_merchandise = merchandise(actual_route), merchandise(standard_route)
+    total = sum(actual_merchandise.values()) + sum(standard_merchandise.values())
+    l1 = sum(abs(actual_merchandise.get(key, 0) - standard_merchandise.get(key, 0))
+             for key in actual_merchandise.keys() | standard_merchandise.keys())
+
+    return city_weight * city_distance + (1 - city_weight) * l1 / total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", nargs="+", default=["1000x30", "100000x1000", "1000000x10000"])
+    parser.add_argument("--chunk-size", type=int, default=4096)
+    parser.add_argument("--matrix-limit", type=int, default=10 ** 8, help="largest full matrix kept (pairs)")
+    parser.add_argument("--python-pairs", type=int, default=20000, help="pairs timed with the Python loop")
+    args = parser.parse_args()
+
+    print(f"{'size':>16} {'kernel s':>10} {'pairs/s':>12} {'python pairs/s':>15} {'speedup':>8}")
+    for size in args.sizes:
+        num_actual, num_standard = (int(n) for n in size.split("x"))
+
+        rng = random.Random(0)
+        # enough standard routes to generate the actual routes (about 25 each), the first ones are compared with
+        standard_routes = generate_standard_routes(max(num_standard, num_actual // 20 + 1), MIN_TRIPS, MAX_TRIPS, rng)
+        actual_routes = itertools.islice(
+            iter_actual_routes(standard_routes, DRIVERS, MIN_ACT_ROUTE_VARIATIONS_PER_DRIVER,
+                               MAX_ACT_ROUTE_VARIATIONS_PER_DRIVER, seed=0), num_actual)
+        actual_table = RouteTable.from_routes(actual_routes)
+        standard_routes = standard_routes[:num_standard]
+
+        start = time.perf_counter()
+        kernel = RouteDistanceKernel(standard_routes, chunk_size=args.chunk_size)
+        if num_actual * num_standard <= args.matrix_limit:
+            kernel.distances(actual_table)
+        else:
+            kernel.nearest(actual_table)
+        kernel_s = time.perf_counter() - start
+
+        # the Python loop on a sample of the pairs
+        sample = [actual_table.route(j) for j in range(min(len(actual_table), args.python_pairs // num_standard + 1))]
+        pairs = list(itertools.islice(itertools.product(sample, standard_routes), args.python_pairs))
+        start = time.perf_counter()
+        for actual_route, standard_route in pairs:
+            python_distance(actual_route, standard_route)
+        python_rate = len(pairs) / (time.perf_counter() - start)
+
+        kernel_rate = num_actual * num_standard / kernel_s
+        print(f"{size:>16} {kernel_s:10.2f} {kernel_rate:12.3g} {python_rate:15.3g} {kernel_rate / python_rate:7.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Stress benchmark of the route id allocator: worker processes allocate --ids ids in total concurrently, each one from
+its own shard (as the generator does per standard route), then the ids of all the workers are checked for global
+uniqueness and, per shard, for monotonic text order. The former id scheme (a random number in [1, 100000]) is
+measured at the same size for comparison.
+
+Usage (from the repository root):
+    python -m src.benchmarks.bench_route_ids [--ids 10000000] [--workers 4] [--batch 0]
+"""
+import argparse
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from src.scripts.route_ids import ACT_ROUTE_ID_PREFIX, RouteIdAllocator
+
+
+def allocate_shard(args):
+    """
+    Worker: allocate n ids from a shard, one at a time or by batches of batch ids, and check their order.
+
+    :return: (int64 array of the keys of the ids, seconds spent allocating, ids in increasing text order) tuple
+    """
+    shard, n, batch = args
+    new_id = RouteIdAllocator(ACT_ROUTE_ID_PREFIX, shard)
+
+    start = time.perf_counter()
+    if batch:
+        ids = []
+        for size in [batch] * (n // batch) + ([n % batch] if n % batch else []):
+            ids.extend(new_id.allocate(size))
+    else:
+        ids = [new_id() for _ in range(n)]
+    elapsed = time.perf_counter() - start
+
+    ordered = all(previous < current for previous, current in zip(ids, ids[1:]))
+    keys = np.fromiter((int(route_id[len(ACT_ROUTE_ID_PREFIX):], 16) for route_id in ids), dtype=np.int64, count=n)
+    return keys, elapsed, ordered
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ids", type=int, default=10_000_000)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--batch", type=int, default=0, help="ids allocated at once (default: 0, one at a time)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    # the last worker takes the remainder, every worker allocates from its own shard
+    counts = [args.ids // args.workers] * args.workers
+    counts[-1] += args.ids % args.workers
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        results = list(executor.map(allocate_shard, [(shard, n, args.batch) for shard, n in enumerate(counts, 1)]))
+    wall = time.perf_counter() - start
+
+    keys = np.concatenate([shard_keys for shard_keys, _, _ in results])
+    unique = len(np.unique(keys))
+    print(f"{'shard':>6} {'ids':>10} {'seconds':>9} {'ids/s':>12}  ordered")
+    for shard, (shard_keys, elapsed, ordered) in enumerate(results, 1):
+        print(f"{shard:>6} {len(shard_keys):>10} {elapsed:>9.2f} {len(shard_keys) / elapsed:>12.0f}  {ordered}")
+    print(f"{'all':>6} {len(keys):>10} {wall:>9.2f} {len(keys) / wall:>12.0f}  "
+          f"{unique} unique, {len(keys) - unique} collisions")
+
+    # the former scheme: f"a{rng.randint(1, 100000)}" for every route
+    rng = random.Random(args.seed)
+    draws = np.fromiter((rng.randint(1, 100000) for _ in range(min(args.ids, 1_000_000))), dtype=np.int64)
+    print(f"random ids in [1, 100000]: {len(draws) - len(np.unique(draws))} collisions in {len(draws)} ids")
+
+    if unique != len(keys) or not all(ordered for _, _, ordered in results):
+        raise SystemExit("route ids are not unique and ordered")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Benchmark of the RouteSimilarityIndex: time per top-k query against a brute-force scan comparing the query signature
+with every indexed signature, recall of the LSH forest (share of the brute-force top-k it also returns), and time per
+add-then-query step of a live index, with the default buffer of recent additions and without (buffer of 1 route,
+the forest being sorted again before every query).
+
+The indexed routes are generated with iter_actual_routes() from seeded standard routes; the queries are other actual
+routes of the same standard routes.
+
+Usage (from the repository root):
+    python -m src.benchmarks.bench_route_similarity [--routes 100000] [--queries 200] [--k 5]
+"""
+import argparse
+import itertools
+import random
+import time
+
+from src.constants import *
+from src.scripts.gen_routes import generate_standard_routes, iter_actual_routes
+from src.scripts.route_similarity import BUFFER_SIZE, RouteSimilarityIndex
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--routes", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    standard_routes = generate_standard_routes(args.routes // 20 + 1, MIN_TRIPS, MAX_TRIPS, rng)
+    actual_routes = iter_actual_routes(standard_routes, DRIVERS, MIN_ACT_ROUTE_VARIATIONS_PER_DRIVER,
+                                       MAX_ACT_ROUTE_VARIATIONS_PER_DRIVER, seed=0)
+
+    index = RouteSimilarityIndex()
+    signatures = [index.minhash(route) for route in itertools.islice(actual_routes, args.routes + args.queries)]
+    rng.shuffle(signatures)
+    queries, indexed = signatures[:args.queries], signatures[args.queries:]
+
+    start = time.perf_counter()
+    for i, minhash in enumerate(indexed):
+        index.add(i, minhash=minhash)
+    index.query(minhash=queries[0])
+    build_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    lsh_results = [index.query(minhash=minhash, k=args.k) for minhash in queries]
+    lsh_s = (time.perf_counter() - start) / len(queries)
+
+    start = time.perf_counter()
+    exact_results = []
+    for minhash in queries:
+        scores = sorted(((minhash.jaccard(other), key) for key, other in index.signatures.items()), reverse=True)
+        exact_results.append(scores[:args.k])
+    exact_s = (time.perf_counter() - start) / len(queries)
+
+    # routes with the same similarity tie, so a result counts as found if it is at least as similar as the k-th
+    # brute-force result
+    recall = sum(
+        sum(similarity >= exact[-1][0] for _, similarity in lsh) / len(exact)
+        for lsh, exact in zip(lsh_results, exact_results)
+    ) / len(queries)
+
+    live_s = {}
+    for buffer_size in (BUFFER_SIZE, 1):
+        live = RouteSimilarityIndex(buffer_size=buffer_size)
+        for i, minhash in enumerate(indexed):
+            live.add(i, minhash=minhash)
+        live.query(minhash=queries[0])
+        start = time.perf_counter()
+        for i, minhash in enumerate(queries):
+            live.add(len(indexed) + i, minhash=minhash)
+            live.query(minhash=minhash, k=args.k)
+        live_s[buffer_size] = (time.perf_counter() - start) / len(queries)
+
+    print(f"indexed routes: {len(index)}, built in {build_s:.2f}s")
+    print(f"LSH forest query:  {lsh_s * 1000:8.3f} ms")
+    print(f"brute-force query: {exact_s * 1000:8.3f} ms ({exact_s / lsh_s:.0f}x slower)")
+    print(f"recall@{args.k}: {recall:.3f}")
+    print(f"add + query, buffer of {BUFFER_SIZE}: {live_s[BUFFER_SIZE] * 1000:8.3f} ms")
+    print(f"add + query, no buffer:     {live_s[1] * 1000:8.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Benchmark of the SQLite route store against scanning a JSON Lines file: time to write the routes in both forms, then
+time of filtered queries (the routes of a driver on a standard route, the routes, their count and the trips through a
+city) on the store and by a full scan of the file, checking that both give the same answers. Queries returning a large
+share of the routes are bound by rebuilding the route dictionaries, in both cases.
+
+The routes are made by replicating the bundled data/actual_routes.json with fresh ids.
+
+Usage (from the repository root):
+    python -m src.benchmarks.bench_route_store [--routes 1000000] [--city Bologna] [--directory /tmp]
+"""
+import argparse
+import itertools
+import json
+import os
+import tempfile
+import time
+
+from src.constants import *
+from src.scripts.route_ids import RouteIdAllocator
+from src.scripts.route_io import iter_routes, write_routes_ndjson
+from src.scripts.route_store import RouteStore, write_routes_sqlite
+
+
+def replicated_routes(base_routes, num_routes):
+    """
+    Generate num_routes routes cycling over base_routes, each one with a fresh id.
+    """
+    new_id = RouteIdAllocator()
+    for route in itertools.islice(itertools.cycle(base_routes), num_routes):
+        yield dict(route, id=new_id())
+
+
+def timed(function, *args):
+    """
+    Call function(*args) and return (result, seconds).
+    """
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--routes", type=int, default=1_000_000)
+    parser.add_argument("--city", default="Bologna")
+    parser.add_argument("--directory", default=None, help="directory of the temporary files (default: the system's)")
+    args = parser.parse_args()
+
+    with open(ACT_ROUTES_FILE) as f:
+        base_routes = json.load(f)
+    driver, sroute = base_routes[0]["driver"], base_routes[0]["sroute"]
+
+    def through_city(route):
+        return any(args.city in (trip["from"], trip["to"]) for trip in route["route"])
+
+    # (name, query on the store, filter of the routes scanned, result of the scan from the matching routes)
+    queries = [
+        (f"routes of {driver} on {sroute}", lambda store: list(store.routes(driver=driver, sroute=sroute)),
+         lambda route: route.get("driver") == driver and route.get("sroute") == sroute, list),
+        (f"routes through {args.city}", lambda store: list(store.routes(city=args.city)), through_city, list),
+        (f"count routes through {args.city}", lambda store: store.count(city=args.city), through_city, len),
+        (f"trips through {args.city}", lambda store: store.trips(args.city), through_city,
+         lambda routes: [(route["id"], position, trip["from"], trip["to"]) for route in routes
+                         for position, trip in enumerate(route["route"]) if args.city in (trip["from"], trip["to"])]),
+    ]
+
+    with tempfile.TemporaryDirectory(dir=args.directory) as directory:
+        ndjson_path = os.path.join(directory, "routes.ndjson")
+        sqlite_path = os.path.join(directory, "routes.sqlite")
+
+        _, ndjson_s = timed(write_routes_ndjson, replicated_routes(base_routes, args.routes), ndjson_path)
+        _, sqlite_s = timed(write_routes_sqlite, replicated_routes(base_routes, args.routes), sqlite_path)
+        print(f"{args.routes} routes")
+        print(f"{'write':<8} {'seconds':>9} {'routes/s':>10} {'MB':>9}")
+        for name, seconds, path in (("ndjson", ndjson_s, ndjson_path), ("sqlite", sqlite_s, sqlite_path)):
+            print(f"{name:<8} {seconds:>9.2f} {args.routes / seconds:>10.0f} {os.path.getsize(path) / 1e6:>9.1f}")
+
+        print(f"\n{'query':<32} {'results':>9} {'scan s':>9} {'sqlite ms':>10} {'speed-up':>10}  same")
+        for name, query, keep, scan_result in queries:
+            expected, scan_s = timed(lambda: scan_result([route for route in iter_routes(ndjson_path) if keep(route)]))
+
+            def query_store():
+                with RouteStore(sqlite_path, readonly=True) as store:
+                    return query(store)
+
+            result, query_s = timed(query_store)
+            results = result if isinstance(result, int) else len(result)
+            print(f"{name:<32} {results:>9} {scan_s:>9.2f} {query_s * 1000:>10.1f} {scan_s / query_s:>9.0f}x  "
+                  f"{result == expected}")
+
+
+if __name__ == "__main__":
+    main()
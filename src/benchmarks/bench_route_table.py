@@ -0,0 +1,73 @@
+"""
+Memory benchmark of the columnar RouteTable against the list-of-dicts form of the routes.
+
+The routes are made by replicating the bundled data/actual_routes.json with fresh ids. The dict form costs about 4 KB
+per route, so it is only built up to --dict-limit routes and extrapolated linearly beyond; the RouteTable is always
+built at the full size, streaming the routes in.
+
+Usage (from the repository root):
+    python -m src.benchmarks.bench_route_table [--routes 1000000] [--dict-limit 100000]
+"""
+import argparse
+import itertools
+import json
+import time
+import tracemalloc
+
+from src.constants import *
+from src.scripts.route_io import iter_routes
+from src.scripts.route_table import RouteTable
+
+
+def replicated_routes(base_lines, num_routes):
+    """
+    Generate num_routes distinct route dictionaries (each one parsed from JSON, so nothing is shared between them).
+    """
+    for i, line in enumerate(itertools.islice(itertools.cycle(base_lines), num_routes)):
+        route = json.loads(line)
+        route["id"] = f"a{i}"
+        yield route
+
+
+def measure(build):
+    """
+    Run build() and return (result, traced memory still allocated in bytes, seconds).
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = build()
+    elapsed = time.perf_counter() - start
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return result, current, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--routes", type=int, default=1000000)
+    parser.add_argument("--dict-limit", type=int, default=100000)
+    parser.add_argument("--input", default=ACT_ROUTES_FILE)
+    args = parser.parse_args()
+
+    base_lines = [json.dumps(route) for route in iter_routes(args.input)]
+    dict_routes = min(args.routes, args.dict_limit)
+
+    routes, dict_bytes, dict_s = measure(lambda: list(replicated_routes(base_lines, dict_routes)))
+    num_trips = sum(len(route["route"]) for route in routes)
+    del routes
+    dict_bytes_full = dict_bytes / dict_routes * args.routes
+
+    table, table_bytes, table_s = measure(lambda: RouteTable.from_routes(replicated_routes(base_lines, args.routes)))
+
+    print(f"routes: {args.routes}, trips: {table.num_trips} ({num_trips / dict_routes:.2f} per route)")
+    extrapolated = " (extrapolated)" if dict_routes < args.routes else ""
+    print(f"list of dicts: {dict_bytes_full / 2 ** 20:>10.1f} MiB{extrapolated}, "
+          f"built in {dict_s:.1f}s for {dict_routes} routes")
+    print(f"RouteTable:    {table_bytes / 2 ** 20:>10.1f} MiB (arrays: {table.nbytes / 2 ** 20:.1f} MiB), "
+          f"built in {table_s:.1f}s")
+    print(f"ratio:         {dict_bytes_full / table_bytes:>10.1f}x")
+
+
+if __name__ == "__main__":
+    main()
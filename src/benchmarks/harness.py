@@ -0,0 +1,290 @@
+"""
+End-to-end benchmark harness: runs the generation and analysis stages over a sweep of parameters, and records for
+each stage its time, throughput (items per second, routes for the route stages) and peak RSS, with the git commit of the
+tree, in a JSON file that can be compared with the results of another commit.
+
+Every parameter point runs in a fresh (spawned) child process, so that the memory of one point does not leak into
+the next. The peak RSS of each stage is its own on Linux (the high-water mark is reset between stages); elsewhere it is
+the peak of the child process so far.
+
+Stages: distance_matrix, standard_routes, actual_routes (streamed to an NDJSON file), route_table, nearest_standard
+(RouteDistanceKernel), clustering (RouteClustering), driver_preferences (DriverPreferenceModel) and perfect_routes.
+
+Usage (from the repository root):
+    python -m src.benchmarks.harness run [--preset quick|full] [--set num_std_routes=30,300] [--repeat 3]
+                                         [--output results.json]
+    python -m src.benchmarks.harness compare base.json new.json [--threshold 0.1] [--min-seconds 0.05]
+
+The parameters (--set name=value[,value...], swept as a cartesian product) are num_std_routes, num_drivers,
+min_variations, max_variations, num_cities (distance matrix stage), workers and seed.
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from src.constants import *
+
+
+STAGES = ("distance_matrix", "standard_routes", "actual_routes", "route_table", "nearest_standard", "clustering",
+          "driver_preferences", "perfect_routes")
+
+# default value of every parameter, the constants of the datasets
+DEFAULT_PARAMS = {
+    "num_std_routes": NUM_STD_ROUTES, "num_drivers": len(DRIVERS),
+    "min_variations": MIN_ACT_ROUTE_VARIATIONS_PER_DRIVER, "max_variations": MAX_ACT_ROUTE_VARIATIONS_PER_DRIVER,
+    "num_cities": len(CITIES), "workers": 1, "seed": 0,
+}
+
+PRESETS = {
+    "quick": {"num_std_routes": [30, 100]},
+    "full": {"num_std_routes": [30, 300, 3000], "num_cities": [46, 281], "workers": [1, 0]},
+}
+
+
+def _reset_peak_rss():
+    """
+    Reset the peak RSS of the process (Linux only), so that the next reading is the peak of what follows.
+
+    :return: True if it was reset
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss_mib():
+    """
+    Get the peak RSS of the process in MiB: VmHWM on Linux, else ru_maxrss (KiB on Linux, bytes on macOS).
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / 2 ** 20 if sys.platform == "darwin" else maxrss / 1024
+
+
+def run_stages(params, stages=STAGES):
+    """
+    Run the stages for one parameter point (in the child process).
+
+    :param params: the parameters, see DEFAULT_PARAMS
+    :param stages: the stages to run, in order (the later stages need the routes of actual_routes)
+    :return: list of stage result dictionaries
+    """
+    from src.scripts.clustering import RouteClustering
+    from src.scripts.data_context import get_data_context
+    from src.scripts.driver_preferences import DriverPreferenceModel
+    from src.scripts.gen_routes import generate_standard_routes, iter_actual_routes
+    from src.scripts.perfect_route import PerfectRouteSolver, generate_perfect_routes
+    from src.scripts.route_distance import RouteDistanceKernel
+    from src.scripts.route_io import iter_routes, write_routes_ndjson
+    from src.scripts.route_table import RouteTable
+    from src.scripts.utils import gen_cities_distance_matrix
+
+    results = []
+    state = {}
+
+    def run(stage, function, unit):
+        per_stage = _reset_peak_rss()
+        start = time.perf_counter()
+        items = function()
+        seconds = time.perf_counter() - start
+        results.append({
+            "stage": stage, "seconds": seconds, "items": items, "unit": unit,
+            "items_per_s": items / seconds if seconds else None,
+            "peak_rss_mib": _peak_rss_mib(), "peak_rss_per_stage": per_stage,
+        })
+
+    def distance_matrix():
+        cities = list(dict.fromkeys(state["cities_df"]["city"]))[:params["num_cities"]]
+        gen_cities_distance_matrix(cities, cities_df=state["cities_df"], matrix_path=None, csv_path=None)
+        return len(cities) ** 2
+
+    def standard_routes():
+        state["standard_routes"] = generate_standard_routes(params["num_std_routes"], MIN_TRIPS, MAX_TRIPS,
+                                                            random.Random(params["seed"]))
+        return len(state["standard_routes"])
+
+    def actual_routes():
+        routes = iter_actual_routes(state["standard_routes"], DRIVERS[:params["num_drivers"]],
+                                    params["min_variations"], params["max_variations"], seed=params["seed"],
+                                    workers=params["workers"])
+        return write_routes_ndjson(routes, state["routes_file"])
+
+    def route_table():
+        state["table"] = RouteTable.from_file(state["routes_file"])
+        return len(state["table"])
+
+    def nearest_standard():
+        RouteDistanceKernel(state["standard_routes"]).nearest(state["table"])
+        return len(state["table"])
+
+    def clustering():
+        RouteClustering(min(NUM_STD_ROUTES, len(state["table"]))).fit(state["table"])
+        return len(state["table"])
+
+    def driver_preferences():
+        return DriverPreferenceModel().add_routes(iter_routes(state["routes_file"]))
+
+    def perfect_routes():
+        generate_perfect_routes(state["table"], PerfectRouteSolver(), params["workers"])
+        return len(state["table"])
+
+    functions = {
+        "distance_matrix": (distance_matrix, "distances"), "standard_routes": (standard_routes, "routes"),
+        "actual_routes": (actual_routes, "routes"), "route_table": (route_table, "routes"),
+        "nearest_standard": (nearest_standard, "routes"), "clustering": (clustering, "routes"),
+        "driver_preferences": (driver_preferences, "routes"), "perfect_routes": (perfect_routes, "routes"),
+    }
+
+    # the cities database is loaded outside of the timings
+    if "distance_matrix" in stages:
+        state["cities_df"] = get_data_context().cities_df
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        state["routes_file"] = os.path.join(tmp_dir, "actual_routes.ndjson")
+        for stage in stages:
+            run(stage, *functions[stage])
+
+    return results
+
+
+def git_revision():
+    """
+    Get the git commit of the tree and whether it has uncommitted changes (None if git is not available).
+    """
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=HOME, capture_output=True, text=True, check=True)
+        status = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=HOME,
+                                capture_output=True, text=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return {"commit": None, "dirty": None}
+
+    return {"commit": commit.stdout.strip(), "dirty": bool(status.stdout.strip())}
+
+
+def parameter_points(sweep):
+    """
+    Get the cartesian product of a sweep.
+
+    :param sweep: {parameter: list of values}, the other parameters keeping their default
+    :return: list of parameter dictionaries
+    """
+    names = list(sweep)
+    return [{**DEFAULT_PARAMS, **dict(zip(names, values))} for values in itertools.product(*sweep.values())]
+
+
+def run(args):
+    sweep = {name: list(values) for name, values in PRESETS[args.preset].items()}
+    for assignment in args.set:
+        name, _, values = assignment.partition("=")
+        if name not in DEFAULT_PARAMS:
+            raise SystemExit(f"unknown parameter {name!r}, expected one of {list(DEFAULT_PARAMS)}")
+        sweep[name] = [int(value) for value in values.split(",")]
+
+    stages = args.stages or STAGES
+    results = []
+    for params in parameter_points(sweep):
+        # the fastest of the repeats of every stage, each repeat in its own child process
+        stage_results = None
+        for _ in range(args.repeat):
+            with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+                repeat_results = executor.submit(run_stages, params, stages).result()
+            stage_results = repeat_results if stage_results is None else [
+                min(previous, result, key=lambda r: r["seconds"])
+                for previous, result in zip(stage_results, repeat_results)
+            ]
+
+        print(", ".join(f"{name}={params[name]}" for name in sweep))
+        for result in stage_results:
+            print(f"  {result['stage']:>18} {result['seconds']:9.3f}s {result['items_per_s'] or 0:12.0f} "
+                  f"{result['unit']}/s {result['peak_rss_mib']:8.0f} MiB")
+            results.append({"params": params, **result})
+
+    report = {
+        "repeat": args.repeat, "git": git_revision(), "python": platform.python_version(),
+        "platform": platform.platform(), "cpus": os.cpu_count(), "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=4)
+    print(f"results written to {args.output}")
+
+
+def compare(args):
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+
+    def key(result):
+        return json.dumps(result["params"], sort_keys=True), result["stage"]
+
+    base_results = {key(result): result for result in base["results"]}
+    print(f"base: {base['git']['commit']}, new: {new['git']['commit']}")
+    print(f"{'stage':>18} {'params':>40} {'base s':>9} {'new s':>9} {'ratio':>6} {'RSS ratio':>9}")
+
+    regressions = 0
+    for result in new["results"]:
+        previous = base_results.get(key(result))
+        # stages too short to be timed reliably are skipped
+        if previous is None or max(previous["seconds"], result["seconds"]) < args.min_seconds:
+            continue
+
+        ratio = result["seconds"] / previous["seconds"] if previous["seconds"] else float("inf")
+        rss_ratio = result["peak_rss_mib"] / previous["peak_rss_mib"]
+        regression = ratio > 1 + args.threshold or rss_ratio > 1 + args.threshold
+        regressions += regression
+        params = ",".join(f"{value}" for value in result["params"].values())
+        print(f"{result['stage']:>18} {params:>40} {previous['seconds']:9.3f} {result['seconds']:9.3f} "
+              f"{ratio:6.2f} {rss_ratio:9.2f}{'  <- regression' if regression else ''}")
+
+    print(f"{regressions} regression(s) above {args.threshold:.0%}")
+    # a non-zero exit status lets CI fail on regressions
+    sys.exit(1 if regressions else 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="run the benchmarks")
+    run_parser.add_argument("--preset", choices=PRESETS, default="quick")
+    run_parser.add_argument("--set", action="append", default=[], metavar="NAME=VALUES",
+                            help="sweep a parameter over comma-separated values (repeatable)")
+    run_parser.add_argument("--stages", nargs="+", choices=STAGES, help="stages to run (default: all)")
+    run_parser.add_argument("--repeat", type=int, default=1, help="runs of every point, the fastest is kept")
+    run_parser.add_argument("--output", default="benchmark-results.json")
+    run_parser.set_defaults(function=run)
+
+    compare_parser = commands.add_parser("compare", help="compare two results files")
+    compare_parser.add_argument("base")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument("--threshold", type=float, default=0.1, help="relative slowdown reported")
+    compare_parser.add_argument("--min-seconds", type=float, default=0.05, help="shorter stages are not compared")
+    compare_parser.set_defaults(function=compare)
+
+    args = parser.parse_args()
+    args.function(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,8 @@
 import os
 
 
-# home directory
-HOME = os.path.dirname(os.path.abspath(__file__))
+# home directory (repository root, one level above src/)
+HOME = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
 # data directory
 DATA_DIR = os.path.join(HOME, "data")
@@ -13,12 +13,45 @@ ITALIAN_CITIES_DB_CSV_FILE = os.path.join(DATA_DIR, "it-cities.csv")
 # Selected Cities Distance Matrix CSV file
 CITIES_DISTANCE_MATRIX_CSV_FILE = os.path.join(DATA_DIR, "distance-matrix.csv")
 
+# Selected Cities Distance Matrix binary file (float32 .npy, memory-mapped) and its city-name index sidecar
+CITIES_DISTANCE_MATRIX_NPY_FILE = os.path.join(DATA_DIR, "distance-matrix.npy")
+CITIES_DISTANCE_MATRIX_INDEX_FILE = os.path.join(DATA_DIR, "distance-matrix.cities.json")
+
 # standard routes file
 STD_ROUTES_FILE = os.path.join(DATA_DIR, "standard_routes.json")
 
 # actual routes file
 ACT_ROUTES_FILE = os.path.join(DATA_DIR, "actual_routes.json")
 
+# actual routes file in JSON Lines format (one route per line, written and read as a stream)
+ACT_ROUTES_NDJSON_FILE = os.path.join(DATA_DIR, "actual_routes.ndjson")
+
+# actual routes in a SQLite route store (indexed on the driver, the standard route and the cities of the trips)
+ACT_ROUTES_SQLITE_FILE = os.path.join(DATA_DIR, "actual_routes.sqlite")
+
+# results directory (outputs of the analysis)
+RESULTS_DIR = os.path.join(HOME, "results")
+
+# recommended standard routes file
+REC_STD_ROUTES_FILE = os.path.join(RESULTS_DIR, "recStandard.json")
+
+# drivers' preferred standard routes file
+DRIVERS_FILE = os.path.join(RESULTS_DIR, "drivers.json")
+
+# drivers' perfect routes file
+PERFECT_ROUTES_FILE = os.path.join(RESULTS_DIR, "perfectRoute.json")
+
+# per-route and per-driver compensation files
+COMPENSATION_ROUTES_FILE = os.path.join(RESULTS_DIR, "compensation.ndjson")
+COMPENSATION_DRIVERS_FILE = os.path.join(RESULTS_DIR, "driverCompensation.json")
+
+# cache directory of the intermediate artifacts of the analysis (content-addressed, least recently used evicted first)
+CACHE_DIR = os.path.join(HOME, ".cache")
+CACHE_MAX_BYTES = 1 << 30
+
+# work directory of the sharded per-driver analysis (routes partitioned by driver, results of the shards)
+SHARDS_DIR = os.path.join(HOME, ".shards")
+
 # List of top 50 cities in Italy (from Wikipedia)
 CITIES = [
     "Rome", "Milan", "Naples", "Turin", "Palermo", "Genoa", "Bologna", "Florence",
@@ -65,6 +98,8 @@ SAME_STD_ROUTE_PROB = 0.20  # 10%
 # maximum number of city variations in a route
 MIN_CITY_VARIATIONS_PER_ROUTE = 2
 MAX_CITY_VARIATIONS_PER_ROUTE = 4
+# bound of the attempts of the addition variation (an attempt can keep a trip without adding a city)
+MAX_ADDITION_ATTEMPTS = 4 * MAX_CITY_VARIATIONS_PER_ROUTE
 
 # maximum number of merchandise variations in a trip
 MIN_MERCH_VARIATIONS_PER_ROUTE = 2
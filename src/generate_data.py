@@ -1,33 +1,105 @@
+import argparse
+import contextlib
 import json
-from constants import *
-from src.scripts import generate_standard_routes, generate_actual_routes
+import random
+from src.constants import *
+from tqdm import tqdm
+from src.scripts import (DataContext, iter_actual_routes, iter_standard_routes, set_data_context, write_routes_json,
+                         write_routes_ndjson, write_routes_sqlite)
+from src.scripts.instrumentation import instrumented
+from src.scripts.route_canonical import RouteInterner, format_duplication_stats, intern_routes
 
 
+parser = argparse.ArgumentParser(description="Generate the standard and actual routes datasets.")
+parser.add_argument("--format", choices=["ndjson", "json", "canonical", "sqlite"], default="ndjson",
+                    help="format of the actual routes file (default: ndjson, one route per line; canonical: JSON Lines "
+                         "with each distinct path stored once and the routes as merchandise deltas; sqlite: an indexed "
+                         "SQLite route store)")
+parser.add_argument("--compression", choices=["none", "gzip", "zstd"], default="none",
+                    help="compression of the actual routes file (zstd needs the zstandard package)")
+parser.add_argument("--output", default=None, help="path of the actual routes file (default: in DATA_DIR)")
+parser.add_argument("--seed", type=int, default=None, help="master seed, for reproducible routes")
+parser.add_argument("--workers", type=int, default=None, help="number of worker processes (0 for one per core)")
+parser.add_argument("--report", default=None,
+                    help="path of a JSON report of the generator's counters and timers (enables the instrumentation)")
+parser.add_argument("--profile", choices=["cprofile", "pyinstrument"], default=None,
+                    help="profile the generation (pyinstrument needs the pyinstrument package)")
+parser.add_argument("--profile-output", default=None, help="path of the profile (default: run.prof or run.html)")
+scale = parser.add_argument_group("scale-out", "generate realistic-scale datasets over the cities of a cities database")
+scale.add_argument("--cities-csv", default=None,
+                   help="draw the cities from this cities database (e.g. data/it-cities.csv) instead of CITIES, the "
+                        "neighbours being computed from the coordinates")
+scale.add_argument("--num-cities", type=int, default=None, help="keep only the most populated cities of --cities-csv")
+scale.add_argument("--min-population", type=int, default=0, help="minimum population of the cities of --cities-csv")
+scale.add_argument("--population-weighted", action="store_true",
+                   help="draw the departure and destination cities of the standard routes weighted by population")
+scale.add_argument("--std-routes", type=int, default=NUM_STD_ROUTES, help="number of standard routes")
+scale.add_argument("--drivers", type=int, default=NUM_DRIVERS, help="number of drivers")
+scale.add_argument("--variations", type=int, nargs=2, metavar=("MIN", "MAX"),
+                   default=[MIN_ACT_ROUTE_VARIATIONS_PER_DRIVER, MAX_ACT_ROUTE_VARIATIONS_PER_DRIVER],
+                   help="minimum and maximum number of actual routes per standard route")
+scale.add_argument("--std-output", default=STD_ROUTES_FILE, help="path of the standard routes file")
+args = parser.parse_args()
+
+if args.format == "sqlite" and args.compression != "none":
+    parser.error("--compression does not apply to --format sqlite")
+
+# Use the cities of the cities database, with their neighbours computed on the fly from the coordinates
+if args.cities_csv is not None:
+    set_data_context(DataContext.from_cities_csv(args.cities_csv, args.num_cities, args.min_population,
+                                                 population_weighted=args.population_weighted))
+elif args.population_weighted:
+    set_data_context(DataContext(population_weighted=True))
+
+drivers = DRIVERS if args.drivers == NUM_DRIVERS else [f"D{i}" for i in range(1, args.drivers + 1)]
+
 # # Generate a set of standard routes
-standard_routes = generate_standard_routes(
-    num_routes=NUM_STD_ROUTES, min_trips_=MIN_TRIPS, max_trips_=MAX_TRIPS
-)
+standard_routes = list(tqdm(iter_standard_routes(
+    num_routes=args.std_routes, min_trips_=MIN_TRIPS, max_trips_=MAX_TRIPS,
+    rng=random if args.seed is None else random.Random(args.seed)
+), total=args.std_routes, desc="standard routes", unit=" routes", disable=None))
 
 # Write the generated standard routes to a JSON file
-with open(STD_ROUTES_FILE, "w") as f:
+with open(args.std_output, "w") as f:
     json.dump(standard_routes, f, indent=4)
 
-print("results standard routes and written to {}".format(STD_ROUTES_FILE))
+print("results standard routes and written to {}".format(args.std_output))
+
+# Generate the actual routes as a stream: they are written one by one and never held in memory together
+actual_routes = tqdm(iter_actual_routes(
+    standard_routes_=standard_routes, drivers_=drivers,
+    min_variations_per_driver=args.variations[0], max_variations_per_driver=args.variations[1],
+    seed=args.seed, workers=args.workers
+), desc="actual routes", unit=" routes", unit_scale=True, disable=None)
+
+act_routes_file = args.output
+if act_routes_file is None:
+    act_routes_file = ACT_ROUTES_FILE if args.format == "json" else ACT_ROUTES_NDJSON_FILE
+    if args.format == "sqlite":
+        act_routes_file = ACT_ROUTES_SQLITE_FILE
+    act_routes_file += {"none": "", "gzip": ".gz", "zstd": ".zst"}[args.compression]
 
-# read standard routes from json file
-with open(STD_ROUTES_FILE, "r") as f:
-    standard_routes = json.load(f)
+# Write the generated actual routes to a JSON Lines (or JSON) file, instrumented and profiled when requested
+run = contextlib.nullcontext()
+if args.report is not None or args.profile is not None:
+    run = instrumented(args.profile, args.profile_output, args.report)
 
-# Generate a set of actual routes
-actual_routes = generate_actual_routes(
-    standard_routes_=standard_routes, drivers_=DRIVERS,
-    min_variations_per_driver=MIN_ACT_ROUTE_VARIATIONS_PER_DRIVER,
-    max_variations_per_driver=MAX_ACT_ROUTE_VARIATIONS_PER_DRIVER,
+interner = RouteInterner()
+with run as instrumentation:
+    if args.format == "ndjson":
+        num_actual_routes = write_routes_ndjson(actual_routes, act_routes_file)
+    elif args.format == "canonical":
+        write_routes_ndjson(intern_routes(actual_routes, interner), act_routes_file)
+        num_actual_routes = interner.num_routes
+    elif args.format == "sqlite":
+        num_actual_routes = write_routes_sqlite(actual_routes, act_routes_file)
+    else:
+        num_actual_routes = write_routes_json(actual_routes, act_routes_file)
 
-)
+if instrumentation is not None:
+    print(instrumentation.format_report())
 
-# Write the generated actual routes to a JSON file
-with open(ACT_ROUTES_FILE, "w") as f:
-    json.dump(actual_routes, f, indent=4)
+if args.format == "canonical":
+    print(format_duplication_stats(interner.stats()))
 
-print("results actual routes and written to {}".format(ACT_ROUTES_FILE))
+print("results {} actual routes and written to {}".format(num_actual_routes, act_routes_file))
@@ -0,0 +1,63 @@
+import argparse
+import asyncio
+import json
+import os
+import signal
+from src.constants import *
+from src.scripts.driver_preferences import DriverPreferenceModel
+from src.scripts.ingestion import RouteIngestionService
+from src.scripts.route_io import open_routes_file
+
+
+parser = argparse.ArgumentParser(description="Ingest live actual routes (NDJSON, one route per line).")
+parser.add_argument("--unix", default=None, help="path of a Unix socket to listen on")
+parser.add_argument("--port", type=int, default=None, help="local TCP port to listen on")
+parser.add_argument("--output", default=ACT_ROUTES_NDJSON_FILE, help="NDJSON file the valid routes are appended to")
+parser.add_argument("--preferences", default=None,
+                    help="snapshot of the drivers' preferences, restored at start and saved at the end")
+parser.add_argument("--batch-size", type=int, default=256, help="maximum number of routes per micro-batch")
+parser.add_argument("--batch-interval", type=float, default=0.05, help="maximum wait of a route for its batch (s)")
+parser.add_argument("--queue-size", type=int, default=8192, help="maximum number of routes waiting for a batch")
+args = parser.parse_args()
+
+
+async def main():
+    # the pipeline: the routes are appended to the output file and update the drivers' preferences
+    model = DriverPreferenceModel()
+    if args.preferences is not None and os.path.exists(args.preferences):
+        model = DriverPreferenceModel.restore(args.preferences)
+
+    with open_routes_file(args.output, "a") as output:
+        def sink(routes):
+            output.write("".join(json.dumps(route, separators=(",", ":")) + "\n" for route in routes))
+            model.add_routes(routes)
+
+        service = RouteIngestionService(sink, args.batch_size, args.batch_interval, args.queue_size)
+        await service.start()
+
+        if args.unix is None and args.port is None:
+            # NDJSON from the standard input, until its end
+            await service.serve_stdin()
+        else:
+            if args.unix is not None:
+                await service.serve_unix(args.unix)
+            if args.port is not None:
+                await service.serve_tcp(port=args.port)
+            print("listening, press Ctrl-C to stop")
+
+            # serve until interrupted
+            stop = asyncio.Event()
+            loop = asyncio.get_running_loop()
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                loop.add_signal_handler(sig, stop.set)
+            await stop.wait()
+
+        await service.close()
+
+    if args.preferences is not None:
+        model.snapshot(args.preferences)
+
+    print(json.dumps(service.stats(), indent=4))
+
+
+asyncio.run(main())
@@ -0,0 +1,29 @@
+import argparse
+from src.constants import *
+from src.scripts.artifact_cache import ArtifactCache, load_route_table
+from src.scripts.perfect_route import PerfectRouteSolver, generate_perfect_routes
+from src.scripts.route_io import write_routes_json
+
+
+parser = argparse.ArgumentParser(description="Build the perfect route of every driver from the actual routes.")
+parser.add_argument("--input", default=ACT_ROUTES_FILE,
+                    help="actual routes file (.json, .ndjson, optionally compressed)")
+parser.add_argument("--output", default=PERFECT_ROUTES_FILE, help="perfect routes file")
+parser.add_argument("--beam-width", type=int, default=32, help="partial routes kept at each step of the search")
+parser.add_argument("--time-budget", type=float, default=1.0, help="search time budget per driver, in seconds")
+parser.add_argument("--workers", type=int, default=None, help="number of worker processes (0 for one per core)")
+parser.add_argument("--cache-dir", default=CACHE_DIR, help="cache directory of the intermediate artifacts")
+parser.add_argument("--no-cache", action="store_true", help="recompute everything without reading or writing the cache")
+args = parser.parse_args()
+cache = None if args.no_cache else ArtifactCache(args.cache_dir)
+
+# Load the actual routes as a columnar table, or read it back from the cache when the file did not change
+table = load_route_table(args.input, cache)
+
+# Search the perfect route of every driver whose routes changed since the last run, the drivers being solved in
+# parallel
+solver = PerfectRouteSolver(beam_width=args.beam_width, time_budget=args.time_budget)
+perfect_routes = generate_perfect_routes(table, solver, args.workers, cache)
+num_routes = write_routes_json(perfect_routes, args.output)
+
+print("perfect routes of {} drivers written to {}".format(num_routes, args.output))
@@ -0,0 +1,34 @@
+import argparse
+from src.constants import *
+from src.scripts.artifact_cache import ArtifactCache, load_route_table
+from src.scripts.clustering import CLUSTERING_METHODS, RouteClustering
+from src.scripts.route_canonical import table_duplication_stats
+from src.scripts.route_io import write_routes_json
+
+
+parser = argparse.ArgumentParser(description="Cluster the actual routes into recommended standard routes.")
+parser.add_argument("--input", default=ACT_ROUTES_FILE,
+                    help="actual routes file (.json, .ndjson, optionally compressed)")
+parser.add_argument("--output", default=REC_STD_ROUTES_FILE, help="recommended standard routes file")
+parser.add_argument("--clusters", type=int, default=NUM_STD_ROUTES, help="number of recommended standard routes")
+parser.add_argument("--method", choices=CLUSTERING_METHODS, default="clara",
+                    help="clara (sampled K-Medoids) or minibatch (mini-batch medoid moves on an LSH neighbour graph)")
+parser.add_argument("--seed", type=int, default=0, help="seed of the sampling")
+parser.add_argument("--cache-dir", default=CACHE_DIR, help="cache directory of the intermediate artifacts")
+parser.add_argument("--no-cache", action="store_true", help="recompute everything without reading or writing the cache")
+args = parser.parse_args()
+cache = None if args.no_cache else ArtifactCache(args.cache_dir)
+
+# Load the actual routes as a columnar table (streamed, the route dictionaries are never held together), or read it
+# back from the cache when the file did not change
+table = load_route_table(args.input, cache)
+print("{routes} routes, {unique_paths} distinct paths ({path_duplication_rate:.1%} duplicated)".format(
+    **table_duplication_stats(table)))
+
+# Cluster the routes, the medoids being the recommended standard routes
+clustering = RouteClustering(n_clusters=args.clusters, method=args.method, seed=args.seed,
+                             cache=cache).fit(table)
+num_routes = write_routes_json(clustering.standard_routes(), args.output)
+
+print("clustered {} actual routes (cost {:.2f}) into {} recommended standard routes written to {}".format(
+    len(table), clustering.inertia_, num_routes, args.output))
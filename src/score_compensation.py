@@ -0,0 +1,43 @@
+import argparse
+import json
+from src.constants import *
+from src.scripts.artifact_cache import ArtifactCache, load_route_table
+from src.scripts.compensation import (COMPENSATION_PER_KM, COMPENSATION_PER_UNIT, CompensationScorer,
+                                      driver_compensations, route_compensations)
+from src.scripts.route_canonical import table_duplication_stats
+from src.scripts.route_io import write_routes_ndjson
+
+
+parser = argparse.ArgumentParser(description="Price the deviations of the actual routes from their standard routes.")
+parser.add_argument("--input", default=ACT_ROUTES_FILE,
+                    help="actual routes file (.json, .ndjson, optionally compressed)")
+parser.add_argument("--standard", default=STD_ROUTES_FILE, help="standard routes file")
+parser.add_argument("--output", default=COMPENSATION_ROUTES_FILE, help="per-route compensation file (JSON Lines)")
+parser.add_argument("--drivers-output", default=COMPENSATION_DRIVERS_FILE, help="per-driver compensation file")
+parser.add_argument("--km-rate", type=float, default=COMPENSATION_PER_KM, help="price of a kilometre")
+parser.add_argument("--unit-rate", type=float, default=COMPENSATION_PER_UNIT, help="price of a unit of merchandise")
+parser.add_argument("--workers", type=int, default=None, help="number of worker processes (0 for one per core)")
+parser.add_argument("--cache-dir", default=CACHE_DIR, help="cache directory of the intermediate artifacts")
+parser.add_argument("--no-cache", action="store_true", help="recompute everything without reading or writing the cache")
+args = parser.parse_args()
+cache = None if args.no_cache else ArtifactCache(args.cache_dir)
+
+# Load the actual routes as a columnar table, and the standard routes they vary
+table = load_route_table(args.input, cache)
+print("{routes} routes, {unique_paths} distinct paths ({path_duplication_rate:.1%} duplicated)".format(
+    **table_duplication_stats(table)))
+with open(args.standard, "r") as f:
+    standard_routes = json.load(f)
+
+# Align every actual route with its standard route and price the extra kilometres and the merchandise deltas
+scorer = CompensationScorer(standard_routes, km_rate=args.km_rate, unit_rate=args.unit_rate)
+scores = scorer.score(table, workers=args.workers)
+
+# Write the compensation of every route, then the totals of every driver
+num_routes = write_routes_ndjson(route_compensations(table, scores), args.output)
+drivers = driver_compensations(table, scores)
+with open(args.drivers_output, "w") as f:
+    json.dump(drivers, f, indent=4)
+
+print("compensation of {} routes written to {} and of {} drivers written to {} (total {:.2f})".format(
+    num_routes, args.output, len(drivers), args.drivers_output, sum(driver["compensation"] for driver in drivers)))
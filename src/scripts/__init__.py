@@ -0,0 +1,38 @@
+import importlib
+
+# public names of the submodules, imported on first access so that importing the package itself is cheap
+_EXPORTS = {
+    "DataContext": "data_context",
+    "get_data_context": "data_context",
+    "set_data_context": "data_context",
+    "NeighbourIndex": "neighbours",
+    "get_closest_cities": "gen_routes",
+    "generate_standard_routes": "gen_routes",
+    "iter_standard_routes": "gen_routes",
+    "generate_actual_routes": "gen_routes",
+    "iter_actual_routes": "gen_routes",
+    "create_actual_routes_with_variations_for_std_route": "gen_routes",
+    "RouteIdAllocator": "route_ids",
+    "parse_route_id": "route_ids",
+    "gen_cities_distance_matrix": "utils",
+    "pairwise_distances": "utils",
+    "iter_routes": "route_io",
+    "write_routes_json": "route_io",
+    "write_routes_ndjson": "route_io",
+    "DriverShardRunner": "driver_shards",
+    "RouteStore": "route_store",
+    "write_routes_sqlite": "route_store",
+}
+
+
+def __getattr__(name):
+    try:
+        module = _EXPORTS[name]
+    except KeyError:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}") from None
+
+    return getattr(importlib.import_module(f".{module}", __name__), name)
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_EXPORTS))
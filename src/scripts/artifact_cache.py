@@ -0,0 +1,356 @@
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+
+import numpy as np
+from src.constants import *
+
+
+# routes per block of the route hashes: appending routes to a table only changes the hashes of its last blocks
+ROUTE_BLOCK_SIZE = 4096
+
+# constants the analysis outputs depend on, part of every cache key
+ANALYSIS_CONSTANTS = {
+    "cities": CITIES,
+    "merchandise": MERCHANDISE_TYPES,
+    "drivers": DRIVERS,
+    "merchandise_size": MERCHANDISE_SIZE,
+}
+
+# bumped when the layout or the semantics of the cached artifacts change
+CACHE_VERSION = 1
+
+
+def content_hash(*parts):
+    """
+    Hash values into a hex SHA-256 digest. Numeric arrays are hashed by dtype, shape and bytes, string arrays by their
+    strings and the other values by their canonical JSON representation (sorted keys), so that equal contents always
+    give the same hash.
+
+    :param parts: arrays, bytes, strings or JSON-serializable values
+    :return: the hex digest
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, np.ndarray) and part.dtype.kind in "UO":
+            # strings are joined, the width of the array dtype depending on the other strings of the array
+            encoded = "\0".join(map(str, part.ravel().tolist())).encode("utf-8")
+            digest.update(f"strings:{part.shape}:{len(encoded)}:".encode())
+            digest.update(encoded)
+        elif isinstance(part, np.ndarray):
+            part = np.ascontiguousarray(part)
+            digest.update(f"array:{part.dtype.str}:{part.shape}:".encode())
+            digest.update(part.tobytes())
+        elif isinstance(part, bytes):
+            digest.update(b"bytes:%d:" % len(part))
+            digest.update(part)
+        else:
+            encoded = json.dumps(part, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")
+            digest.update(b"json:%d:" % len(encoded))
+            digest.update(encoded)
+
+    return digest.hexdigest()
+
+
+def file_hash(path, chunk_size=1 << 20):
+    """
+    Hash the content of a file (in chunks, the file is not read in memory).
+
+    :param path: path of the file
+    :param chunk_size: bytes read at a time
+    :return: the hex SHA-256 digest
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def table_block_hashes(table, block_size=ROUTE_BLOCK_SIZE):
+    """
+    Hash the routes of a RouteTable block by block: block b covers the routes [b * block_size, (b + 1) * block_size).
+    A block hash covers its rows of every column and the names its ids refer to, so it does not depend on the
+    routes of the other blocks, and appending routes to the table leaves the hashes of its full blocks unchanged.
+
+    :param table: the RouteTable
+    :param block_size: routes per block
+    :return: list of hex digests, one per block
+    """
+    hashes = []
+    for start in range(0, len(table), block_size):
+        stop = min(start + block_size, len(table))
+        trips = slice(table.trip_offsets[start], table.trip_offsets[stop])
+        merch = slice(table.merch_offsets[table.trip_offsets[start]], table.merch_offsets[table.trip_offsets[stop]])
+        sroutes, drivers = table.sroutes[start:stop], table.drivers[start:stop]
+
+        hashes.append(content_hash(
+            table.ids[start:stop], sroutes, drivers,
+            table.trip_offsets[start:stop + 1] - table.trip_offsets[start], table.trip_from[trips],
+            table.trip_to[trips],
+            table.merch_offsets[table.trip_offsets[start]:table.trip_offsets[stop] + 1] - merch.start,
+            table.merch_items[merch], table.merch_quantities[merch],
+            # the vocabulary entries up to the largest id used (vocabularies only grow by appending)
+            table.cities[:int(max(table.trip_from[trips].max(initial=-1), table.trip_to[trips].max(initial=-1))) + 1],
+            table.merchandise[:int(table.merch_items[merch].max(initial=-1)) + 1],
+            table.sroute_names[:int(sroutes.max(initial=-1)) + 1],
+            table.driver_names[:int(drivers.max(initial=-1)) + 1],
+        ))
+
+    return hashes
+
+
+def table_hash(table, block_hashes=None):
+    """
+    Hash all the routes of a RouteTable.
+
+    :param table: the RouteTable
+    :param block_hashes: its table_block_hashes(), when already computed
+    :return: the hex digest
+    """
+    return content_hash(len(table), block_hashes if block_hashes is not None else table_block_hashes(table))
+
+
+class ArtifactCache:
+    """
+    A content-addressed cache of the intermediate artifacts of the analysis (route tables, assignment blocks, perfect
+    routes ...) on disk. An artifact is stored under a key hashing everything it was computed from: the input routes,
+    the parameters and the analysis constants, so a stale artifact is never returned and there is nothing to
+    invalidate. Artifacts are pickled files <directory>/<kind>/<key>.pkl, written atomically.
+
+    Reading an artifact touches its file, and when the total size exceeds max_bytes the least recently used artifacts
+    are deleted first.
+    """
+
+    def __init__(self, directory=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        """
+        Initialize the ArtifactCache class.
+
+        :param directory: cache directory (created when needed)
+        :param max_bytes: size cap of the cache, in bytes
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._size = None
+
+    def key(self, *parts):
+        """
+        Get the key of an artifact computed from parts (see content_hash()), including the analysis constants.
+
+        :param parts: everything the artifact depends on
+        :return: the key
+        """
+        return content_hash(CACHE_VERSION, ANALYSIS_CONSTANTS, *parts)
+
+    def path(self, kind, key):
+        """
+        Get the path of an artifact file.
+
+        :param kind: kind of artifact (sub-directory), e.g. "assign"
+        :param key: key of the artifact
+        :return: the path
+        """
+        return os.path.join(self.directory, kind, key + ".pkl")
+
+    def get(self, kind, key, default=None):
+        """
+        Get an artifact, marking it as recently used.
+
+        :param kind: kind of artifact
+        :param key: key of the artifact
+        :param default: value returned when the artifact is not cached
+        :return: the artifact or default
+        """
+        path = self.path(kind, key)
+        try:
+            with open(path, "rb") as f:
+                value = pickle.load(f)
+            os.utime(path)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            self.misses += 1
+            return default
+
+        self.hits += 1
+        return value
+
+    def put(self, kind, key, value):
+        """
+        Store an artifact, then evict the least recently used artifacts if the cache exceeds its size cap.
+
+        :param kind: kind of artifact
+        :param key: key of the artifact
+        :param value: the artifact (any picklable value)
+        """
+        path = self.path(kind, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # write to a temporary file renamed over the artifact, so that readers never see a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            previous = os.path.getsize(path) if os.path.exists(path) else 0
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+        self._size = self.size() + os.path.getsize(path) - previous
+        if self._size > self.max_bytes:
+            self.evict()
+
+    def get_or_compute(self, kind, key, compute):
+        """
+        Get an artifact, computing and storing it when it is not cached.
+
+        :param kind: kind of artifact
+        :param key: key of the artifact
+        :param compute: function() computing the artifact
+        :return: the artifact
+        """
+        missing = object()
+        value = self.get(kind, key, missing)
+        if value is missing:
+            value = compute()
+            self.put(kind, key, value)
+
+        return value
+
+    def _entries(self):
+        """
+        List the artifact files as (last use time, size, path) tuples.
+        """
+        entries = []
+        if not os.path.isdir(self.directory):
+            return entries
+
+        for kind in os.scandir(self.directory):
+            if not kind.is_dir():
+                continue
+            for entry in os.scandir(kind.path):
+                if entry.name.endswith(".pkl"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        return entries
+
+    def size(self):
+        """
+        Total size of the artifacts, in bytes (the directory is scanned once, then the size is kept up to date).
+        """
+        if self._size is None:
+            self._size = sum(size for _, size, _ in self._entries())
+
+        return self._size
+
+    def evict(self, max_bytes=None):
+        """
+        Delete the least recently used artifacts until the cache fits in max_bytes.
+
+        :param max_bytes: target size (default: the size cap of the cache)
+        :return: the number of artifacts deleted
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        entries = sorted(self._entries())
+        size = sum(entry_size for _, entry_size, _ in entries)
+
+        deleted = 0
+        for _, entry_size, path in entries:
+            if size <= max_bytes:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            size -= entry_size
+            deleted += 1
+
+        self._size = size
+        return deleted
+
+    def clear(self):
+        """
+        Delete all the artifacts.
+        """
+        self.evict(0)
+
+    def stats(self):
+        """
+        Get the hit and miss counts of this cache instance and the size of the cache.
+
+        :return: dictionary of statistics
+        """
+        return {"hits": self.hits, "misses": self.misses, "bytes": self.size(), "max_bytes": self.max_bytes}
+
+
+def _file_hashes(path, prefix_size, chunk_size=1 << 20):
+    """
+    Hash the content of a file and of its first prefix_size bytes, in one pass.
+
+    :return: (file hex digest, prefix hex digest or None when the file is shorter than prefix_size, size of the file)
+        tuple
+    """
+    digest, prefix_digest, size = hashlib.sha256(), None, 0
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            if size <= prefix_size < size + len(chunk):
+                digest.update(chunk[:prefix_size - size])
+                prefix_digest = digest.hexdigest()
+                digest.update(chunk[prefix_size - size:])
+            else:
+                digest.update(chunk)
+            size += len(chunk)
+
+    if size == prefix_size:
+        prefix_digest = digest.hexdigest()
+
+    return digest.hexdigest(), prefix_digest, size
+
+
+def load_route_table(path, cache=None):
+    """
+    Load a routes file as a RouteTable, the parsed table being cached under the hash of the file content. When routes
+    were appended to an uncompressed JSON Lines file since it was last loaded (the file starts with the content it had
+    then), only the appended lines are parsed.
+
+    :param path: path of the routes file (.json, .ndjson, optionally compressed)
+    :param cache: the ArtifactCache (None to always parse the file)
+    :return: the RouteTable
+    """
+    from .route_canonical import expand_routes
+    from .route_io import iter_routes_ndjson, routes_file_compression
+    from .route_store import is_route_store
+    from .route_table import RouteTable
+
+    if cache is None:
+        return RouteTable.from_file(path)
+
+    # the last table loaded from this path, and the size and hash of the file then
+    index_key = cache.key("table_index", os.path.abspath(path))
+    index = cache.get("table_index", index_key)
+    appendable = routes_file_compression(path) is None and not str(path).endswith(".json") and not is_route_store(path)
+    digest, prefix_digest, size = _file_hashes(path, index["size"] if index and appendable else -1)
+
+    key = cache.key("table", digest)
+    table = cache.get("table", key)
+    if table is None:
+        base = cache.get("table", index["table_key"]) if prefix_digest and prefix_digest == index["hash"] else None
+        if base is not None:
+            try:
+                table = base.concatenate(RouteTable.from_routes(
+                    expand_routes(iter_routes_ndjson(path, offset=index["size"])), cities=base.cities,
+                    merchandise=base.merchandise, sroute_names=base.sroute_names, driver_names=base.driver_names))
+            except ValueError:
+                # appended routes of a canonical file referring to paths stored before the offset
+                base = None
+        if base is None:
+            table = RouteTable.from_file(path)
+        cache.put("table", key, table)
+
+    cache.put("table_index", index_key, {"size": size, "hash": digest, "table_key": key})
+    return table
@@ -0,0 +1,343 @@
+import numpy as np
+
+from src.constants import *
+from .artifact_cache import table_block_hashes, table_hash
+from .route_distance import RouteDistanceKernel
+from .route_similarity import RouteSimilarityIndex
+from .route_table import RouteTable
+
+
+CLUSTERING_METHODS = ("clara", "minibatch")
+
+
+def kernel_route_distance(routes, medoids):
+    """
+    Default route distance of the clustering: the RouteDistanceKernel distance (city-pair Jaccard and merchandise
+    L1). A custom distance must have the same signature.
+
+    :param routes: RouteTable of routes
+    :param medoids: RouteTable of medoids
+    :return: (len(routes), len(medoids)) distance matrix
+    """
+    return RouteDistanceKernel(medoids).distances(routes)
+
+
+def pam(distances, n_clusters, max_iter=100):
+    """
+    Exact K-Medoids (PAM: greedy BUILD, then SWAP until no swap of a medoid with a non-medoid lowers the cost) on a
+    precomputed distance matrix.
+
+    :param distances: (N, N) distance matrix
+    :param n_clusters: number of medoids
+    :param max_iter: maximum number of swaps
+    :return: array of the medoid indices
+    """
+    distances = np.asarray(distances, dtype=np.float64)
+    n = len(distances)
+
+    # BUILD: start from the most central point, then add the point lowering the cost the most
+    medoids = [int(distances.sum(axis=0).argmin())]
+    nearest = distances[:, medoids[0]].copy()
+    for _ in range(1, n_clusters):
+        gains = np.maximum(nearest[:, None] - distances, 0).sum(axis=0)
+        gains[medoids] = -1
+        medoids.append(int(gains.argmax()))
+        nearest = np.minimum(nearest, distances[:, medoids[-1]])
+
+    # SWAP: best (medoid, point) swap of each iteration
+    for _ in range(max_iter):
+        medoid_distances = distances[:, medoids]
+        order = np.argsort(medoid_distances, axis=1)
+        labels = order[:, 0]
+        first = medoid_distances[np.arange(n), labels]
+        second = medoid_distances[np.arange(n), order[:, 1]] if n_clusters > 1 else np.full(n, np.inf)
+
+        best_delta, best_swap = -1e-9 * first.sum(), None
+        for i in range(n_clusters):
+            # the points of medoid i go to their second medoid or to the new point, the others stay or move to it
+            current = np.where(labels == i, second, first)
+            delta = np.minimum(current[:, None], distances).sum(axis=0) - first.sum()
+            delta[medoids] = np.inf
+            h = int(delta.argmin())
+            if delta[h] < best_delta:
+                best_delta, best_swap = delta[h], (i, h)
+
+        if best_swap is None:
+            break
+        medoids[best_swap[0]] = best_swap[1]
+
+    return np.array(medoids)
+
+
+def kmedoids(distances, n_clusters, seed=0):
+    """
+    Exact K-Medoids on a precomputed distance matrix, with sklearn_extra's KMedoids if it can be imported, else pam().
+
+    :param distances: (N, N) distance matrix
+    :param n_clusters: number of medoids
+    :param seed: random state of sklearn_extra's KMedoids
+    :return: array of the medoid indices
+    """
+    try:
+        from sklearn_extra.cluster import KMedoids
+    except (ImportError, ValueError):  # ValueError: built against another numpy
+        return pam(distances, n_clusters)
+
+    model = KMedoids(n_clusters=n_clusters, metric="precomputed", method="pam", init="build", random_state=seed)
+    return model.fit(distances).medoid_indices_
+
+
+class RouteClustering:
+    """
+    K-Medoids clustering of actual routes into recommended standard routes (the medoids), without the full pairwise
+    distance matrix, so that it scales to millions of routes in bounded memory:
+
+    - "clara": exact K-Medoids on num_samples random samples of sample_size routes, keeping the medoids with the
+      lowest cost over all the routes
+    - "minibatch": CLARA on one sample for the initial medoids, then each iteration assigns a random batch of routes
+      to the medoids and moves every medoid to the candidate lowering the cost of its batch routes the most. The
+      candidates of a medoid are its neighbours in a sparse graph over a pool of routes, built with the MinHash
+      LSH forest of RouteSimilarityIndex, so only a few candidate pairs are ever compared
+
+    The cost of a set of medoids is the sum of the distances of the routes to their closest medoid; it is computed
+    chunk by chunk. The route distance is pluggable (see kernel_route_distance()).
+
+    With an ArtifactCache, the clustering of the same routes with the same parameters is read back from the cache, and
+    the assignments of the chunks of routes to a set of medoids are cached under the hash of the chunk, so the chunks
+    left unchanged by appended routes are not assigned again to medoids they were already assigned to.
+    """
+
+    def __init__(self, n_clusters=NUM_STD_ROUTES, method="clara", distance=kernel_route_distance, num_samples=5,
+                 sample_size=None, batch_size=4096, pool_size=10000, num_neighbours=16, max_iter=20,
+                 chunk_size=4096, seed=0, cache=None):
+        """
+        Initialize the RouteClustering class.
+
+        :param n_clusters: number of clusters (recommended standard routes)
+        :param method: "clara" or "minibatch"
+        :param distance: function(routes, medoids) of two RouteTables returning their distance matrix
+        :param num_samples: number of CLARA samples
+        :param sample_size: routes per CLARA sample (default: 40 + 10 * n_clusters)
+        :param batch_size: routes per mini-batch
+        :param pool_size: routes of the mini-batch candidate pool (and of its neighbour graph)
+        :param num_neighbours: neighbours of each route in the candidate graph
+        :param max_iter: maximum number of mini-batch iterations
+        :param chunk_size: routes per chunk when assigning all the routes
+        :param seed: seed of the sampling
+        :param cache: ArtifactCache of the clusterings and chunk assignments (None to disable caching)
+        """
+        if method not in CLUSTERING_METHODS:
+            raise ValueError(f"unknown clustering method {method!r}, expected one of {CLUSTERING_METHODS}")
+
+        self.n_clusters = n_clusters
+        self.method = method
+        self.distance = distance
+        self.num_samples = num_samples
+        self.sample_size = sample_size or 40 + 10 * n_clusters
+        self.batch_size = batch_size
+        self.pool_size = pool_size
+        self.num_neighbours = num_neighbours
+        self.max_iter = max_iter
+        self.chunk_size = chunk_size
+        self.seed = seed
+        self.cache = cache
+
+        self.table = None
+        self._chunk_hashes = None
+        self.medoid_indices_ = None
+        self.labels_ = None
+        self.inertia_ = None
+
+    def assign(self, table, medoids):
+        """
+        Assign routes to their closest medoid, chunk by chunk.
+
+        :param table: RouteTable of the routes
+        :param medoids: RouteTable of the medoids
+        :return: (labels, distances) arrays
+        """
+        labels = np.empty(len(table), dtype=np.int64)
+        distances = np.empty(len(table), dtype=np.float64)
+        # only the chunks of the clustered table are cached, not the ones of the mini-batches
+        cached = self.cache is not None and table is self.table
+        if cached:
+            medoids_hash = table_hash(medoids)
+
+        # the distance to the medoids is only prepared (e.g. the medoids encoded by the kernel) for the first chunk not
+        # read from the cache, then shared by all the chunks
+        medoid_distance = None
+
+        def assign_chunk(start, stop):
+            nonlocal medoid_distance
+            if medoid_distance is None:
+                medoid_distance = self._medoid_distance(medoids)
+            return self._assign_chunk(table, medoid_distance, start, stop)
+
+        for chunk, start in enumerate(range(0, len(table), self.chunk_size)):
+            stop = min(start + self.chunk_size, len(table))
+            if cached:
+                key = self.cache.key("assign", self._distance_name(), self._chunk_hashes[chunk], medoids_hash)
+                labels[start:stop], distances[start:stop] = self.cache.get_or_compute(
+                    "assign", key, lambda: assign_chunk(start, stop))
+            else:
+                labels[start:stop], distances[start:stop] = assign_chunk(start, stop)
+
+        return labels, distances
+
+    def _medoid_distance(self, medoids):
+        """
+        Get the function of routes giving their distance matrix to a set of medoids. With the default distance, the
+        RouteDistanceKernel of the medoids is built once and reused for every chunk of routes.
+        """
+        if self.distance is kernel_route_distance:
+            return RouteDistanceKernel(medoids).distances
+
+        return lambda routes: self.distance(routes, medoids)
+
+    def _assign_chunk(self, table, medoid_distance, start, stop):
+        """
+        Assign the routes [start, stop) of a table to their closest medoid.
+        """
+        block = medoid_distance(table.select(np.arange(start, stop)))
+        labels = block.argmin(axis=1)
+
+        return labels, block[np.arange(stop - start), labels]
+
+    def _distance_name(self):
+        """
+        Qualified name of the distance function, part of the cache keys.
+        """
+        module = getattr(self.distance, "__module__", "")
+        return f"{module}.{getattr(self.distance, '__qualname__', repr(self.distance))}"
+
+    def _params(self):
+        """
+        Parameters of the clustering, part of the cache keys.
+        """
+        return {
+            "n_clusters": self.n_clusters, "method": self.method, "distance": self._distance_name(),
+            "num_samples": self.num_samples, "sample_size": self.sample_size, "batch_size": self.batch_size,
+            "pool_size": self.pool_size, "num_neighbours": self.num_neighbours, "max_iter": self.max_iter,
+            "chunk_size": self.chunk_size, "seed": self.seed,
+        }
+
+    def fit(self, routes):
+        """
+        Cluster routes.
+
+        :param routes: RouteTable or iterable of route dictionaries
+        :return: self
+        """
+        table = routes if isinstance(routes, RouteTable) else RouteTable.from_routes(routes)
+        if len(table) < self.n_clusters:
+            raise ValueError(f"{len(table)} routes cannot make {self.n_clusters} clusters")
+
+        self.table = table
+        if self.cache is None:
+            self.medoid_indices_, self.labels_, self.inertia_ = self._fit(table)
+            return self
+
+        self._chunk_hashes = table_block_hashes(table, self.chunk_size)
+        key = self.cache.key("clustering", self._params(), table_hash(table, self._chunk_hashes))
+        self.medoid_indices_, self.labels_, self.inertia_ = self.cache.get_or_compute(
+            "clustering", key, lambda: self._fit(table))
+
+        return self
+
+    def _fit(self, table):
+        """
+        Cluster the routes of a table.
+
+        :return: (medoid indices, labels, inertia) tuple
+        """
+        rng = np.random.default_rng(self.seed)
+        if self.method == "clara":
+            medoids = self._clara(table, rng, self.num_samples)
+        else:
+            medoids = self._minibatch(table, rng)
+
+        labels, distances = self.assign(table, table.select(medoids))
+
+        return medoids, labels, float(distances.sum())
+
+    def _clara(self, table, rng, num_samples):
+        """
+        Get the medoids of the best of num_samples CLARA samples.
+        """
+        best_cost, best_medoids = np.inf, None
+        for _ in range(num_samples):
+            sample = np.sort(rng.choice(len(table), min(len(table), self.sample_size), replace=False))
+            sample_table = table.select(sample)
+            medoids = sample[kmedoids(self.distance(sample_table, sample_table), self.n_clusters, self.seed)]
+
+            cost = self.assign(table, table.select(medoids))[1].sum()
+            if cost < best_cost:
+                best_cost, best_medoids = cost, medoids
+
+        return best_medoids
+
+    def _minibatch(self, table, rng):
+        """
+        Get the medoids with mini-batch medoid moves along the LSH neighbour graph of a candidate pool.
+        """
+        # the pool always contains the initial medoids
+        medoids = self._clara(table, rng, 1)
+        others = np.setdiff1d(np.arange(len(table)), medoids)
+        pool = np.concatenate([medoids, rng.choice(others, min(len(others), self.pool_size), replace=False)])
+        graph = self.neighbour_graph(table.select(pool))
+        medoids = np.arange(self.n_clusters)  # positions in the pool
+
+        for _ in range(self.max_iter):
+            batch = table.select(np.sort(rng.choice(len(table), min(len(table), self.batch_size), replace=False)))
+            labels = self.assign(batch, table.select(pool[medoids]))[0]
+
+            moved = False
+            for cluster in range(self.n_clusters):
+                members = np.flatnonzero(labels == cluster)
+                if not len(members):
+                    continue
+
+                # the current medoid first, then its neighbours that are not medoids already
+                neighbours = graph[medoids[cluster]]
+                neighbours = neighbours[(neighbours >= 0) & ~np.isin(neighbours, medoids)]
+                candidates = np.concatenate([[medoids[cluster]], neighbours])
+                costs = self.distance(batch.select(members), table.select(pool[candidates])).sum(axis=0)
+                best = int(costs.argmin())
+                if costs[best] < costs[0]:
+                    medoids[cluster], moved = candidates[best], True
+
+            if not moved:
+                break
+
+        return pool[medoids]
+
+    def neighbour_graph(self, table):
+        """
+        Build the sparse neighbour graph of routes with the MinHash LSH forest: the num_neighbours most similar
+        routes of each route.
+
+        :param table: RouteTable of the routes
+        :return: (N, num_neighbours) array of route indices, -1 where a route has fewer neighbours
+        """
+        index = RouteSimilarityIndex()
+        signatures = [index.minhash(table.route(i)) for i in range(len(table))]
+        for i, minhash in enumerate(signatures):
+            index.add(i, minhash=minhash)
+
+        graph = np.full((len(table), self.num_neighbours), -1, dtype=np.int64)
+        for i, minhash in enumerate(signatures):
+            neighbours = [key for key, _ in index.query(minhash=minhash, k=self.num_neighbours + 1) if key != i]
+            graph[i, :len(neighbours[:self.num_neighbours])] = neighbours[:self.num_neighbours]
+
+        return graph
+
+    def standard_routes(self):
+        """
+        Get the recommended standard routes in the results/recStandard.json schema, one per cluster.
+
+        :return: list of {"id": "s<label>", "route": [trips...]} dictionaries
+        """
+        return [
+            {"id": f"s{label}", "route": self.table.route(int(medoid))["route"]}
+            for label, medoid in enumerate(self.medoid_indices_)
+        ]
@@ -0,0 +1,392 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from src.constants import *
+from .data_context import get_data_context
+from .route_canonical import table_path_ids
+from .route_table import RouteTable
+
+
+# price of a kilometre driven more (or saved) than on the standard route
+COMPENSATION_PER_KM = 0.5
+
+# price of a unit of merchandise delivered differently from the standard route
+COMPENSATION_PER_UNIT = 0.2
+
+# alignment operations, in the order of the operation counts of summarize_alignment()
+ALIGNMENT_OPERATIONS = ("matched", "substituted", "omitted", "added")
+
+
+def align_trips(std_trips, act_trips):
+    """
+    Align the trips of an actual route with the trips of its standard route (Needleman-Wunsch, minimum cost): a trip
+    can be matched with an identical trip (cost 0), substituted by a trip sharing one of its cities (cost 1) or by
+    any other trip (cost 2), omitted (cost 1) or added (cost 1). A replaced city gives two substitutions, an omitted
+    city a substitution and an omission, a detour a substitution and an addition.
+
+    :param std_trips: the (from, to) city ids of the trips of the standard route
+    :param act_trips: the (from, to) city ids of the trips of the actual route
+    :return: list of (standard trip index, actual trip index) pairs in route order, None on the omitted or added side
+    """
+    n, m = len(std_trips), len(act_trips)
+
+    # costs[i][j]: cost of aligning the first i standard trips with the first j actual trips
+    costs = [[j for j in range(m + 1)]]
+    for i in range(1, n + 1):
+        row = [i]
+        std_from, std_to = std_trips[i - 1]
+        previous = costs[i - 1]
+        for j in range(1, m + 1):
+            act_from, act_to = act_trips[j - 1]
+            substitution = (std_from != act_from) + (std_to != act_to)
+            row.append(min(previous[j - 1] + substitution, previous[j] + 1, row[j - 1] + 1))
+        costs.append(row)
+
+    # trace back, preferring matches and substitutions
+    pairs = []
+    i, j = n, m
+    while i or j:
+        if i and j:
+            substitution = (std_trips[i - 1][0] != act_trips[j - 1][0]) + (std_trips[i - 1][1] != act_trips[j - 1][1])
+            if costs[i][j] == costs[i - 1][j - 1] + substitution:
+                i, j = i - 1, j - 1
+                pairs.append((i, j))
+                continue
+        if i and costs[i][j] == costs[i - 1][j] + 1:
+            i -= 1
+            pairs.append((i, None))
+        else:
+            j -= 1
+            pairs.append((None, j))
+
+    pairs.reverse()
+    return pairs
+
+
+def summarize_alignment(pairs, std_trips, act_trips):
+    """
+    Summarize an alignment of trips for the pricing.
+
+    :param pairs: the alignment pairs (see align_trips())
+    :param std_trips: the (from, to) city ids of the trips of the standard route
+    :param act_trips: the (from, to) city ids of the trips of the actual route
+    :return: (standard trip index of every actual trip, -1 for the added trips, indices of the omitted standard trips,
+        operation counts in the order of ALIGNMENT_OPERATIONS) tuple
+    """
+    targets, omitted = [-1] * len(act_trips), []
+    matched = substituted = 0
+    for i, j in pairs:
+        if j is None:
+            omitted.append(i)
+        elif i is not None:
+            targets[j] = i
+            if std_trips[i] == act_trips[j]:
+                matched += 1
+            else:
+                substituted += 1
+
+    return tuple(targets), tuple(omitted), (matched, substituted, len(omitted), targets.count(-1))
+
+
+def city_distance_matrix(cities):
+    """
+    Get the distances in km between cities, from the dense distance matrix of the data context when it holds all the
+    cities, else computed from their coordinates.
+
+    :param cities: the N city names
+    :return: (N, N) float64 array, 0 on the diagonal
+    """
+    data_context = get_data_context()
+    context_ids = {city: i for i, city in enumerate(data_context.cities)}
+    if data_context.matrix_path is not None and all(city in context_ids for city in cities):
+        ids = [context_ids[city] for city in cities]
+        matrix = np.asarray(data_context.matrix, dtype=np.float64)[np.ix_(ids, ids)]
+    else:
+        from .utils import get_cities_coordinates, pairwise_distances
+
+        matrix = pairwise_distances(get_cities_coordinates(cities, data_context.cities_df))
+
+    matrix = np.array(matrix, dtype=np.float64)
+    np.fill_diagonal(matrix, 0)
+    return matrix
+
+
+class CompensationScorer:
+    """
+    Price the deviations of actual routes from their standard routes. Every actual route is aligned trip by trip with
+    its standard route (align_trips()), then priced:
+
+    - extra_km: km of the actual route minus km of the standard route (negative when the driver saved kilometres),
+      summed over the trips from the distance matrix, vectorized over all the routes
+    - merchandise_delta: units of merchandise delivered differently, i.e. the quantity differences of the matched and
+      substituted trips plus the whole merchandise of the omitted and added trips
+    - compensation: km_rate * extra_km + unit_rate * merchandise_delta
+
+    The alignment only depends on the cities of the standard route and of the actual route, and the same variations
+    are generated again and again (SAME_VARIED_ROUTE_PROB), so the routes are grouped by (standard route, path) pair
+    (route_canonical.table_path_ids()) and aligned once per pair, the alignments being also cached per pair across
+    the chunks of routes.
+    """
+
+    def __init__(self, standard_routes, km_rate=COMPENSATION_PER_KM, unit_rate=COMPENSATION_PER_UNIT,
+                 cache_size=100000):
+        """
+        Initialize the CompensationScorer class.
+
+        :param standard_routes: the standard routes (list of {"id", "route"} dictionaries)
+        :param km_rate: price of a kilometre
+        :param unit_rate: price of a unit of merchandise
+        :param cache_size: maximum number of cached alignments (per process, 0 to disable the cache)
+        """
+        self.standard_routes = {route["id"]: route["route"] for route in standard_routes}
+        self.km_rate = km_rate
+        self.unit_rate = unit_rate
+        self.cache_size = cache_size
+        self._alignments = {}
+
+    def __getstate__(self):
+        # the alignment cache is not sent to the worker processes
+        state = self.__dict__.copy()
+        state["_alignments"] = {}
+        return state
+
+    def align(self, sroute, std_trips, act_trips):
+        """
+        Align the trips of an actual route with the trips of its standard route, with the alignment cache.
+
+        :param sroute: id of the standard route
+        :param std_trips: the (from, to) city ids of the trips of the standard route
+        :param act_trips: the (from, to) city ids of the trips of the actual route, as a tuple
+        :return: (standard trip index of every actual trip, -1 for the added trips, indices of the omitted standard
+            trips, operation counts in the order of ALIGNMENT_OPERATIONS) tuple
+        """
+        if not self.cache_size:
+            return summarize_alignment(align_trips(std_trips, act_trips), std_trips, act_trips)
+
+        key = (sroute, act_trips)
+        try:
+            return self._alignments[key]
+        except KeyError:
+            pass
+
+        if len(self._alignments) >= self.cache_size:
+            # evict the oldest alignment (dictionaries keep the insertion order)
+            del self._alignments[next(iter(self._alignments))]
+
+        alignment = self._alignments[key] = summarize_alignment(align_trips(std_trips, act_trips), std_trips,
+                                                                act_trips)
+        return alignment
+
+    def _standard_trips(self, table):
+        """
+        Get the trips of the standard routes of a table, extending the city and merchandise vocabularies of the table
+        with the names it does not know.
+
+        :return: ({standard route id: ((from, to) city ids of its trips, index of its first trip)}, (S + 1, M) dense
+            merchandise quantities of the S standard trips with a last row of zeros, city names, merchandise names)
+            tuple
+        """
+        city2id, merchandise2id = dict(table.city2id), dict(table.merchandise2id)
+        standard_trips, trip_merchandise = {}, []
+        for sroute in table.sroute_names:
+            trips = self.standard_routes.get(sroute)
+            if trips is None:
+                raise ValueError(f"unknown standard route {sroute!r}")
+            standard_trips[sroute] = (
+                [(city2id.setdefault(trip["from"], len(city2id)), city2id.setdefault(trip["to"], len(city2id)))
+                 for trip in trips],
+                len(trip_merchandise),
+            )
+            trip_merchandise.extend(
+                {merchandise2id.setdefault(item, len(merchandise2id)): quantity
+                 for item, quantity in trip["merchandise"].items()}
+                for trip in trips
+            )
+
+        std_merchandise = np.zeros((len(trip_merchandise) + 1, len(merchandise2id)), dtype=np.int64)
+        for t, merchandise in enumerate(trip_merchandise):
+            std_merchandise[t, list(merchandise)] = list(merchandise.values())
+
+        return standard_trips, std_merchandise, _names(city2id), _names(merchandise2id)
+
+    def score_alignments(self, table, standard_trips, std_merchandise):
+        """
+        Align every route of a table with its standard route and compute its merchandise delta, the quantities being
+        compared with array operations over all the trips once the trips are aligned.
+
+        :param table: RouteTable of actual routes
+        :param standard_trips: the standard trips (see _standard_trips())
+        :param std_merchandise: the merchandise of the standard trips (see _standard_trips())
+        :return: ((R,) merchandise deltas, (R, 4) operation counts in the order of ALIGNMENT_OPERATIONS) arrays
+        """
+        from scipy.sparse import csr_matrix
+
+        # one alignment per distinct (standard route, path) pair, shared by all the routes following the same cities
+        path_ids, _ = table_path_ids(table)
+        keys = table.sroutes.astype(np.int64) * (int(path_ids.max(initial=0)) + 1) + path_ids
+        _, representatives, pair_index = np.unique(keys, return_index=True, return_inverse=True)
+        pair_index = pair_index.reshape(-1)
+
+        trip_offsets, trip_from, trip_to = table.trip_offsets.tolist(), table.trip_from.tolist(), table.trip_to.tolist()
+        sroutes, std_totals = table.sroutes.tolist(), std_merchandise.sum(axis=1)
+        pair_targets, pair_offsets, pair_first_trips, pair_operations, pair_omitted = [], [0], [], [], []
+        no_operations = (0,) * len(ALIGNMENT_OPERATIONS)
+        for r in representatives.tolist():
+            start, stop = trip_offsets[r], trip_offsets[r + 1]
+            if sroutes[r] < 0:
+                route_targets, first_trip, counts, omitted_total = [-1] * (stop - start), 0, no_operations, 0
+            else:
+                sroute = table.sroute_names[sroutes[r]]
+                std_trips, first_trip = standard_trips[sroute]
+                route_targets, omitted, counts = self.align(sroute, std_trips, tuple(zip(trip_from[start:stop],
+                                                                                         trip_to[start:stop])))
+                omitted_total = sum(std_totals[first_trip + i] for i in omitted)
+
+            pair_targets.extend(route_targets)
+            pair_offsets.append(len(pair_targets))
+            pair_first_trips.append(first_trip)
+            pair_operations.append(counts)
+            pair_omitted.append(omitted_total)
+
+        # standard trip of every actual trip (the targets of its pair at the same position), the row of zeros for the
+        # added trips
+        route_index = table.trip_route_index()
+        trip_pairs = pair_index[route_index]
+        positions = np.arange(table.num_trips) - table.trip_offsets[route_index]
+        targets = np.array(pair_targets, dtype=np.int64)[np.array(pair_offsets[:-1], dtype=np.int64)[trip_pairs]
+                                                         + positions]
+        targets = np.where(targets >= 0, targets + np.array(pair_first_trips, dtype=np.int64)[trip_pairs],
+                           len(std_merchandise) - 1)
+
+        act_merchandise = csr_matrix((table.merch_quantities, table.merch_items, table.merch_offsets),
+                                     shape=(table.num_trips, std_merchandise.shape[1])).toarray()
+        trip_delta = np.abs(act_merchandise - std_merchandise[targets]).sum(axis=1)
+        merchandise_delta = (np.bincount(route_index, weights=trip_delta, minlength=len(table)).astype(np.int64)
+                             + np.array(pair_omitted, dtype=np.int64)[pair_index])
+        merchandise_delta[table.sroutes < 0] = 0
+
+        operations = np.array(pair_operations, dtype=np.int32).reshape(-1, len(ALIGNMENT_OPERATIONS))
+        return merchandise_delta, operations[pair_index]
+
+    def score(self, routes, workers=None, chunk_size=50000):
+        """
+        Score actual routes.
+
+        :param routes: RouteTable or iterable of actual routes
+        :param workers: number of worker processes aligning the routes (default: 1, 0 for one per CPU core)
+        :param chunk_size: routes per task of the worker processes
+        :return: dictionary of (R,) arrays: extra_km, merchandise_delta, compensation and one array per alignment
+            operation (see ALIGNMENT_OPERATIONS)
+        """
+        table = routes if isinstance(routes, RouteTable) else RouteTable.from_routes(routes)
+        if workers is None:
+            workers = 1
+        elif workers == 0:
+            workers = os.cpu_count() or 1
+
+        standard_trips, std_merchandise, cities, _ = self._standard_trips(table)
+
+        # kilometres of the actual routes and of their standard routes, vectorized over all the trips
+        km = city_distance_matrix(cities)
+        route_km = np.bincount(table.trip_route_index(), weights=km[table.trip_from, table.trip_to],
+                               minlength=len(table))
+        sroute_km = np.array([sum(km[a, b] for a, b in standard_trips[sroute][0]) for sroute in table.sroute_names]
+                             + [np.nan])
+        extra_km = route_km - sroute_km[table.sroutes]
+
+        # alignments, in chunks of routes split between the worker processes
+        chunks = [np.arange(start, min(start + chunk_size, len(table))) for start in range(0, len(table), chunk_size)]
+        if workers == 1 or len(chunks) <= 1:
+            results = [self.score_alignments(table.select(chunk), standard_trips, std_merchandise)
+                       for chunk in chunks]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(_score_alignments, [
+                    (self, table.select(chunk), standard_trips, std_merchandise) for chunk in chunks
+                ]))
+
+        merchandise_delta = np.concatenate([delta for delta, _ in results] or [np.zeros(0, dtype=np.int64)])
+        operations = np.concatenate([counts for _, counts in results]
+                                    or [np.zeros((0, len(ALIGNMENT_OPERATIONS)), dtype=np.int32)])
+
+        scores = {
+            "extra_km": extra_km,
+            "merchandise_delta": merchandise_delta,
+            "compensation": self.km_rate * extra_km + self.unit_rate * merchandise_delta,
+        }
+        scores.update({operation: operations[:, k] for k, operation in enumerate(ALIGNMENT_OPERATIONS)})
+        return scores
+
+
+def _score_alignments(args):
+    """
+    Align a chunk of routes (run in the worker processes).
+    """
+    scorer, table, standard_trips, std_merchandise = args
+    return scorer.score_alignments(table, standard_trips, std_merchandise)
+
+
+def _names(vocabulary):
+    """
+    Names of an interning dictionary (name -> id), indexed by id.
+    """
+    names = [None] * len(vocabulary)
+    for name, i in vocabulary.items():
+        names[i] = name
+
+    return names
+
+
+def route_compensations(table, scores):
+    """
+    Iterate over the compensation of every route.
+
+    :param table: RouteTable of the actual routes
+    :param scores: the scores of the routes (see CompensationScorer.score())
+    :return: generator of {"id", "driver", "sroute", "extra_km", "merchandise_delta", "compensation", <operation>...}
+        dictionaries
+    """
+    for r in range(len(table)):
+        if table.sroutes[r] < 0:
+            continue
+        yield {
+            "id": str(table.ids[r]),
+            "driver": table.driver_names[table.drivers[r]] if table.drivers[r] >= 0 else None,
+            "sroute": table.sroute_names[table.sroutes[r]],
+            "extra_km": round(float(scores["extra_km"][r]), 3),
+            "merchandise_delta": int(scores["merchandise_delta"][r]),
+            "compensation": round(float(scores["compensation"][r]), 2),
+            **{operation: int(scores[operation][r]) for operation in ALIGNMENT_OPERATIONS},
+        }
+
+
+def driver_compensations(table, scores):
+    """
+    Sum the compensations of the routes of every driver.
+
+    :param table: RouteTable of the actual routes
+    :param scores: the scores of the routes (see CompensationScorer.score())
+    :return: list of {"driver", "routes", "extra_km", "merchandise_delta", "compensation"} dictionaries, in the order
+        of DRIVERS (then of the names of the other drivers)
+    """
+    mask = (table.drivers >= 0) & (table.sroutes >= 0)
+    drivers = table.drivers[mask]
+    num_drivers = len(table.driver_names)
+
+    def total(values):
+        return np.bincount(drivers, weights=values[mask], minlength=num_drivers)
+
+    routes, extra_km = np.bincount(drivers, minlength=num_drivers), total(scores["extra_km"])
+    merchandise_delta, compensation = total(scores["merchandise_delta"]), total(scores["compensation"])
+
+    order = {driver: i for i, driver in enumerate(DRIVERS)}
+    return [
+        {
+            "driver": table.driver_names[d], "routes": int(routes[d]), "extra_km": round(float(extra_km[d]), 3),
+            "merchandise_delta": int(merchandise_delta[d]), "compensation": round(float(compensation[d]), 2),
+        }
+        for d in sorted(np.flatnonzero(routes).tolist(),
+                        key=lambda d: (order.get(table.driver_names[d], len(order)), table.driver_names[d]))
+    ]
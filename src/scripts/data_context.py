@@ -0,0 +1,224 @@
+import os
+from functools import cached_property
+
+import numpy as np
+
+from src.constants import *
+
+
+# number of neighbours kept per city by the BallTree index when there is no dense distance matrix
+DEFAULT_NEIGHBOURS_K = 32
+
+
+class DataContext:
+    """
+    The city data used by the route generator: the cities database, the distance matrix and the neighbour index.
+    Nothing is read when the context is created; every piece is loaded on first access and then cached, so importing
+    the modules that use it costs nothing. Call warm() before forking worker processes so that they inherit the
+    loaded data (the distance matrix is memory-mapped and shared through the page cache).
+
+    Worker pools set the context of their workers with set_data_context() as initializer. Only the construction
+    arguments of a context are pickled, so with the spawn start method the workers get the same cities and files and
+    load the data again on first access.
+    """
+
+    def __init__(self, cities=None, cities_csv=ITALIAN_CITIES_DB_CSV_FILE, matrix_path=CITIES_DISTANCE_MATRIX_NPY_FILE,
+                 matrix_csv_path=CITIES_DISTANCE_MATRIX_CSV_FILE, neighbours_k=None, population_weighted=False):
+        """
+        Initialize the DataContext class.
+
+        :param cities: the cities routes are generated over (default: CITIES)
+        :param cities_csv: path of the cities database CSV file (city, lat, lng, ... columns)
+        :param matrix_path: path of the binary distance matrix; None to work without a dense matrix, in which case
+                            the neighbour index is built from the coordinates with a BallTree
+        :param matrix_csv_path: path of the CSV distance matrix imported when the binary one does not exist yet
+        :param neighbours_k: number of neighbours kept per city (default: all of them with a dense matrix,
+                             DEFAULT_NEIGHBOURS_K without)
+        :param population_weighted: whether the departure and destination cities of the standard routes are drawn
+                                    with probabilities proportional to the population of the cities
+        """
+        self.cities = list(CITIES if cities is None else cities)
+        self.cities_csv = cities_csv
+        self.matrix_path = matrix_path
+        self.matrix_csv_path = matrix_csv_path
+        self.neighbours_k = neighbours_k
+        self.population_weighted = population_weighted
+
+    def __getstate__(self):
+        # the cached data is left out, see the class docstring
+        return {name: value for name, value in self.__dict__.items()
+                if not isinstance(getattr(type(self), name, None), cached_property)}
+
+    @classmethod
+    def from_cities_csv(cls, cities_csv=ITALIAN_CITIES_DB_CSV_FILE, num_cities=None, min_population=0,
+                        neighbours_k=None, population_weighted=False):
+        """
+        Create a data context over the cities of a cities database CSV file instead of CITIES, e.g. to generate
+        realistic-scale datasets. There is no dense distance matrix: the neighbour index is built from the coordinates
+        with a BallTree.
+
+        :param cities_csv: path of the cities database CSV file (city, lat, lng and population columns)
+        :param num_cities: number of cities kept, the most populated first (default: all of them)
+        :param min_population: minimum population of the cities kept
+        :param neighbours_k: number of neighbours kept per city (default: DEFAULT_NEIGHBOURS_K)
+        :param population_weighted: see __init__()
+        :return: the data context
+        """
+        import pandas as pd
+
+        cities_df = pd.read_csv(cities_csv).drop_duplicates("city")
+        cities_df = cities_df[cities_df["population"].fillna(0) >= min_population]
+        cities = cities_df.sort_values("population", ascending=False, kind="stable")["city"].tolist()[:num_cities]
+        if len(cities) < 2:
+            raise ValueError(f"{cities_csv} has {len(cities)} cities with a population of at least {min_population}, "
+                             f"routes need at least 2")
+
+        return cls(cities=cities, cities_csv=cities_csv, matrix_path=None, matrix_csv_path=None,
+                   neighbours_k=neighbours_k, population_weighted=population_weighted)
+
+    @cached_property
+    def cities_df(self):
+        """
+        The cities database as a pandas dataframe.
+        """
+        import pandas as pd
+
+        cities_df = pd.read_csv(self.cities_csv)
+
+        # rename so that the column names are shorter and comply with PEP-8
+        cities_df.rename(
+            columns={"CountryName": "Country", "CapitalName": "capital", "CapitalLatitude": "lat",
+                     "CapitalLongitude": "lon", "CountryCode": "code", "ContinentName": "continent"},
+            inplace=True
+        )
+
+        return cities_df
+
+    @cached_property
+    def coordinates(self):
+        """
+        The (lat, lng) coordinates of the cities as a (N, 2) array, in the order of self.cities.
+        """
+        from .utils import get_cities_coordinates
+
+        return get_cities_coordinates(self.cities, self.cities_df)
+
+    @cached_property
+    def city_cum_weights(self):
+        """
+        The cumulative population weights of the cities, in the order of self.cities, for random.choices(); None when
+        the cities are drawn uniformly. Cities without a population count as the least populated one.
+        """
+        if not self.population_weighted:
+            return None
+
+        population = self.cities_df.drop_duplicates("city").set_index("city")["population"].reindex(self.cities)
+        population = population.fillna(population.min()).clip(lower=1).to_numpy(dtype=np.float64)
+
+        return np.cumsum(population).tolist()
+
+    @cached_property
+    def matrix(self):
+        """
+        The dense (N, N) distance matrix in km, memory-mapped from the binary store. If the binary store does not exist
+        it is imported from the CSV file, or generated from the coordinates when there is no CSV file either.
+        """
+        from .distance_store import import_distance_matrix_csv, load_distance_matrix, save_distance_matrix
+        from .utils import gen_cities_distance_matrix
+
+        if self.matrix_path is None:
+            raise ValueError("This data context has no dense distance matrix (matrix_path=None)")
+
+        if not os.path.exists(self.matrix_path):
+            if self.matrix_csv_path is not None and os.path.exists(self.matrix_csv_path):
+                print(f"Importing the distance matrix from {self.matrix_csv_path}...")
+                matrix, cities = import_distance_matrix_csv(self.matrix_csv_path, self.cities)
+                save_distance_matrix(matrix, cities, self.matrix_path)
+            else:
+                print("The distance matrix does not exist. Generating a new one...")
+                gen_cities_distance_matrix(self.cities, cities_df=self.cities_df, matrix_path=self.matrix_path,
+                                           csv_path=self.matrix_csv_path)
+
+        matrix, _ = load_distance_matrix(self.matrix_path, self.cities)
+        return matrix
+
+    @cached_property
+    def distance_matrix(self):
+        """
+        The distance matrix as a pandas dataframe with the cities as row and column indexes (a view of self.matrix).
+        """
+        from .distance_store import distance_matrix_to_frame
+
+        return distance_matrix_to_frame(self.matrix, self.cities)
+
+    @cached_property
+    def neighbour_index(self):
+        """
+        The neighbour index of the cities, from the dense matrix when there is one, else from the coordinates.
+        """
+        from .neighbours import NeighbourIndex
+
+        if self.matrix_path is None:
+            return NeighbourIndex.from_coordinates(self.cities, self.coordinates,
+                                                   self.neighbours_k or DEFAULT_NEIGHBOURS_K)
+
+        return NeighbourIndex.from_distance_matrix(self.matrix, self.cities, self.neighbours_k)
+
+    @cached_property
+    def fingerprint(self):
+        """
+        A hash of the city data of the context: its cities, the content of its distance matrix and cities database
+        files and its number of neighbours, e.g. for the keys of the outputs computed with it.
+        """
+        from .artifact_cache import content_hash, file_hash
+
+        def optional_file_hash(path):
+            return file_hash(path) if path is not None and os.path.exists(path) else None
+
+        return content_hash(self.cities, optional_file_hash(self.matrix_path), optional_file_hash(self.cities_csv),
+                            self.neighbours_k)
+
+    def warm(self):
+        """
+        Load everything the route generator needs, e.g. before forking worker processes.
+
+        :return: the data context itself
+        """
+        if self.matrix_path is not None:
+            self.matrix
+        self.neighbour_index
+        self.city_cum_weights
+
+        return self
+
+
+_data_context = None
+
+
+def get_data_context():
+    """
+    Get the data context of the current process, creating the default one (CITIES and the files in DATA_DIR) on first
+    use. Worker processes get the context of their parent through the initializer of their pool (see DataContext).
+
+    :return: the data context
+    """
+    global _data_context
+
+    if _data_context is None:
+        _data_context = DataContext()
+
+    return _data_context
+
+
+def set_data_context(data_context):
+    """
+    Replace the data context of the current process, e.g. to generate routes over other cities or matrix files. It is
+    also the initializer of the worker pools, which pass it the context of the parent process.
+
+    :param data_context: the new data context
+    :return: the previous data context
+    """
+    global _data_context
+
+    previous, _data_context = _data_context, data_context
+    return previous
@@ -0,0 +1,141 @@
+import json
+import os
+
+import numpy as np
+from src.constants import *
+
+
+# dtype of the binary distance matrix (km precision to about 1 m up to 16,000 km)
+DISTANCE_MATRIX_DTYPE = np.float32
+
+
+def cities_index_path(matrix_path):
+    """
+    Get the path of the city-name index sidecar of a binary distance matrix, e.g. "distance-matrix.npy" ->
+    "distance-matrix.cities.json".
+
+    :param matrix_path: path of the .npy distance matrix
+    :return: path of the sidecar JSON file
+    """
+    root, _ = os.path.splitext(matrix_path)
+    return root + ".cities.json"
+
+
+def validate_cities_index(cities, expected_cities, source=""):
+    """
+    Check that the city index of a distance matrix is exactly the expected list of cities (same names, same order),
+    so that a stale or mislabeled matrix is detected instead of silently returning wrong distances.
+
+    :param cities: the city index stored with the matrix
+    :param expected_cities: the expected cities (usually constants.CITIES)
+    :param source: name of the file the index comes from, for the error message
+    :raise ValueError: if the two lists differ
+    """
+    cities, expected_cities = list(cities), list(expected_cities)
+    if cities == expected_cities:
+        return
+
+    missing = [city for city in expected_cities if city not in set(cities)]
+    unexpected = [city for city in cities if city not in set(expected_cities)]
+    if missing or unexpected:
+        details = f"missing cities: {missing}, unexpected cities: {unexpected}"
+    else:
+        details = "same cities in a different order"
+
+    raise ValueError(f"Distance matrix {source} does not match the expected cities ({details}). "
+                     f"Regenerate it with gen_cities_distance_matrix().")
+
+
+def save_distance_matrix(matrix, cities, matrix_path=CITIES_DISTANCE_MATRIX_NPY_FILE):
+    """
+    Save a distance matrix as a float32 .npy file plus a JSON sidecar with the city names of its rows/columns.
+
+    :param matrix: (N, N) distance matrix (array or dataframe)
+    :param cities: the N city names, in row order
+    :param matrix_path: path of the .npy file to write
+    """
+    matrix = np.asarray(matrix, dtype=DISTANCE_MATRIX_DTYPE)
+    cities = list(cities)
+    if matrix.shape != (len(cities), len(cities)):
+        raise ValueError(f"Distance matrix shape {matrix.shape} does not match the {len(cities)} cities")
+
+    np.save(matrix_path, matrix)
+    with open(cities_index_path(matrix_path), "w") as f:
+        json.dump(cities, f, indent=4, ensure_ascii=False)
+
+
+def load_distance_matrix(matrix_path=CITIES_DISTANCE_MATRIX_NPY_FILE, expected_cities=CITIES, mmap=True):
+    """
+    Load a binary distance matrix and its city index. With mmap=True the matrix is opened read-only with np.memmap, so
+    loading costs almost nothing and all the processes reading the file share one page-cache copy.
+
+    :param matrix_path: path of the .npy file
+    :param expected_cities: cities the index must match (None to skip the check)
+    :param mmap: whether to memory-map the matrix instead of reading it in memory
+    :return: a (matrix, cities) tuple
+    """
+    index_path = cities_index_path(matrix_path)
+    with open(index_path, "r") as f:
+        cities = json.load(f)
+
+    if expected_cities is not None:
+        validate_cities_index(cities, expected_cities, source=index_path)
+
+    matrix = np.load(matrix_path, mmap_mode="r" if mmap else None)
+    if matrix.shape != (len(cities), len(cities)):
+        raise ValueError(f"Distance matrix {matrix_path} has shape {matrix.shape} but its index has "
+                         f"{len(cities)} cities")
+
+    return matrix, cities
+
+
+def distance_matrix_to_frame(matrix, cities):
+    """
+    Wrap a distance matrix in a dataframe with the cities as row and column indexes, without copying it.
+
+    :param matrix: (N, N) distance matrix
+    :param cities: the N city names
+    :return: the distance matrix as a pandas dataframe
+    """
+    import pandas as pd
+
+    return pd.DataFrame(matrix, index=list(cities), columns=list(cities), copy=False)
+
+
+def import_distance_matrix_csv(csv_path=CITIES_DISTANCE_MATRIX_CSV_FILE, expected_cities=CITIES):
+    """
+    Read a distance matrix from a CSV file. Both the labeled layout (city names in the first column) and the old
+    layout written with index=False (no row labels, rows in the same order as the columns) are accepted.
+
+    :param csv_path: path of the CSV file
+    :param expected_cities: cities the index must match (None to skip the check)
+    :return: a (matrix, cities) tuple
+    """
+    import pandas as pd
+
+    df = pd.read_csv(csv_path)
+    first_column = df.columns[0]
+    if first_column.startswith("Unnamed") or first_column == "":
+        # labeled layout
+        df = df.set_index(first_column)
+        if list(df.index) != list(df.columns):
+            validate_cities_index(df.index, df.columns, source=csv_path)
+    elif len(df) != len(df.columns):
+        raise ValueError(f"Distance matrix {csv_path} is not square: {df.shape}")
+
+    cities = list(df.columns)
+    if expected_cities is not None:
+        validate_cities_index(cities, expected_cities, source=csv_path)
+
+    return df.to_numpy(dtype=DISTANCE_MATRIX_DTYPE), cities
+
+
+def export_distance_matrix_csv(matrix, cities, csv_path=CITIES_DISTANCE_MATRIX_CSV_FILE):
+    """
+    Write a distance matrix to a CSV file with the city names as both the header and the first column.
+
+    :param matrix: (N, N) distance matrix
+    :param cities: the N city names
+    :param csv_path: path of the CSV file to write
+    """
+    distance_matrix_to_frame(np.asarray(matrix, dtype=np.float64), cities).to_csv(csv_path)
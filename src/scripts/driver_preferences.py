@@ -0,0 +1,209 @@
+import heapq
+import json
+import math
+import os
+import time
+
+from .route_io import open_routes_file
+
+
+# number of standard routes recommended per driver (results/drivers.json)
+TOP_K_ROUTES = 5
+
+# inflated scores are rescaled before their scale factor overflows a float
+_MAX_LOG_SCALE = 600.0
+
+
+class DriverPreferenceModel:
+    """
+    An online model of the drivers' preferred standard routes (the results/drivers.json output), updated one actual
+    route at a time instead of rescanning all the routes.
+
+    The affinity of a driver for a standard route is the sum of the weights of the driver's actual routes following
+    it (by default 1, or e.g. the similarity of the actual route to the standard route). With a half-life, the weights
+    decay exponentially with their age, so that recent routes count more.
+
+    Decay does not touch the stored scores: a weight added at time t is stored multiplied by 2^((t - t0) / half_life),
+    in "inflated" units that all decay at the same rate, so the ranking of the scores never changes between updates
+    and an update is O(k). The reference time t0 moves forward (rescaling all the scores once) only when the factor
+    would overflow.
+
+    Each driver keeps its k best standard routes in a bounded min-heap. Scores only grow, so a route can only enter
+    the top-k when it is updated, and the heap stays exact with one comparison against its minimum per update.
+    """
+
+    def __init__(self, k=TOP_K_ROUTES, half_life=None):
+        """
+        Initialize the DriverPreferenceModel class.
+
+        :param k: number of preferred standard routes kept per driver
+        :param half_life: time after which a route weight is halved, in the unit of the timestamps (None: no decay)
+        """
+        self.k = k
+        self.half_life = half_life
+        self.t0 = None
+        self.scores = {}  # driver -> {standard route id -> inflated score}
+        self.heaps = {}  # driver -> min-heap of [inflated score, standard route id], at most k entries
+
+    def __len__(self):
+        return len(self.scores)
+
+    def _inflation(self, timestamp):
+        """
+        Get the factor of a weight added at a timestamp, rescaling the scores when it gets too large.
+        """
+        if self.half_life is None:
+            return 1.0
+
+        if self.t0 is None:
+            self.t0 = timestamp
+
+        log_scale = (timestamp - self.t0) / self.half_life * math.log(2)
+        if log_scale > _MAX_LOG_SCALE:
+            self._rescale(timestamp)
+            log_scale = 0.0
+
+        return math.exp(log_scale)
+
+    def _rescale(self, timestamp):
+        """
+        Move the reference time to a timestamp, dividing all the scores by the corresponding factor.
+        """
+        factor = math.exp(-(timestamp - self.t0) / self.half_life * math.log(2))
+        for driver, scores in self.scores.items():
+            for sroute in scores:
+                scores[sroute] *= factor
+            for entry in self.heaps[driver]:
+                entry[0] *= factor
+        self.t0 = timestamp
+
+    def update(self, driver, sroute, weight=1.0, timestamp=None):
+        """
+        Add an actual route of a driver following a standard route.
+
+        :param driver: driver id
+        :param sroute: standard route id
+        :param weight: weight of the route (>= 0)
+        :param timestamp: time of the route (default: now), only used with a half-life
+        """
+        if weight < 0:
+            raise ValueError(f"route weights must be >= 0, got {weight}")
+
+        if self.half_life is not None and timestamp is None:
+            timestamp = time.time()
+
+        # inflate first: it may rescale the stored scores
+        weight *= self._inflation(timestamp)
+        scores = self.scores.setdefault(driver, {})
+        score = scores.get(sroute, 0.0) + weight
+        scores[sroute] = score
+
+        heap = self.heaps.setdefault(driver, [])
+        for entry in heap:
+            if entry[1] == sroute:
+                entry[0] = score
+                heapq.heapify(heap)
+                return
+
+        if len(heap) < self.k:
+            heapq.heappush(heap, [score, sroute])
+        elif [score, sroute] > heap[0]:
+            heapq.heapreplace(heap, [score, sroute])
+
+    def add_route(self, route, weight=1.0, timestamp=None):
+        """
+        Add an actual route in the JSON schema ({"id", "driver", "sroute", "route"}).
+
+        :param route: the actual route
+        :param weight: weight of the route (>= 0)
+        :param timestamp: time of the route (default: now), only used with a half-life
+        """
+        self.update(route["driver"], route["sroute"], weight, timestamp)
+
+    def add_routes(self, routes):
+        """
+        Add actual routes with the default weight and timestamp.
+
+        :param routes: iterable of actual routes
+        :return: the number of routes added
+        """
+        count = 0
+        for route in routes:
+            self.update(route["driver"], route["sroute"])
+            count += 1
+
+        return count
+
+    def top_routes(self, driver):
+        """
+        Get the preferred standard routes of a driver, the highest affinity first (ties broken by route id).
+
+        :param driver: driver id
+        :return: list of at most k standard route ids
+        """
+        return [sroute for _, sroute in sorted(self.heaps.get(driver, ()), reverse=True)]
+
+    def affinity(self, driver, sroute, timestamp=None):
+        """
+        Get the (decayed) affinity of a driver for a standard route.
+
+        :param driver: driver id
+        :param sroute: standard route id
+        :param timestamp: time at which the affinity is evaluated (default: now), only used with a half-life
+        :return: the sum of the decayed weights of the driver's routes following the standard route
+        """
+        score = self.scores.get(driver, {}).get(sroute, 0.0)
+        if self.half_life is None or self.t0 is None:
+            return score
+
+        if timestamp is None:
+            timestamp = time.time()
+
+        return score * math.exp(-(timestamp - self.t0) / self.half_life * math.log(2))
+
+    def drivers(self):
+        """
+        Get the preferred standard routes of all the drivers in the results/drivers.json schema.
+
+        :return: list of {"driver", "routes"} dictionaries
+        """
+        return [{"driver": driver, "routes": self.top_routes(driver)} for driver in self.scores]
+
+    def snapshot(self, path):
+        """
+        Save the model to a JSON file (.gz or .zst to compress it), atomically: the file is written next to its
+        destination, then renamed over it.
+
+        :param path: path of the snapshot
+        """
+        state = {"k": self.k, "half_life": self.half_life, "t0": self.t0, "scores": self.scores}
+
+        # keep the compression suffix on the temporary file
+        directory, name = os.path.split(path)
+        tmp_path = os.path.join(directory, f".tmp-{os.getpid()}-{name}")
+        with open_routes_file(tmp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def restore(cls, path):
+        """
+        Load a model saved with snapshot().
+
+        :param path: path of the snapshot
+        :return: the model
+        """
+        with open_routes_file(path) as f:
+            state = json.load(f)
+
+        model = cls(state["k"], state["half_life"])
+        model.t0 = state["t0"]
+        for driver, scores in state["scores"].items():
+            model.scores[driver] = scores
+            # the k best (score, route) entries, as a heap
+            best = heapq.nlargest(model.k, ((score, sroute) for sroute, score in scores.items()))
+            heap = [list(entry) for entry in best]
+            heapq.heapify(heap)
+            model.heaps[driver] = heap
+
+        return model
@@ -0,0 +1,241 @@
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from src.constants import *
+from .artifact_cache import content_hash, file_hash
+from .data_context import get_data_context, set_data_context
+from .driver_preferences import TOP_K_ROUTES, DriverPreferenceModel
+from .perfect_route import PerfectRouteSolver, driver_sort_key, generate_perfect_routes
+from .route_io import iter_routes
+from .route_table import RouteTable
+
+
+# number of driver shards: a worker holds the routes of one shard in memory at a time
+NUM_DRIVER_SHARDS = 64
+
+# bumped when the layout or the semantics of the shard files change
+SHARDS_VERSION = 1
+
+
+def driver_shard(driver, num_shards):
+    """
+    Get the shard of a driver: a stable hash of its name (the same in every process and run, unlike hash()) modulo
+    the number of shards.
+
+    :param driver: driver id
+    :param num_shards: number of shards
+    :return: the shard, in [0, num_shards)
+    """
+    digest = hashlib.blake2b(driver.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % num_shards
+
+
+def _write_json(path, value):
+    """
+    Write a JSON file atomically: to a temporary file next to it, then renamed over it.
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(value, f)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path):
+    """
+    Read a JSON file, None when it does not exist or is not valid JSON.
+    """
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def _process_shard(args):
+    """
+    Worker of the process pool of DriverShardRunner.process(): compute the per-driver outputs of one shard and write
+    them to its result file.
+
+    :param args: (shard, path of the shard routes, path of the result file, result key, solver, top k) tuple
+    :return: (shard, number of routes, number of drivers) tuple
+    """
+    shard, routes_path, result_path, key, solver, k = args
+
+    table = RouteTable.from_file(routes_path)
+    model = DriverPreferenceModel(k)
+    for driver, sroute in zip(table.drivers.tolist(), table.sroutes.tolist()):
+        if sroute >= 0:
+            model.update(table.driver_names[driver], table.sroute_names[sroute])
+    drivers = model.drivers()
+    perfect_routes = generate_perfect_routes(table, solver, workers=1)
+
+    _write_json(result_path, {"key": key, "routes": len(table), "drivers": drivers, "perfect_routes": perfect_routes})
+    return shard, len(table), len(drivers)
+
+
+class DriverShardRunner:
+    """
+    A map-reduce runner of the per-driver analysis outputs (the preferred standard routes of results/drivers.json
+    and the perfect routes of results/perfectRoute.json), which are independent across drivers:
+
+    - partition(): the actual routes are streamed into num_shards JSON Lines files, by driver hash (driver_shard()),
+      so that all the routes of a driver are in one shard
+    - process(): the shards are processed by a process pool, each worker loading a single shard at a time, so the
+      memory of a worker is bounded by the size of a shard rather than of the dataset; every shard writes its results
+      to its own file
+    - merge(): the results of the shards are merged in the order of the drivers (see driver_sort_key()), so the
+      outputs do not depend on the number of shards or workers nor on the order in which the shards complete
+
+    Everything is written atomically in the work directory. A manifest records the partition of an input file (by
+    content hash), and the result of a shard records the parameters and the city data it was computed with, so a run
+    interrupted at any point resumes where it stopped: the partition is reused when the input did not change, and only
+    the shards without an up-to-date result are processed again.
+    """
+
+    def __init__(self, work_dir=SHARDS_DIR, num_shards=NUM_DRIVER_SHARDS, solver=None, k=TOP_K_ROUTES):
+        """
+        Initialize the DriverShardRunner class.
+
+        :param work_dir: directory of the shard, result and manifest files (created when needed)
+        :param num_shards: number of shards
+        :param solver: the PerfectRouteSolver (default: default parameters)
+        :param k: number of preferred standard routes per driver
+        """
+        if num_shards < 1:
+            raise ValueError(f"the number of shards must be >= 1, got {num_shards}")
+
+        self.work_dir = work_dir
+        self.num_shards = num_shards
+        self.solver = solver or PerfectRouteSolver()
+        self.k = k
+        self.manifest = None
+
+    def _path(self, kind, shard):
+        """
+        Get the path of the routes ("shard") or of the result ("result") of a shard.
+        """
+        suffix = "ndjson" if kind == "shard" else "json"
+        return os.path.join(self.work_dir, f"{kind}-{shard:04d}-of-{self.num_shards:04d}.{suffix}")
+
+    def _manifest_path(self):
+        return os.path.join(self.work_dir, f"manifest-{self.num_shards:04d}.json")
+
+    def partition(self, path):
+        """
+        Partition the actual routes of a file into the shards, unless the work directory already holds a complete
+        partition of the same content.
+
+        :param path: path of the routes file (any format read by iter_routes())
+        :return: True when the routes were partitioned, False when the previous partition was reused
+        """
+        os.makedirs(self.work_dir, exist_ok=True)
+        input_hash = file_hash(path)
+        manifest = _read_json(self._manifest_path())
+        if manifest is not None and manifest["version"] == SHARDS_VERSION and manifest["input"] == input_hash:
+            self.manifest = manifest
+            return False
+
+        # the manifest is only written once all the shards are, so an interrupted partition is redone
+        if manifest is not None:
+            os.unlink(self._manifest_path())
+        files = [open(self._path("shard", shard), "w", encoding="utf-8") for shard in range(self.num_shards)]
+        counts = [0] * self.num_shards
+        shards = {}  # driver -> shard
+        try:
+            for route in iter_routes(path):
+                driver = route.get("driver")
+                if driver is None:
+                    continue
+                try:
+                    shard = shards[driver]
+                except KeyError:
+                    shard = shards[driver] = driver_shard(driver, self.num_shards)
+                files[shard].write(json.dumps(route, ensure_ascii=False, separators=(",", ":")))
+                files[shard].write("\n")
+                counts[shard] += 1
+        finally:
+            for f in files:
+                f.close()
+
+        self.manifest = {"version": SHARDS_VERSION, "input": input_hash, "routes": counts, "drivers": len(shards)}
+        _write_json(self._manifest_path(), self.manifest)
+        return True
+
+    def _result_key(self, shard):
+        """
+        Get the key of the result of a shard: the input, the shard, the parameters of the outputs and the city data
+        they are computed with (see DataContext.fingerprint).
+        """
+        return content_hash(SHARDS_VERSION, self.manifest["input"], shard, self.num_shards, vars(self.solver), self.k,
+                            get_data_context().fingerprint, MERCHANDISE_TYPES)
+
+    def pending_shards(self):
+        """
+        Get the shards without an up-to-date result.
+
+        :return: list of shards
+        """
+        if self.manifest is None:
+            raise ValueError("the routes must be partitioned first (see partition())")
+
+        pending = []
+        for shard in range(self.num_shards):
+            result = _read_json(self._path("result", shard))
+            if result is None or result.get("key") != self._result_key(shard):
+                pending.append(shard)
+
+        return pending
+
+    def process(self, workers=None):
+        """
+        Process the shards without an up-to-date result, in parallel. Iterate over the returned generator to run them;
+        a shard is reported when its result is written, so the progress can be followed and an interrupted run
+        resumed.
+
+        :param workers: number of worker processes (default: 1, 0 for one per CPU core)
+        :return: generator of (shard, number of routes, number of drivers) tuples, in completion order
+        """
+        if workers is None:
+            workers = 1
+        elif workers == 0:
+            workers = os.cpu_count() or 1
+
+        tasks = [(shard, self._path("shard", shard), self._path("result", shard), self._result_key(shard),
+                  self.solver, self.k) for shard in self.pending_shards()]
+        # the largest shards first, so that a large shard does not keep a worker busy alone at the end
+        tasks.sort(key=lambda task: -self.manifest["routes"][task[0]])
+
+        if workers == 1 or len(tasks) <= 1:
+            for task in tasks:
+                yield _process_shard(task)
+            return
+
+        # load the city data once so that forked workers inherit it, and give the workers the context of this process
+        data_context = get_data_context().warm()
+        with ProcessPoolExecutor(max_workers=workers, initializer=set_data_context,
+                                 initargs=(data_context,)) as executor:
+            for future in as_completed([executor.submit(_process_shard, task) for task in tasks]):
+                yield future.result()
+
+    def merge(self):
+        """
+        Merge the results of all the shards.
+
+        :return: (list of {"driver", "routes"} dictionaries, list of {"driver", "route"} perfect routes) tuple, both
+            in the order of the drivers (see driver_sort_key())
+        """
+        pending = self.pending_shards()
+        if pending:
+            raise ValueError(f"{len(pending)} shards are not processed yet (see process())")
+
+        drivers, perfect_routes = [], []
+        for shard in range(self.num_shards):
+            result = _read_json(self._path("result", shard))
+            drivers.extend(result["drivers"])
+            perfect_routes.extend(result["perfect_routes"])
+
+        drivers.sort(key=lambda driver: driver_sort_key(driver["driver"]))
+        perfect_routes.sort(key=lambda perfect_route: driver_sort_key(perfect_route["driver"]))
+        return drivers, perfect_routes
@@ -1,43 +1,50 @@
-import copy
+import collections
+import hashlib
+import itertools
+import os
 import random
-from .utils import *
+from concurrent.futures import ProcessPoolExecutor
+from src.constants import *
+from . import instrumentation
+from .data_context import get_data_context, set_data_context
+from .route_ids import ACT_ROUTE_ID_PREFIX, STD_ROUTE_ID_PREFIX, RouteIdAllocator
+from .route_model import Trip, route_from_dicts, route_to_dicts
 
-if not os.path.exists(CITIES_DISTANCE_MATRIX_CSV_FILE):
-    print("The distance matrix CSV file does not exist. Generating a new one...")
-    distance_matrix = gen_cities_distance_matrix()
-else:
-    distance_matrix = pd.read_csv(CITIES_DISTANCE_MATRIX_CSV_FILE, index_col=0)
 
+def __getattr__(name):
+    # the module-level distance matrix and neighbour index are kept for compatibility, they are now loaded lazily
+    # through the data context on first access instead of at import time
+    if name == "distance_matrix":
+        return get_data_context().distance_matrix
+    if name == "neighbour_index":
+        return get_data_context().neighbour_index
 
-def get_closest_cities(city, num_cities=5):
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def get_closest_cities(city, num_cities=5, exclude=()):
     """
-    Get the closest cities to the given city based on the distance matrix.
+    Get the closest cities to the given city based on the precomputed neighbour index of the distance matrix.
 
     :param city: The city to find the closest cities to.
     :param num_cities: Number of closest cities to return.
+    :param exclude: Cities that must not be returned (e.g. the cities already in the route).
     :return: A list of the closest cities.
     """
-    # print('city:', city)
-    # print('distance_matrix:', distance_matrix)
-    # print('distance_matrix[city]:', distance_matrix[city])
-    # print('num_cities:', num_cities)
-    closest = distance_matrix[city].nsmallest(num_cities + 1).index.tolist()
-    try:
-        closest.remove(city)  # Remove the city itself from the list
-    except ValueError:
-        pass
-    return closest
+    instrumentation.count("nearest_city_lookups")
+    with instrumentation.timer("nearest_city_lookup"):
+        return get_data_context().neighbour_index.closest(city, num_cities, exclude)
 
 
-def generate_merchandise():
-    selected_merchandise = random.sample(
-        MERCHANDISE_TYPES, random.randint(2, min(MERCHANDISE_SIZE, len(MERCHANDISE_TYPES)))
+def generate_merchandise(rng=random):
+    selected_merchandise = rng.sample(
+        MERCHANDISE_TYPES, rng.randint(2, min(MERCHANDISE_SIZE, len(MERCHANDISE_TYPES)))
     )
 
-    return {item: random.randint(1, 50) for item in selected_merchandise}
+    return {item: rng.randint(1, 50) for item in selected_merchandise}
 
 
-# def generate_merchandise():
+# def generate_merchandise(rng=random):
 #     """Generate a random set of merchandise with quantities."""
 #     return {
 #         # merchandise_type: random_quantity for _ in range(random_number_of_items)
@@ -74,20 +81,29 @@ def generate_merchandise():
 #     return adjusted
 
 
-def generate_connected_standard_route(min_trips, max_trips):
+def generate_connected_standard_route(min_trips, max_trips, rng=random):
     """
     Generate a connected route based on the distance matrix, ensuring no city is revisited.
 
     :param min_trips: Minimum number of trips in the route.
     :param max_trips: Maximum number of trips in the route.
+    :param rng: The random generator to draw from (the random module or a random.Random instance).
     :return: A connected route.
     """
-    route_length = random.randint(min_trips, max_trips)
+    route_length = rng.randint(min_trips, max_trips)
     route = []
 
     # Select random departure and destination cities
-    departure_city = random.choice(CITIES)
-    destination_city = random.choice([city for city in CITIES if city != departure_city])
+    data_context = get_data_context()
+    cities, cum_weights = data_context.cities, data_context.city_cum_weights
+    if cum_weights is None:
+        departure_city = rng.choice(cities)
+        destination_city = rng.choice([city for city in cities if city != departure_city])
+    else:
+        # weighted by population: the destination is drawn again until it differs from the departure
+        departure_city = destination_city = rng.choices(cities, cum_weights=cum_weights)[0]
+        while destination_city == departure_city:
+            destination_city = rng.choices(cities, cum_weights=cum_weights)[0]
 
     current_city = departure_city
     visited_cities = [current_city]  # Initialize list of visited cities
@@ -100,11 +116,11 @@ def generate_connected_standard_route(min_trips, max_trips):
         if not closest_cities:
             break
 
-        next_city = random.choice(closest_cities)
+        next_city = rng.choice(closest_cities)
         visited_cities.append(next_city)  # Update visited cities list
 
         # Add trip to the route
-        route.append({"from": current_city, "to": next_city, "merchandise": generate_merchandise()})
+        route.append({"from": current_city, "to": next_city, "merchandise": generate_merchandise(rng)})
 
         # Update current city
         current_city = next_city
@@ -116,394 +132,618 @@ def generate_connected_standard_route(min_trips, max_trips):
     return route
 
 
-def generate_standard_routes(num_routes, min_trips_, max_trips_):
+def generate_standard_routes(num_routes, min_trips_, max_trips_, rng=random):
     """
     Generate a set of standard routes with connected trips and trip number constraints.
 
     @param num_routes: number of routes to generate
     @param min_trips_: minimum number of trips in the route
     @param max_trips_: maximum number of trips in the route
+    @param rng: random generator to draw from (the random module or a random.Random instance)
 
     @return: a set of standard routes with connected trips and trip number constraints
     """
-    standard_routes = []
+    return list(iter_standard_routes(num_routes, min_trips_, max_trips_, rng))
+
+
+def iter_standard_routes(num_routes, min_trips_, max_trips_, rng=random):
+    """
+    Generate standard routes one by one, e.g. to follow the progress of a large generation.
+
+    :param num_routes: number of routes to generate
+    :param min_trips_: minimum number of trips in the route
+    :param max_trips_: maximum number of trips in the route
+    :param rng: random generator to draw from (the random module or a random.Random instance)
+    :return: a generator of standard routes
+    """
     for i in range(num_routes):  # Generate a standard route for each route id
         # Generate a connected route with the specified trip constraints
-        route_ = generate_connected_standard_route(min_trips_, max_trips_)
+        route_ = generate_connected_standard_route(min_trips_, max_trips_, rng)
 
-        # Add the route to the list of standard routes
-        standard_routes.append({"id": f"s{i + 1}", "route": route_})
+        # the standard routes keep their readable ids (s1, s2, ...), only the actual routes need allocated ones
+        yield {"id": f"{STD_ROUTE_ID_PREFIX}{i + 1}", "route": route_}
 
-    return standard_routes
 
-
-def route_merchandise_variations(route):
+def route_merchandise_variations(route, rng=random):
     """
     Adjust the merchandise of a random trip either by removing an item or changing the quantity of an item.
-    :param route: A route containing trips with merchandise.
-    :return: The route with adjusted merchandise in a random trip.
+    :param route: A route (tuple of trips) containing trips with merchandise.
+    :param rng: The random generator to draw from.
+    :return: A new route with adjusted merchandise in a random trip, sharing the other trips with the given route.
     """
     try:
-        index = random.randint(0, len(route) - 1)  # select a random trip
-        merchandise = route[index]['merchandise']  # get the merchandise in the trip
-        length = len(merchandise)
+        index = rng.randint(0, len(route) - 1)  # select a random trip
+        trip = route[index]  # get the trip
     except Exception:
         print('route:', route)
         raise Exception
 
-    if random.randint(0, 1):  # 50% chance of losing an item or changing the quantity of an item
-        # if losing an item
-        for _ in range(random.randint(0, length)):
-            if length > 5:
-                key = list(merchandise.keys())[random.randint(0, length - 1)]
-                del merchandise[key]
-                length -= 1
-    else:
-        # if changing the quantity of an item
-        for _ in range(random.randint(0, length)):
-            key = list(merchandise.keys())[random.randint(1, length - 1)]
-            merchandise[key] = random.randint(1, 50)
+    varied_trip = trip.replace(merchandise=trip_merchandise_variations(trip, rng))
 
-    route[index]['merchandise'].update(merchandise)
-
-    return route
+    return route[:index] + (varied_trip,) + route[index + 1:]
 
 
-def trip_merchandise_variations(trip):
+def trip_merchandise_variations(trip, rng=random):
     """
     Adjust the merchandise of a trip either by removing an item or changing the quantity of an item.
     :param trip: A trip with merchandise.
-    :return: The trip with adjusted merchandise.
+    :param rng: The random generator to draw from.
+    :return: The adjusted merchandise, as a new dictionary (the merchandise of the trip is left untouched).
     """
-    merchandise = trip['merchandise']
+    merchandise = dict(trip.merchandise)
     length = len(merchandise)  # get the length of the merchandise in the trip
 
-    if random.randint(0, 1):
+    if rng.randint(0, 1):
         # if losing an item
-        for _ in range(random.randint(0, length)):
+        for _ in range(rng.randint(0, length)):
             if length > 5:  # if the length of the merchandise is greater than 5
                 # randomly choose an item to remove
-                key = list(merchandise.keys())[random.randint(0, length - 1)]
+                key = list(merchandise.keys())[rng.randint(0, length - 1)]
                 del merchandise[key]
                 length -= 1
     else:
         # if changing the quantity of an item
-        for _ in range(random.randint(0, length)):
-            key = list(merchandise.keys())[random.randint(1, length - 1)]
-            merchandise[key] = random.randint(1, 50)
-
-    trip['merchandise'].update(merchandise)
+        for _ in range(rng.randint(0, length)):
+            key = list(merchandise.keys())[rng.randint(1, length - 1)]
+            merchandise[key] = rng.randint(1, 50)
 
-    return trip['merchandise']
+    return merchandise
 
 
-def add_item_or_change_quantity_of_items_in_merchandise(route):
+def add_item_or_change_quantity_of_items_in_merchandise(route, rng=random):
     """
     Add new items to the merchandise if there is space or change the quantity of the existing items.
-    :param route: A route containing trips with merchandise.
-    :return: The route with adjusted merchandise.
+    :param route: A route (tuple of trips) containing trips with merchandise.
+    :param rng: The random generator to draw from.
+    :return: A new route with adjusted merchandise.
     """
+    varied_route = []
+
     # Iterate over the trips in the route to add new items or change the quantity of the existing items
-    for index in range(0, len(route)):
-        current_merchandise = [m for m in route[index]['merchandise'].keys()]
-        available_merchandise = [m for m in MERCHANDISE_TYPES if m not in current_merchandise]
+    for trip in route:
+        available_merchandise = [m for m in MERCHANDISE_TYPES if m not in trip.merchandise]
 
-        new_items = {}
         if available_merchandise:  # if there is space for new items
-            selected_merchandise = random.sample(
-                available_merchandise, random.randint(1, min(MERCHANDISE_SIZE, len(available_merchandise)))
+            selected_merchandise = rng.sample(
+                available_merchandise, rng.randint(1, min(MERCHANDISE_SIZE, len(available_merchandise)))
             )
+            merchandise = dict(trip.merchandise)
             for item in selected_merchandise:  # add new items to the merchandise
-                new_items[item] = random.randint(1, 50)
+                merchandise[item] = rng.randint(1, 50)
         else:
             # if there is no space for new items, then change the quantity of the existing items
-            new_items = trip_merchandise_variations(copy.deepcopy(route[index]))
+            merchandise = trip_merchandise_variations(trip, rng)
 
-        route[index]['merchandise'].update(new_items)
+        varied_route.append(trip.replace(merchandise=merchandise))
 
-    return route
+    return tuple(varied_route)
 
 
-def adjust_merchandise(route):
+def adjust_merchandise(route, rng=random):
     """
     Adjust the merchandise of the trips in the route by adding new items or changing the quantity of the existing items.
-    :param route: A route containing trips with merchandise.
-    :return: The route with adjusted merchandise.
+    :param route: A route (tuple of trips) containing trips with merchandise.
+    :param rng: The random generator to draw from.
+    :return: The route with adjusted merchandise: a new route sharing the unchanged trips, or the same route.
     """
     merchandise_variations_ops = ['Addition', 'Variation', 'Keep']
     # randomly choose a merchandise variation operation
-    merchandise_variation_op = random.choice(merchandise_variations_ops)
+    merchandise_variation_op = rng.choice(merchandise_variations_ops)
 
     if merchandise_variation_op == 'Addition':
-        return add_item_or_change_quantity_of_items_in_merchandise(route)
+        return add_item_or_change_quantity_of_items_in_merchandise(route, rng)
     elif merchandise_variation_op == 'Variation':
-        return route_merchandise_variations(route)
+        return route_merchandise_variations(route, rng)
     else:
         return route
 
 
-def create_actual_routes_with_variations_for_std_route(standard_route_, variations=10):
+class VariationCandidates:
+    """
+    The candidate cities of the city variations of one standard route, looked up once in the neighbour index instead
+    of at every variation:
+
+    - replacement cities of the omission action, for each city of the route: its closest cities that are not in the
+      route, taken from the smallest window of its closest cities (5, then 8, 11, ...) holding at least one of them
+    - detour cities of the addition action, for each trip: the 5 closest cities of its "from" city, then of its "to"
+      city, that are not in the route
+
+    The route cities are passed at every call, as the detours added by the variations join them. A lookup only scans
+    the precomputed neighbours, so it always ends, with an empty list when the candidates are exhausted (every close
+    city already being in the route).
+    """
+
+    def __init__(self, std_route_trips):
+        """
+        Initialize the VariationCandidates class.
+
+        :param std_route_trips: the trips of the standard route
+        """
+        self.index = get_data_context().neighbour_index
+        self.ranked = {}  # city -> all its neighbours in the index, closest first
+        self.detours = [
+            list(dict.fromkeys(self.closest(trip.from_city)[:5] + self.closest(trip.to_city)[:5]))
+            for trip in std_route_trips
+        ]
+
+    def closest(self, city):
+        """
+        Get all the neighbours of a city in the index, closest first (looked up on first use).
+        """
+        try:
+            return self.ranked[city]
+        except KeyError:
+            instrumentation.count("nearest_city_lookups")
+            ranked = self.ranked[city] = self.index.closest(city, self.index.max_k)
+            return ranked
+
+    def replacements(self, city, route_cities):
+        """
+        Get the candidate replacement cities of a city of the route.
+
+        :param city: the city to replace
+        :param route_cities: the cities of the route (a set)
+        :return: list of cities, empty if exhausted
+        """
+        ranked = self.closest(city)
+        first = next((rank for rank, other in enumerate(ranked) if other not in route_cities), None)
+        if first is None:
+            return []
+
+        # the window of closest cities holding the first candidate: 5, then widened by 3
+        window = 5 if first < 5 else 5 + 3 * ((first - 5) // 3 + 1)
+        return [other for other in ranked[:window] if other not in route_cities]
+
+    def detour_cities(self, trip_index, trip, route_cities):
+        """
+        Get the candidate detour cities of a trip of the standard route.
+
+        :param trip_index: index of the trip in the standard route
+        :param trip: the trip
+        :param route_cities: the cities of the route (a set)
+        :return: list of cities, empty if exhausted
+        """
+        return [
+            city for city in self.detours[trip_index]
+            if city != trip.from_city and city != trip.to_city and city not in route_cities
+        ]
+
+
+def create_actual_routes_with_variations_for_std_route(standard_route_, variations=10, rng=random, new_id=None):
     """
     Create a variation of the standard route to form an actual route.
     Variations include minor changes in the route and merchandise.
 
+    The variations are built on immutable trips (see route_model.Trip): a variation only allocates the trips it
+    changes and shares the others, and the standard route itself is never modified.
+
     :param standard_route_: The original standard route.
     # :param driver_id: The ID of the driver for the actual route.
     :param variations: The number of variations to create for the standard route.
+    :param rng: The random generator to draw from.
+    :param new_id: The RouteIdAllocator of the ids of the actual routes (default: a new one on shard 0, so pass the
+                   allocator of a distinct shard for each standard route to keep the ids unique across them).
 
     :return: A varied actual route.
     """
+    if new_id is None:
+        new_id = RouteIdAllocator(ACT_ROUTE_ID_PREFIX)
+
+    std_route_trips = route_from_dicts(standard_route_["route"])
+
     # get all the cities from the current standard route
     current_route_cities = []
-    for trip in standard_route_["route"]:
-        current_route_cities.append(trip["from"])
-        current_route_cities.append(trip["to"])
+    for trip in std_route_trips:
+        current_route_cities.append(trip.from_city)
+        current_route_cities.append(trip.to_city)
+
+    # duplicate cities are removed (keeping the route order, so that the output only depends on the random generator)
+    current_route_cities = list(dict.fromkeys(current_route_cities))
+    current_route_cities_set = set(current_route_cities)
 
-    current_route_cities = list(set(current_route_cities))
+    # candidate replacement and detour cities, looked up once for all the variations
+    candidates = VariationCandidates(std_route_trips)
 
     actions_list = ["omission", "addition", "merchandise_variation"]
 
     num_of_city_variations = 0  # number of city variations in the route
     actual_route_variations_of_current_std_route = []
+    variations_trips = []  # trips of each variation, in the same order as the list above
 
     while len(actual_route_variations_of_current_std_route) < variations:
         # Create a new actual route variation of the standard route
         actual_route = {
-            "id": f"a{random.randint(1, 100000)}",  # Unique ID for the actual route
+            "id": new_id(),  # Unique ID for the actual route
             # "driver": driver_id,
             "route": []
         }
+        actual_route_trips = []
 
         try:
             actual_route["sroute"] = standard_route_["sroute"]  # in case of keeping the same variation
         except KeyError:
             actual_route["sroute"] = standard_route_["id"]  # keeping the standard route or creating a new variation
 
-        keep_std_route = random.random() < SAME_STD_ROUTE_PROB
-        keep_same_variation = random.random() < SAME_VARIED_ROUTE_PROB
+        keep_std_route = rng.random() < SAME_STD_ROUTE_PROB
+        keep_same_variation = rng.random() < SAME_VARIED_ROUTE_PROB
 
         if keep_same_variation:
             # then randomly choose a variation of the standard route from the actual_routes list for the same
             # driver and same standard route
             if len(actual_route_variations_of_current_std_route) > 0:
-                already_created_variation = random.choice(actual_route_variations_of_current_std_route)
-                already_created_variation["route"] = adjust_merchandise(
-                    copy.deepcopy(already_created_variation["route"])
-                )
-                actual_route_variations_of_current_std_route.append(already_created_variation)
+                instrumentation.count("action.keep_same_variation")
+                action_start = instrumentation.clock()
+                index = rng.randrange(len(actual_route_variations_of_current_std_route))
+                # a new route (with its own id) following the same path, the earlier route is left unchanged
+                varied_trips = adjust_merchandise(variations_trips[index], rng)
+                actual_route["route"] = route_to_dicts(varied_trips)
+                actual_route_variations_of_current_std_route.append(actual_route)
+                variations_trips.append(varied_trips)
+                instrumentation.record("action.keep_same_variation", action_start)
                 continue
 
         if keep_std_route:
             # keep the original standard route
-            actual_route["route"] = adjust_merchandise(copy.deepcopy(standard_route_["route"]))
+            instrumentation.count("action.keep_std")
+            action_start = instrumentation.clock()
+            actual_route_trips = adjust_merchandise(std_route_trips, rng)
+            actual_route["route"] = route_to_dicts(actual_route_trips)
             actual_route_variations_of_current_std_route.append(actual_route)
+            variations_trips.append(actual_route_trips)
+            instrumentation.record("action.keep_std", action_start)
             continue
 
         # randomly choose an action
-        action = random.choice(actions_list)
+        action = rng.choice(actions_list)
+        action_start = instrumentation.clock()
         if action == "omission":
             # randomly choose a city to remove
-            selected_city_to_remove = random.choice(current_route_cities[:len(current_route_cities) - 1])
-
-            # to replace the removed city with a new close city, select top 3 closest cities
-            closest_cities = get_closest_cities(selected_city_to_remove, 5)
+            selected_city_to_remove = rng.choice(current_route_cities[:len(current_route_cities) - 1])
 
-            closest_cities_ = [
-                city for city in closest_cities
-                if city != selected_city_to_remove and city not in current_route_cities
-            ]
+            # to replace the removed city with a new close city, select the closest cities not in the route
+            closest_cities_ = candidates.replacements(selected_city_to_remove, current_route_cities_set)
 
             if len(closest_cities_) == 0:
-                num_of_closest_increment = 5
-                while len(closest_cities_) == 0:
-                    # to replace the removed city with a new close city, select top 3 closest cities
-                    closest_cities = get_closest_cities(selected_city_to_remove, num_of_closest_increment + 3)
-
-                    closest_cities_ = [
-                        city for city in closest_cities
-                        if city != selected_city_to_remove and city not in current_route_cities
-                    ]
-
-                    num_of_closest_increment += 3
-
-                # randomly choose a new city to replace the removed city
-                selected_new_city_to_replace = random.choice(closest_cities_)
-            else:
-                # randomly choose a new city to replace the removed city
-                selected_new_city_to_replace = random.choice(closest_cities_)
-
-            # get all the trips with selected_city_to_remove
-            trips_with_selected_city_to_remove = []
-            for trip_ in standard_route_["route"]:
-                if trip_["from"] == selected_city_to_remove or trip_["to"] == selected_city_to_remove:
-                    trips_with_selected_city_to_remove.append(trip_)
+                # no city left close to this one: remove another city that still has candidates
+                instrumentation.count("exhausted.omission_city")
+                removable_cities = [
+                    city for city in current_route_cities[:len(current_route_cities) - 1]
+                    if candidates.replacements(city, current_route_cities_set)
+                ]
+                if not removable_cities:
+                    # every close city is in the route already: vary the merchandise only
+                    instrumentation.count("exhausted.omission_route")
+                    action = "merchandise_variation"
+                else:
+                    selected_city_to_remove = rng.choice(removable_cities)
+                    closest_cities_ = candidates.replacements(selected_city_to_remove, current_route_cities_set)
+
+        if action == "omission":
+            # randomly choose a new city to replace the removed city
+            selected_new_city_to_replace = rng.choice(closest_cities_)
 
             # replace all the trips with selected_city_to_remove with trips with selected_new_city_to_replace
-            for trip_ in standard_route_["route"]:
-                if trip_["from"] == selected_city_to_remove:
-                    varied_trip = {
-                        "from": selected_new_city_to_replace, "to": trip_["to"],
-                        "merchandise": trip_["merchandise"]
-                    }
+            for trip_ in std_route_trips:
+                if trip_.from_city == selected_city_to_remove:
                     # trip's merchandise variation
-                    varied_trip["merchandise"] = trip_merchandise_variations(varied_trip)
-                    actual_route["route"].append(varied_trip)
-                elif trip_["to"] == selected_city_to_remove:
-                    varied_trip = {
-                        "from": trip_["from"], "to": selected_new_city_to_replace,
-                        "merchandise": trip_["merchandise"]
-                    }
+                    varied_trip = Trip(
+                        selected_new_city_to_replace, trip_.to_city, trip_merchandise_variations(trip_, rng)
+                    )
+                    actual_route_trips.append(varied_trip)
+                elif trip_.to_city == selected_city_to_remove:
                     # trip's merchandise variation
-                    varied_trip["merchandise"] = trip_merchandise_variations(varied_trip)
-                    actual_route["route"].append(varied_trip)
+                    varied_trip = Trip(
+                        trip_.from_city, selected_new_city_to_replace, trip_merchandise_variations(trip_, rng)
+                    )
+                    actual_route_trips.append(varied_trip)
                 else:
-                    # add the original trip
-                    actual_route["route"].append(trip_)
+                    # add the original trip (shared with the standard route, trips are immutable)
+                    actual_route_trips.append(trip_)
         elif action == "addition":  # addition of a new city in the route
+            # every attempt either adds a city variation or keeps a trip, and there are at most MAX_ADDITION_ATTEMPTS
+            attempts = 0
             while num_of_city_variations < MAX_CITY_VARIATIONS_PER_ROUTE:
-                # randomly choose a trip for the new city addition
-                selected_trip_index = random.randint(0, len(standard_route_["route"]) - 1)
-                selected_trip = standard_route_["route"][selected_trip_index]
-
-                # closest cities to the current trip "from" city
-                closest_cities = get_closest_cities(selected_trip["from"], 5)
+                if attempts == MAX_ADDITION_ATTEMPTS:
+                    instrumentation.count("exhausted.addition_attempts")
+                    break
+                attempts += 1
 
-                # closest cities to the current trip "to" city
-                closest_cities.extend(get_closest_cities(selected_trip["to"], 5))
+                # randomly choose a trip for the new city addition
+                selected_trip_index = rng.randint(0, len(std_route_trips) - 1)
+                selected_trip = std_route_trips[selected_trip_index]
 
-                # duplicate cities are removed
-                closest_cities = list(set(closest_cities))
+                # closest cities to the current trip "from" and "to" cities, without the cities of the route
+                closest_cities = candidates.detour_cities(selected_trip_index, selected_trip, current_route_cities_set)
 
-                # remove the current trip "from" and "to" cities from the closest cities list
-                closest_cities = [
-                    city for city in closest_cities
-                    if city != selected_trip["from"] and city != selected_trip["to"] and city not in current_route_cities
-                ]
                 # if there are no close cities to the current trip "from" and "to" cities, keep the original trip
                 if not closest_cities:
-                    actual_route["route"].append(selected_trip)
+                    instrumentation.count("exhausted.addition_trip")
+                    actual_route_trips.append(selected_trip)
                     num_of_city_variations += 1
                     continue
 
                 # Choose a random nearby city for a detour trip
-                detour_city = random.choice(closest_cities)
+                detour_city = rng.choice(closest_cities)
 
                 # if this is the first trip
                 if selected_trip_index == 0:
                     # add a detour city in from of the original trip or after the original trip
-                    if random.choice([True, False]):
+                    if rng.choice([True, False]):
                         # Add a detour trip (from the detour city to the original city)
-                        trip_varied = {
-                            "from": detour_city, "to": selected_trip["from"],
-                            "merchandise": selected_trip["merchandise"]
-                        }
-                        # trip's merchandise variation
-                        trip_varied["merchandise"] = trip_merchandise_variations(trip_varied)
-                        actual_route["route"].append(trip_varied)
+                        actual_route_trips.append(
+                            Trip(detour_city, selected_trip.from_city, trip_merchandise_variations(selected_trip, rng))
+                        )
 
                         # Add the original trip (from the original city to the detour city)
-                        trip_varied = {
-                            "from": selected_trip["from"], "to": selected_trip["to"],
-                            "merchandise": selected_trip["merchandise"]
-                        }
-                        # trip's merchandise variation
-                        trip_varied["merchandise"] = trip_merchandise_variations(trip_varied)
-                        actual_route["route"].append(trip_varied)
-
-                        # update the current route cities list with the new detour city
-                        current_route_cities.append(detour_city)
-
-                        # increase the number of city variations
-                        num_of_city_variations += 1
+                        actual_route_trips.append(
+                            selected_trip.replace(merchandise=trip_merchandise_variations(selected_trip, rng))
+                        )
                     else:
                         # Add the original trip (from the original city to the detour city)
-                        trip_varied = {
-                            "from": selected_trip["from"], "to": detour_city,
-                            "merchandise": selected_trip["merchandise"]
-                        }
-                        # trip's merchandise variation
-                        trip_varied["merchandise"] = trip_merchandise_variations(trip_varied)
-                        actual_route["route"].append(trip_varied)
+                        actual_route_trips.append(
+                            Trip(selected_trip.from_city, detour_city, trip_merchandise_variations(selected_trip, rng))
+                        )
 
                         # Add a detour trip (from the detour city to the original city)
-                        trip_varied = {
-                            "from": detour_city, "to": selected_trip["to"],
-                            "merchandise": selected_trip["merchandise"]
-                        }
-                        # trip's merchandise variation
-                        trip_varied["merchandise"] = trip_merchandise_variations(trip_varied)
-                        actual_route["route"].append(trip_varied)
+                        actual_route_trips.append(
+                            Trip(detour_city, selected_trip.to_city, trip_merchandise_variations(selected_trip, rng))
+                        )
 
-                        # update the current route cities list with the new detour city
-                        current_route_cities.append(detour_city)
+                    # update the current route cities list with the new detour city
+                    current_route_cities.append(detour_city)
+                    current_route_cities_set.add(detour_city)
 
-                        # increase the number of city variations
-                        num_of_city_variations += 1
+                    # increase the number of city variations
+                    num_of_city_variations += 1
                 else:
                     # Randomly decide to make a minor detour in middle of the route
-                    if random.choice([True, False]):
+                    if rng.choice([True, False]):
                         # Add a detour trip (from the original city to the detour city)
-                        trip_varied = {
-                            "from": selected_trip["from"], "to": detour_city,
-                            "merchandise": selected_trip["merchandise"]
-                        }
-                        # trip's merchandise variation
-                        trip_varied["merchandise"] = trip_merchandise_variations(trip_varied)
-                        actual_route["route"].append(trip_varied)
+                        actual_route_trips.append(
+                            Trip(selected_trip.from_city, detour_city, trip_merchandise_variations(selected_trip, rng))
+                        )
 
                         # Add the original trip (from the detour city to the original destination)
-                        trip_varied = {
-                            "from": detour_city, "to": selected_trip["to"],
-                            "merchandise": selected_trip["merchandise"]
-                        }
-                        # trip's merchandise variation
-                        trip_varied["merchandise"] = trip_merchandise_variations(trip_varied)
-                        actual_route["route"].append(trip_varied)
+                        actual_route_trips.append(
+                            Trip(detour_city, selected_trip.to_city, trip_merchandise_variations(selected_trip, rng))
+                        )
 
                         # update the current route cities list with the new detour city
                         current_route_cities.append(detour_city)
+                        current_route_cities_set.add(detour_city)
 
                         # increase the number of city variations
                         num_of_city_variations += 1
                     else:
                         # Keep the original trip
-                        actual_route["route"].append(selected_trip)
+                        instrumentation.count("retries.addition_kept_trip")
+                        actual_route_trips.append(selected_trip)
                         continue
             num_of_city_variations = 0
         elif action == "merchandise_variation":
             # add variations in the merchandise
-            actual_route["route"] = adjust_merchandise(copy.deepcopy(standard_route_["route"]))
+            actual_route_trips = adjust_merchandise(std_route_trips, rng)
+        instrumentation.count("action." + action)
+        instrumentation.record("action." + action, action_start)
 
         # add actual route variation to the list
+        actual_route_trips = tuple(actual_route_trips)
+        actual_route["route"] = route_to_dicts(actual_route_trips)
         actual_route_variations_of_current_std_route.append(actual_route)
+        variations_trips.append(actual_route_trips)
 
     return actual_route_variations_of_current_std_route
 
 
-def generate_actual_routes(standard_routes_, drivers_, min_variations_per_driver=1, max_variations_per_driver=3):
+def std_route_seed(seed, std_route_id):
+    """
+    Derive the seed of the random generator of one standard route from the master seed and the route id. The seed only
+    depends on these two values, so the routes generated for a standard route do not depend on the order in which
+    the standard routes are processed nor on the process that generates them.
+
+    :param seed: The master seed.
+    :param std_route_id: The id of the standard route.
+    :return: A 64-bit seed.
+    """
+    digest = hashlib.blake2b(f"{seed}:{std_route_id}".encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+def generate_actual_routes_for_std_route(std_route, drivers_, min_variations_per_driver, max_variations_per_driver,
+                                         rng=random, shard=0):
+    """
+    Generate the actual routes of one standard route and assign a driver to each of them. The ids of the routes are
+    allocated from the given shard (see RouteIdAllocator), the position of the standard route in its input, so the
+    ids are unique across the standard routes and do not depend on the process that generates them.
+
+    :param std_route: The standard route to vary.
+    :param drivers_: The drivers to use.
+    :param min_variations_per_driver: The minimum number of variations for the standard route.
+    :param max_variations_per_driver: The maximum number of variations for the standard route.
+    :param rng: The random generator to draw from.
+    :param shard: The shard of the ids of the actual routes.
+    :return: The actual routes of the standard route.
+    """
+    start = instrumentation.clock()
+
+    # Generate a random number of variations for each standard route
+    num_variations = rng.randint(min_variations_per_driver, max_variations_per_driver)
+    actual_routes = create_actual_routes_with_variations_for_std_route(
+        std_route, num_variations, rng, RouteIdAllocator(ACT_ROUTE_ID_PREFIX, shard)
+    )
+
+    # assign the driver to the actual route
+    for actual_route in actual_routes:
+        actual_route["driver"] = rng.choice(drivers_)
+
+    instrumentation.count("routes", len(actual_routes))
+    instrumentation.record("std_route", start)
+    return actual_routes
+
+
+def _generate_actual_routes_shard(args):
+    """
+    Worker of the process pool of iter_actual_routes(): generate the actual routes of a shard of standard routes,
+    each one with its own random generator seeded from the master seed and the route id.
+
+    :param args: ((position, standard route) pairs, drivers, min variations, max variations, master seed, instrument)
+                 tuple, the position of a standard route being the shard of the ids of its actual routes and
+                 instrument enabling the instrumentation of the worker for the shard
+    :return: (list with the actual routes of each standard route of the shard, instrumentation report or None) tuple
+    """
+    std_routes, drivers_, min_variations_per_driver, max_variations_per_driver, seed, instrument = args
+
+    if instrument:
+        instrumentation.enable()
+
+    actual_routes = [
+        generate_actual_routes_for_std_route(
+            std_route, drivers_, min_variations_per_driver, max_variations_per_driver,
+            random.Random(std_route_seed(seed, std_route["id"])), position
+        )
+        for position, std_route in std_routes
+    ]
+
+    return actual_routes, instrumentation.disable().report() if instrument else None
+
+
+def iter_actual_routes(standard_routes_, drivers_, min_variations_per_driver=1, max_variations_per_driver=3,
+                       seed=None, workers=None, shard_size=16):
     """
-    Generate a set of actual routes with variations from the given standard routes and drivers.
+    Generate actual routes with variations from the given standard routes and drivers, yielding them one by one in the
+    order of the standard routes, so that they can be streamed to a file in constant memory.
+
+    Without a seed and with a single worker, the routes are drawn from the global random module, as they always were.
+    With a seed, or with several workers, each standard route gets its own random.Random seeded from the master seed
+    and the route id, so the output is identical whatever the number of workers. With several workers, the standard
+    routes are split into shards processed by a process pool; only a bounded number of shards is in flight at once.
+
+    :param standard_routes_: The standard routes to use (any iterable).
+    :param drivers_: The drivers to use.
+    :param min_variations_per_driver: The minimum number of variations for each standard route for each driver.
+    :param max_variations_per_driver: The maximum number of variations for each standard route for each driver.
+    :param seed: The master seed (default: drawn from the global random module when needed).
+    :param workers: The number of worker processes (default: 1, 0 for one per CPU core).
+    :param shard_size: The number of standard routes sent to a worker at once.
+
+    :return: A generator of actual routes.
+    """
+    if workers is None:
+        workers = 1
+    elif workers == 0:
+        workers = os.cpu_count() or 1
+
+    if seed is None and workers == 1:
+        for position, std_route in enumerate(standard_routes_):
+            yield from generate_actual_routes_for_std_route(
+                std_route, drivers_, min_variations_per_driver, max_variations_per_driver, shard=position
+            )
+        return
+
+    if seed is None:
+        seed = random.getrandbits(64)
+
+    # the workers of the pool instrument their shards when the instrumentation is enabled here, and the reports are
+    # merged into it (in this process, the hooks record into it directly)
+    run_instrumentation = instrumentation.get_instrumentation()
+    standard_routes_ = enumerate(standard_routes_)
+    shards = (
+        (shard, drivers_, min_variations_per_driver, max_variations_per_driver, seed,
+         workers > 1 and run_instrumentation is not None)
+        for shard in iter(lambda: list(itertools.islice(standard_routes_, shard_size)), [])
+    )
+
+    if workers == 1:
+        for shard in shards:
+            for current_actual_routes_variations in _generate_actual_routes_shard(shard)[0]:
+                yield from current_actual_routes_variations
+        return
+
+    def shard_routes(future):
+        actual_routes, report = future.result()
+        if report is not None:
+            run_instrumentation.merge(report)
+        return actual_routes
+
+    # load the city data once so that forked workers inherit it, and give the workers the context of this process
+    data_context = get_data_context().warm()
+    with ProcessPoolExecutor(max_workers=workers, initializer=set_data_context, initargs=(data_context,)) as executor:
+        pending = collections.deque()
+        for shard in shards:
+            pending.append(executor.submit(_generate_actual_routes_shard, shard))
+            # keep at most two shards per worker in flight, so memory does not grow with the number of routes
+            if len(pending) >= 2 * workers:
+                for current_actual_routes_variations in shard_routes(pending.popleft()):
+                    yield from current_actual_routes_variations
+
+        while pending:
+            for current_actual_routes_variations in shard_routes(pending.popleft()):
+                yield from current_actual_routes_variations
+
+
+def generate_actual_routes(standard_routes_, drivers_, min_variations_per_driver=1, max_variations_per_driver=3,
+                           seed=None, workers=None, shard_size=16):
+    """
+    Generate a set of actual routes with variations from the given standard routes and drivers. See
+    iter_actual_routes() for the seed and workers parameters, and to stream the routes instead of building a list.
 
     :param standard_routes_: The standard routes to use.
     :param drivers_: The drivers to use.
     :param min_variations_per_driver: The minimum number of variations for each standard route for each driver.
     :param max_variations_per_driver: The maximum number of variations for each standard route for each driver.
+    :param seed: The master seed (default: drawn from the global random module when needed).
+    :param workers: The number of worker processes (default: 1, 0 for one per CPU core).
+    :param shard_size: The number of standard routes sent to a worker at once.
 
     :return: A set of actual routes with variations from the given standard routes and drivers.
     """
-    actual_routes = []
-
-    for std_route in standard_routes_:
-        print(f"Generating actual routes for standard route {std_route['id']}")
-        # Generate a random number of variations for each standard route
-        num_variations = random.randint(min_variations_per_driver, max_variations_per_driver)
-        current_actual_routes_variations = create_actual_routes_with_variations_for_std_route(std_route, num_variations)
-        print(f"Generated {len(current_actual_routes_variations)} actual route variations.")
-        # assign the driver to the actual route
-        for actual_route in current_actual_routes_variations:
-            actual_route["driver"] = random.choice(drivers_)
-            # add the actual route to the list of actual routes
-            actual_routes.append(actual_route)
-
-    print(f"Generated {len(actual_routes)} actual routes with variations")
+    if seed is None and workers in (None, 1):
+        actual_routes = []
+        for position, std_route in enumerate(standard_routes_):
+            print(f"Generating actual routes for standard route {std_route['id']}")
+            current_actual_routes_variations = generate_actual_routes_for_std_route(
+                std_route, drivers_, min_variations_per_driver, max_variations_per_driver, shard=position
+            )
+            print(f"Generated {len(current_actual_routes_variations)} actual route variations.")
+            # add the actual routes to the list of actual routes
+            actual_routes.extend(current_actual_routes_variations)
+
+        print(f"Generated {len(actual_routes)} actual routes with variations")
+        return actual_routes
+
+    # the standard routes can be any iterable, they are counted as they are consumed
+    num_standard_routes = 0
+
+    def counted_standard_routes():
+        nonlocal num_standard_routes
+        for std_route in standard_routes_:
+            num_standard_routes += 1
+            yield std_route
+
+    actual_routes = list(iter_actual_routes(
+        counted_standard_routes(), drivers_, min_variations_per_driver, max_variations_per_driver, seed, workers,
+        shard_size
+    ))
+
+    print(f"Generated {len(actual_routes)} actual routes with variations from {num_standard_routes} standard routes")
     return actual_routes
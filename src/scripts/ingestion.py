@@ -0,0 +1,322 @@
+import asyncio
+import json
+import sys
+import time
+from array import array
+
+import numpy as np
+
+from src.constants import *
+
+
+# fields of an actual route record
+ROUTE_FIELDS = ("id", "route", "sroute", "driver")
+
+# bytes of the standard input read at a time when it is a regular file
+STDIN_CHUNK_SIZE = 1 << 16
+
+
+def validate_route(route, cities=frozenset(CITIES), merchandise=frozenset(MERCHANDISE_TYPES)):
+    """
+    Check that an actual route record follows the schema of the generated routes: string "id", "sroute" and "driver",
+    and a non-empty "route" list of trips between two different known cities, carrying known items in positive integer
+    quantities.
+
+    :param route: the decoded record
+    :param cities: the known cities
+    :param merchandise: the known merchandise items
+    :raise ValueError: with the first problem found
+    """
+    if not isinstance(route, dict):
+        raise ValueError("a route must be a JSON object")
+
+    for field in ROUTE_FIELDS:
+        if field not in route:
+            raise ValueError(f"missing field {field!r}")
+    for field in ("id", "sroute", "driver"):
+        if not isinstance(route[field], str):
+            raise ValueError(f"field {field!r} must be a string")
+
+    trips = route["route"]
+    if not isinstance(trips, list) or not trips:
+        raise ValueError("field 'route' must be a non-empty list of trips")
+
+    for i, trip in enumerate(trips):
+        if not isinstance(trip, dict) or "from" not in trip or "to" not in trip or "merchandise" not in trip:
+            raise ValueError(f"trip {i} must be an object with 'from', 'to' and 'merchandise'")
+        for end in ("from", "to"):
+            if not isinstance(trip[end], str):
+                raise ValueError(f"trip {i}: {end!r} must be a string")
+            if trip[end] not in cities:
+                raise ValueError(f"trip {i}: unknown city {trip[end]!r}")
+        if trip["from"] == trip["to"]:
+            raise ValueError(f"trip {i} goes from {trip['from']!r} to itself")
+        if not isinstance(trip["merchandise"], dict):
+            raise ValueError(f"trip {i}: 'merchandise' must be an object")
+        for item, quantity in trip["merchandise"].items():
+            if not isinstance(item, str):
+                raise ValueError(f"trip {i}: merchandise items must be strings")
+            if item not in merchandise:
+                raise ValueError(f"trip {i}: unknown merchandise {item!r}")
+            if not isinstance(quantity, int) or isinstance(quantity, bool) or quantity <= 0:
+                raise ValueError(f"trip {i}: quantity of {item!r} must be a positive integer")
+
+
+class RouteIngestionService:
+    """
+    An asyncio front-end ingesting live actual routes as NDJSON records (one route per line) from local sockets or
+    stdin, validating them and passing them to the analysis pipeline in micro-batches.
+
+    Valid routes go through a bounded queue: when the pipeline falls behind and the queue is full, the connections
+    stop being read until there is room again, so the backpressure reaches the senders (through the socket buffers)
+    instead of the memory growing. Invalid records are counted and answered on the connection with an error line,
+    including the lines longer than the limit of the stream reader, which are skipped up to their newline.
+
+    The sink is called with every batch (a list of routes), when batch_size routes are waiting or batch_interval
+    seconds after the first one arrived. It runs on the event loop, so it must be quick (e.g.
+    DriverPreferenceModel.add_routes), or be a coroutine function. A batch whose sink call raises is counted as
+    failed (with its routes) and the service goes on with the next batches.
+    """
+
+    def __init__(self, sink, batch_size=256, batch_interval=0.05, queue_size=8192, cities=CITIES,
+                 merchandise=MERCHANDISE_TYPES):
+        """
+        Initialize the RouteIngestionService class.
+
+        :param sink: function or coroutine function called with every batch of valid routes
+        :param batch_size: maximum number of routes per batch
+        :param batch_interval: maximum time a route waits for its batch to fill, in seconds
+        :param queue_size: maximum number of valid routes waiting for a batch
+        :param cities: the known cities
+        :param merchandise: the known merchandise items
+        """
+        self.sink = sink
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.queue_size = queue_size
+        self.cities = frozenset(cities)
+        self.merchandise = frozenset(merchandise)
+
+        self.queue = None
+        self.batcher = None
+        self.servers = []
+
+        self.received = 0
+        self.invalid = 0
+        self.processed = 0
+        self.batches = 0
+        self.failed = 0  # routes of the batches whose sink call raised
+        self.sink_errors = 0
+        self.last_sink_error = None
+        self.max_queued = 0
+        self.latencies = array("d")  # seconds from the reception of every route to the end of its batch
+        self.start_time = None
+
+    async def start(self):
+        """
+        Start the batching task (the servers are started by serve_unix(), serve_tcp() or serve_stdin()).
+        """
+        self.queue = asyncio.Queue(self.queue_size)
+        self.batcher = asyncio.create_task(self._batch_loop())
+        self.start_time = time.perf_counter()
+
+    async def close(self):
+        """
+        Stop the servers, then wait for the queued routes to be passed to the sink.
+        """
+        for server in self.servers:
+            server.close()
+            await server.wait_closed()
+        self.servers = []
+
+        await self.queue.put(None)  # end of the batches
+        await self.batcher
+
+    async def serve_unix(self, path):
+        """
+        Accept NDJSON connections on a Unix socket.
+
+        :param path: path of the socket
+        """
+        self.servers.append(await asyncio.start_unix_server(self.handle_connection, path))
+
+    async def serve_tcp(self, host="127.0.0.1", port=0):
+        """
+        Accept NDJSON connections on a TCP socket.
+
+        :param host: host of the socket (default: local connections only)
+        :param port: port of the socket (0 for a free port)
+        :return: the port of the socket
+        """
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        self.servers.append(server)
+        return server.sockets[0].getsockname()[1]
+
+    async def serve_stdin(self):
+        """
+        Ingest the NDJSON records of the standard input until its end.
+        """
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader(limit=2 ** 24)
+        try:
+            await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+        except ValueError:
+            # a regular file cannot be read asynchronously, it is read by a thread in chunks of about STDIN_CHUNK_SIZE
+            # bytes, the next chunk being read once the lines of the previous one are queued (backpressure)
+            while True:
+                lines = await loop.run_in_executor(None, sys.stdin.buffer.readlines, STDIN_CHUNK_SIZE)
+                if not lines:
+                    return
+                for line in lines:
+                    await self.ingest_line(line)
+
+        await self.handle_stream(reader)
+
+    async def handle_connection(self, reader, writer):
+        try:
+            await self.handle_stream(reader, writer)
+        finally:
+            writer.close()
+
+    async def handle_stream(self, reader, writer=None):
+        """
+        Ingest the NDJSON records of a stream until its end, answering invalid ones on the writer if any.
+        """
+        while True:
+            line = await self._read_line(reader)
+            if line is None:
+                self.received += 1
+                error = self._reject("record longer than the line limit of the stream")
+            elif not line:
+                break
+            else:
+                error = await self.ingest_line(line)
+
+            if error is not None and writer is not None:
+                writer.write(json.dumps(error).encode("utf-8") + b"\n")
+                await writer.drain()
+
+    @staticmethod
+    async def _read_line(reader):
+        """
+        Read the next line of a stream. A line longer than the limit of the reader is skipped up to its newline, so
+        the next line is read from its start.
+
+        :return: the line (b"" at the end of the stream), None for a line longer than the limit
+        """
+        try:
+            return await reader.readuntil(b"\n")
+        except asyncio.IncompleteReadError as e:
+            return e.partial  # the last line, without a newline
+        except asyncio.LimitOverrunError as e:
+            consumed = e.consumed
+
+        # drop the bytes scanned so far and look for the newline again, until it is found or the stream ends
+        while True:
+            await reader.readexactly(consumed)
+            try:
+                await reader.readuntil(b"\n")
+                return None
+            except asyncio.IncompleteReadError:
+                return None
+            except asyncio.LimitOverrunError as e:
+                consumed = e.consumed
+
+    def _reject(self, message, route=None):
+        """
+        Count an invalid record and get its error dictionary.
+        """
+        self.invalid += 1
+        return {"error": message, "id": route.get("id") if isinstance(route, dict) else None}
+
+    async def ingest_line(self, line):
+        """
+        Decode, validate and queue one NDJSON record (waiting for room in the queue).
+
+        :param line: the record, as bytes
+        :return: None if the route was queued, an error dictionary otherwise (None for blank lines)
+        """
+        if not line.strip():
+            return None
+
+        received = time.perf_counter()
+        self.received += 1
+        route = None
+        try:
+            route = json.loads(line)
+            validate_route(route, self.cities, self.merchandise)
+        except ValueError as e:  # json.JSONDecodeError is a ValueError
+            return self._reject(str(e), route)
+        except RecursionError:
+            return self._reject("record nested too deeply")
+
+        await self.queue.put((received, route))
+        self.max_queued = max(self.max_queued, self.queue.qsize())
+        return None
+
+    async def _batch_loop(self):
+        """
+        Collect the queued routes in batches and pass them to the sink, until close().
+        """
+        loop = asyncio.get_running_loop()
+        is_coroutine = asyncio.iscoroutinefunction(self.sink)
+        done = False
+        while not done:
+            item = await self.queue.get()
+            if item is None:
+                break
+
+            batch = [item]
+            deadline = loop.time() + self.batch_interval
+            while len(batch) < self.batch_size:
+                # take what is already queued without waiting, then wait until the deadline
+                try:
+                    item = self.queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self.queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                if item is None:
+                    done = True
+                    break
+                batch.append(item)
+
+            routes = [route for _, route in batch]
+            try:
+                if is_coroutine:
+                    await self.sink(routes)
+                else:
+                    self.sink(routes)
+            except Exception as e:
+                # the batcher must keep running: if it stopped, the readers would block forever on the full queue
+                self.sink_errors += 1
+                self.failed += len(batch)
+                self.last_sink_error = repr(e)
+                continue
+
+            end = time.perf_counter()
+            self.latencies.extend(end - received for received, _ in batch)
+            self.processed += len(batch)
+            self.batches += 1
+
+    def stats(self):
+        """
+        Get the statistics of the service since its start.
+
+        :return: dictionary of the counts (failed: routes of the batches whose sink call raised), the throughput
+                 (processed routes per second), the mean batch size and the p50 / p99 latencies in milliseconds
+        """
+        elapsed = time.perf_counter() - self.start_time
+        latencies = np.frombuffer(self.latencies, dtype=np.float64) if len(self.latencies) else np.zeros(1)
+        return {
+            "received": self.received, "invalid": self.invalid, "processed": self.processed, "batches": self.batches,
+            "failed": self.failed, "sink_errors": self.sink_errors, "last_sink_error": self.last_sink_error,
+            "queued": self.queue.qsize(), "max_queued": self.max_queued, "elapsed_s": elapsed,
+            "routes_per_s": self.processed / elapsed,
+            "mean_batch": self.processed / self.batches if self.batches else 0.0,
+            "p50_ms": float(np.percentile(latencies, 50) * 1000), "p99_ms": float(np.percentile(latencies, 99) * 1000),
+        }
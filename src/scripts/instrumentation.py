@@ -0,0 +1,263 @@
+import collections
+import json
+import time
+
+
+# the enabled Instrumentation, None when instrumentation is disabled (the hooks then only test this global)
+_active = None
+
+
+class _NullTimer:
+    """
+    The timer returned when instrumentation is disabled: a context manager doing nothing.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+    """
+    A context manager adding its duration to a timer of an Instrumentation.
+    """
+
+    __slots__ = ("timers", "name", "start")
+
+    def __init__(self, timers, name):
+        self.timers = timers
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self.start
+        timer = self.timers[self.name]
+        timer[0] += 1
+        timer[1] += elapsed
+        if elapsed > timer[2]:
+            timer[2] = elapsed
+        return False
+
+
+class Instrumentation:
+    """
+    Counters and timers of a run, filled by the hooks of the generator (see count() and timer()) while enabled.
+    """
+
+    def __init__(self):
+        """
+        Initialize the Instrumentation class.
+        """
+        self.counters = collections.Counter()
+        self.timers = collections.defaultdict(lambda: [0, 0.0, 0.0])  # name -> [count, total s, max s]
+        self.start = time.perf_counter()
+
+    def merge(self, report):
+        """
+        Add the counters and timers of a report (e.g. of a worker process) to this instrumentation.
+
+        :param report: a report returned by report()
+        """
+        self.counters.update(report["counters"])
+        for name, timer in report["timers"].items():
+            current = self.timers[name]
+            current[0] += timer["count"]
+            current[1] += timer["total_s"]
+            current[2] = max(current[2], timer["max_s"])
+
+    def report(self):
+        """
+        Get the structured report of the run.
+
+        :return: {"wall_s", "counters", "timers": {name: {"count", "total_s", "mean_us", "max_s"}}} dictionary
+        """
+        return {
+            "wall_s": time.perf_counter() - self.start,
+            "counters": dict(sorted(self.counters.items())),
+            "timers": {
+                name: {"count": count, "total_s": total, "mean_us": total / count * 1e6 if count else 0.0,
+                       "max_s": maximum}
+                for name, (count, total, maximum) in sorted(self.timers.items())
+            },
+        }
+
+    def format_report(self):
+        """
+        Get the report as a text table, the timers by decreasing total time.
+        """
+        report = self.report()
+        lines = [f"wall time: {report['wall_s']:.3f}s", "", f"{'counter':<40} {'value':>12}"]
+        lines += [f"{name:<40} {value:12d}" for name, value in report["counters"].items()]
+        lines += ["", f"{'timer':<40} {'count':>10} {'total s':>10} {'mean us':>10} {'max ms':>10}"]
+        for name, timer in sorted(report["timers"].items(), key=lambda item: -item[1]["total_s"]):
+            lines.append(f"{name:<40} {timer['count']:10d} {timer['total_s']:10.3f} {timer['mean_us']:10.2f} "
+                         f"{timer['max_s'] * 1000:10.3f}")
+
+        return "\n".join(lines)
+
+    def write_report(self, path):
+        """
+        Write the report to a JSON file.
+
+        :param path: path of the file
+        """
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=4)
+
+
+def get_instrumentation():
+    """
+    Get the enabled Instrumentation, or None when instrumentation is disabled.
+    """
+    return _active
+
+
+def enable():
+    """
+    Enable instrumentation with new counters and timers.
+
+    :return: the Instrumentation collecting them
+    """
+    global _active
+    _active = Instrumentation()
+    return _active
+
+
+def disable():
+    """
+    Disable instrumentation.
+
+    :return: the Instrumentation that was enabled, or None
+    """
+    global _active
+    instrumentation, _active = _active, None
+    return instrumentation
+
+
+def count(name, n=1):
+    """
+    Add n to a counter (no-op when instrumentation is disabled).
+
+    :param name: name of the counter
+    :param n: value to add
+    """
+    if _active is not None:
+        _active.counters[name] += n
+
+
+def timer(name):
+    """
+    Get a context manager timing its block (a shared no-op when instrumentation is disabled).
+
+    :param name: name of the timer
+    :return: the context manager
+    """
+    if _active is None:
+        return _NULL_TIMER
+
+    return _Timer(_active.timers, name)
+
+
+def clock():
+    """
+    Get the start time of a timed section for record(), without a with block (None when instrumentation is disabled).
+    """
+    if _active is None:
+        return None
+
+    return time.perf_counter()
+
+
+def record(name, start):
+    """
+    Add the time elapsed since a clock() start to a timer (no-op when instrumentation is disabled).
+
+    :param name: name of the timer
+    :param start: the value returned by clock() at the start of the section
+    """
+    if start is None or _active is None:
+        return
+
+    elapsed = time.perf_counter() - start
+    timer = _active.timers[name]
+    timer[0] += 1
+    timer[1] += elapsed
+    if elapsed > timer[2]:
+        timer[2] = elapsed
+
+
+class instrumented:
+    """
+    A context manager enabling instrumentation for its block, optionally under a profiler:
+
+    - "cprofile": the standard library cProfile, the stats are dumped to profile_path (for pstats or snakeviz)
+    - "pyinstrument": the optional pyinstrument sampling profiler, its HTML report is written to profile_path
+
+    Profilers only see the current process, not the workers of a process pool (whose counters and timers are merged
+    into the report by the generator).
+
+        with instrumented(profile="cprofile", profile_path="run.prof") as instrumentation:
+            ...
+        print(instrumentation.format_report())
+    """
+
+    def __init__(self, profile=None, profile_path=None, report_path=None):
+        """
+        Initialize the instrumented class.
+
+        :param profile: None, "cprofile" or "pyinstrument"
+        :param profile_path: path of the profile dump (default: run.prof or run.html)
+        :param report_path: path of the JSON report written at the end of the block (None: not written)
+        """
+        if profile not in (None, "cprofile", "pyinstrument"):
+            raise ValueError(f"unknown profiler {profile!r}, expected 'cprofile' or 'pyinstrument'")
+
+        self.profile = profile
+        self.profile_path = profile_path or ("run.prof" if profile == "cprofile" else "run.html")
+        self.report_path = report_path
+        self.profiler = None
+        self.instrumentation = None
+
+    def __enter__(self):
+        if self.profile == "cprofile":
+            import cProfile
+
+            self.profiler = cProfile.Profile()
+        elif self.profile == "pyinstrument":
+            try:
+                from pyinstrument import Profiler
+            except ImportError:
+                raise ImportError("the pyinstrument profiler needs the pyinstrument package (pip install pyinstrument)")
+
+            self.profiler = Profiler()
+
+        self.instrumentation = enable()
+        if self.profile == "cprofile":
+            self.profiler.enable()
+        elif self.profile == "pyinstrument":
+            self.profiler.start()
+
+        return self.instrumentation
+
+    def __exit__(self, *exc_info):
+        if self.profile == "cprofile":
+            self.profiler.disable()
+            self.profiler.dump_stats(self.profile_path)
+        elif self.profile == "pyinstrument":
+            self.profiler.stop()
+            with open(self.profile_path, "w") as f:
+                f.write(self.profiler.output_html())
+
+        disable()
+        if self.report_path is not None:
+            self.instrumentation.write_report(self.report_path)
+
+        return False
@@ -0,0 +1,122 @@
+import numpy as np
+from .utils import EARTH_MEAN_RADIUS_KM
+
+
+class NeighbourIndex:
+    """
+    A k-nearest-neighbour index over a set of cities. For every city it stores the ids of its neighbours sorted by
+    increasing distance (the city itself excluded) as one int array, so that the "k nearest cities excluding a set of
+    cities" queries of the route generator are answered with a slice instead of a sort of the distance matrix.
+    """
+
+    def __init__(self, cities, neighbours, distances=None):
+        """
+        Initialize the NeighbourIndex class. Use from_distance_matrix() or from_coordinates() to build one.
+
+        :param cities: the N city names
+        :param neighbours: (N, K) int array, row i holds the ids of the K closest cities to city i, closest first
+        :param distances: optional (N, K) array with the matching distances in km
+        """
+        self.cities = list(cities)
+        self.city2id = {city: i for i, city in enumerate(self.cities)}
+        self.neighbours = np.ascontiguousarray(neighbours, dtype=np.int32)
+        self.distances = distances
+
+        if self.neighbours.ndim != 2 or self.neighbours.shape[0] != len(self.cities):
+            raise ValueError(f"neighbours must be a ({len(self.cities)}, K) array, got {self.neighbours.shape}")
+
+    @classmethod
+    def from_distance_matrix(cls, matrix, cities, k=None):
+        """
+        Build the index from a dense distance matrix. With k=None every city keeps the full sorted list of the other
+        cities (argsort), otherwise only its k closest ones (argpartition, then argsort of the k candidates).
+
+        :param matrix: (N, N) distance matrix, NaN on the diagonal
+        :param cities: the N city names
+        :param k: number of neighbours to keep per city (default: all of them)
+        :return: the neighbour index
+        """
+        matrix = np.array(matrix, dtype=np.float64)
+        n = matrix.shape[0]
+        # a city is never its own neighbour, and missing distances sort last
+        np.fill_diagonal(matrix, np.inf)
+        matrix[np.isnan(matrix)] = np.inf
+
+        if k is None or k >= n - 1:
+            neighbours = np.argsort(matrix, axis=1, kind="stable")[:, :n - 1]
+        else:
+            candidates = np.argpartition(matrix, k - 1, axis=1)[:, :k]
+            order = np.argsort(np.take_along_axis(matrix, candidates, axis=1), axis=1, kind="stable")
+            neighbours = np.take_along_axis(candidates, order, axis=1)
+
+        distances = np.take_along_axis(matrix, neighbours, axis=1)
+        return cls(cities, neighbours, distances)
+
+    @classmethod
+    def from_coordinates(cls, cities, coords, k):
+        """
+        Build the index of the k closest cities from (lat, lng) coordinates, without a dense distance matrix, using a
+        BallTree with the haversine metric. This is what scales to thousands of cities.
+
+        :param cities: the N city names
+        :param coords: (N, 2) array of (lat, lng) coordinates in degrees
+        :param k: number of neighbours to keep per city
+        :return: the neighbour index
+        """
+        from sklearn.neighbors import BallTree
+
+        coords = np.radians(np.asarray(coords, dtype=np.float64))
+        n = coords.shape[0]
+        k = min(k, n - 1)
+
+        tree = BallTree(coords, metric="haversine")
+        distances, ids = tree.query(coords, k=k + 1)
+
+        # drop the city itself from each row (it is not necessarily first when two cities share coordinates)
+        is_self = ids == np.arange(n)[:, None]
+        no_self = ~is_self.any(axis=1)
+        is_self[no_self, -1] = True
+        keep = ~is_self
+        neighbours = ids[keep].reshape(n, k)
+        distances = distances[keep].reshape(n, k) * EARTH_MEAN_RADIUS_KM
+
+        return cls(cities, neighbours, distances)
+
+    def __len__(self):
+        return len(self.cities)
+
+    @property
+    def max_k(self):
+        """
+        Number of neighbours stored per city.
+        """
+        return self.neighbours.shape[1]
+
+    def closest_ids(self, city_id, k, exclude_ids=()):
+        """
+        Get the ids of the k closest cities to the given city, skipping the excluded ones. Fewer than k ids are
+        returned only if the index does not hold enough neighbours for this city.
+
+        :param city_id: id of the city
+        :param k: number of closest cities to return
+        :param exclude_ids: ids of the cities to skip
+        :return: list of city ids, closest first
+        """
+        if not exclude_ids:
+            return self.neighbours[city_id, :k].tolist()
+
+        # at most len(exclude_ids) of the first k + len(exclude_ids) neighbours can be excluded
+        candidates = self.neighbours[city_id, :k + len(exclude_ids)].tolist()
+        return [i for i in candidates if i not in exclude_ids][:k]
+
+    def closest(self, city, k=5, exclude=()):
+        """
+        Get the names of the k closest cities to the given city, skipping the excluded ones.
+
+        :param city: name of the city
+        :param k: number of closest cities to return
+        :param exclude: names of the cities to skip
+        :return: list of city names, closest first
+        """
+        exclude_ids = {self.city2id[c] for c in exclude if c in self.city2id}
+        return [self.cities[i] for i in self.closest_ids(self.city2id[city], k, exclude_ids)]
@@ -0,0 +1,382 @@
+import heapq
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from src.constants import *
+from .artifact_cache import table_hash
+from .compensation import city_distance_matrix
+from .data_context import get_data_context, set_data_context
+from .neighbours import NeighbourIndex
+from .route_table import RouteTable
+
+
+# additive smoothing of the transition counts, so that unseen transitions to neighbouring cities stay possible
+TRANSITION_SMOOTHING = 0.5
+
+
+def normalize_city_name(city):
+    """
+    Normalize a city name as in the results files: lower case, spaces and hyphens replaced by underscores.
+
+    :param city: name of the city
+    :return: the normalized name
+    """
+    return city.replace("-", " ").strip().lower().replace(" ", "_")
+
+
+def city_space(cities):
+    """
+    Get the cities a perfect route through some cities is searched over, with their distances and neighbour index: all
+    the cities of the data context when it has a dense distance matrix holding the given cities, else the given cities
+    alone, their distances being computed from their coordinates (see compensation.city_distance_matrix()), e.g. for
+    routes generated over a cities database.
+
+    :param cities: names of the cities of a driver's routes
+    :return: (city names, (N, N) distance matrix in km, NeighbourIndex) tuple
+    """
+    data_context = get_data_context()
+    if data_context.matrix_path is not None and set(cities) <= set(data_context.cities):
+        return data_context.cities, data_context.matrix, data_context.neighbour_index
+
+    # sorted, so the city ids (and the ties of the search) do not depend on the vocabulary of the route table
+    cities = sorted(cities)
+    matrix = city_distance_matrix(cities)
+    return cities, matrix, NeighbourIndex.from_distance_matrix(matrix, cities)
+
+
+class DriverProfile:
+    """
+    The frequency tables of a driver's actual routes the perfect route is built from: how often each city starts a
+    route, how often each (from, to) transition is taken, and which merchandise is carried on each transition. City ids
+    are those of the cities the perfect route is searched over (see city_space()).
+    """
+
+    def __init__(self, driver, starts, successors, trip_merchandise, default_merchandise, route_length, trip_km,
+                 cities, matrix, neighbour_index):
+        """
+        Initialize the DriverProfile class.
+
+        :param driver: driver id
+        :param starts: {city id: number of routes starting there}
+        :param successors: {city id: {next city id: number of trips}}
+        :param trip_merchandise: {(from id, to id): typical merchandise dictionary of the transition}
+        :param default_merchandise: typical merchandise dictionary of all the driver's trips
+        :param route_length: typical number of trips of the driver's routes
+        :param trip_km: mean length of the driver's trips, in km
+        :param cities: names of the cities the perfect route is searched over, the city ids indexing them
+        :param matrix: (N, N) distance matrix of the cities, in km
+        :param neighbour_index: NeighbourIndex of the cities
+        """
+        self.driver = driver
+        self.starts = starts
+        self.successors = successors
+        self.trip_merchandise = trip_merchandise
+        self.default_merchandise = default_merchandise
+        self.route_length = route_length
+        self.trip_km = trip_km
+        self.cities = cities
+        self.matrix = matrix
+        self.neighbour_index = neighbour_index
+
+    @classmethod
+    def from_table(cls, table, driver):
+        """
+        Build the profile of a driver from the driver's actual routes.
+
+        :param table: RouteTable of the driver's routes
+        :param driver: driver id
+        :return: the driver profile
+        """
+        # the table can hold the names of other drivers' cities, only the cities of the trips are mapped
+        used = np.unique(np.concatenate([table.trip_from, table.trip_to]))
+        cities, matrix, neighbour_index = city_space([table.cities[city] for city in used.tolist()])
+        city_map = np.full(len(table.cities), -1, dtype=np.int64)
+        city_map[used] = [neighbour_index.city2id[table.cities[city]] for city in used.tolist()]
+        trip_from, trip_to = city_map[table.trip_from], city_map[table.trip_to]
+        num_cities = len(cities)
+
+        # the first trip and the length of every route with trips
+        trips_per_route = table.trips_per_route()
+        first_trips = table.trip_offsets[:-1][trips_per_route > 0]
+        route_lengths = trips_per_route[trips_per_route > 0]
+        starts = dict(zip(*(a.tolist() for a in np.unique(trip_from[first_trips], return_counts=True))))
+
+        successors = {}
+        pairs, counts = np.unique(trip_from * num_cities + trip_to, return_counts=True)
+        for pair, count in zip(pairs.tolist(), counts.tolist()):
+            successors.setdefault(pair // num_cities, {})[pair % num_cities] = count
+
+        # merchandise entries grouped by the transition of their trip
+        merch_trips = np.repeat(np.arange(table.num_trips), np.diff(table.merch_offsets))
+        merch_pairs = (trip_from * num_cities + trip_to)[merch_trips]
+        order = np.argsort(merch_pairs, kind="stable")
+        entry_starts = np.searchsorted(merch_pairs[order], pairs, side="left").tolist()
+        entry_ends = np.searchsorted(merch_pairs[order], pairs, side="right").tolist()
+        trip_merchandise = {
+            divmod(pair, num_cities): cls._typical_merchandise(table, order[lo:hi], count)
+            for pair, lo, hi, count in zip(pairs.tolist(), entry_starts, entry_ends, counts.tolist())
+        }
+        default_merchandise = cls._typical_merchandise(table, np.arange(len(merch_trips)), table.num_trips)
+
+        trip_km = float(np.nanmean(matrix[trip_from, trip_to])) if table.num_trips else 1.0
+
+        return cls(driver, starts, successors, trip_merchandise, default_merchandise,
+                   int(np.median(route_lengths)) if len(route_lengths) else 0, trip_km, cities, matrix, neighbour_index)
+
+    @staticmethod
+    def _typical_merchandise(table, entries, num_trips):
+        """
+        Get the typical merchandise of a set of trips: their usual number of items, taken among the most frequent
+        items, each with its mean quantity.
+        """
+        if not num_trips or not len(entries):
+            return {}
+
+        items, inverse, counts = np.unique(table.merch_items[entries], return_inverse=True, return_counts=True)
+        quantities = np.bincount(inverse.ravel(), weights=table.merch_quantities[entries])
+        num_items = max(int(round(len(entries) / num_trips)), 1)
+        # most frequent first, ties broken by item id
+        order = np.lexsort((items, -counts))[:num_items]
+
+        return {table.merchandise[items[i]]: int(round(quantities[i] / counts[i])) for i in order}
+
+
+class PerfectRouteSolver:
+    """
+    Build a driver's perfect route: the connected sequence of cities maximizing the log-likelihood of its transitions
+    under the driver's transition frequencies, minus a penalty for the length of its trips, with the driver's typical
+    merchandise on every trip.
+
+    The search is a beam search over the route length. From each city, the candidate next cities are the ones the
+    driver went to from there plus its closest cities in the neighbour index, instead of all the cities, and a route
+    never takes the same transition twice. The search stops at the time budget, returning the best route found so far
+    (shorter than the target length).
+    """
+
+    def __init__(self, beam_width=32, time_budget=1.0, num_neighbours=8, distance_weight=1.0, route_length=None):
+        """
+        Initialize the PerfectRouteSolver class.
+
+        :param beam_width: number of partial routes kept at each step
+        :param time_budget: time budget per driver, in seconds (None: no limit)
+        :param num_neighbours: closest cities added to the candidate next cities
+        :param distance_weight: weight of the trip length penalty (trip km / driver's mean trip km)
+        :param route_length: number of trips of the perfect routes (default: the driver's typical route length)
+        """
+        self.beam_width = beam_width
+        self.time_budget = time_budget
+        self.num_neighbours = num_neighbours
+        self.distance_weight = distance_weight
+        self.route_length = route_length
+
+    def candidates(self, profile, city):
+        """
+        Get the candidate next cities of a city with their transition score (smoothed log-probability minus the
+        distance penalty).
+
+        :param profile: the driver profile
+        :param city: city id
+        :return: list of (score, next city id) tuples
+        """
+        observed = profile.successors.get(city, {})
+        next_cities = set(observed) | set(profile.neighbour_index.closest_ids(city, self.num_neighbours))
+        next_cities.discard(city)
+
+        total = sum(observed.values()) + TRANSITION_SMOOTHING * len(next_cities)
+        distances = profile.matrix[city]
+        return [
+            (math.log((observed.get(n, 0) + TRANSITION_SMOOTHING) / total)
+             - self.distance_weight * float(distances[n]) / profile.trip_km, n)
+            for n in sorted(next_cities)
+        ]
+
+    def solve(self, profile):
+        """
+        Find the perfect route of a driver.
+
+        :param profile: the driver profile
+        :return: (cities, score, complete) tuple: the city ids of the route, its score, and False if the time budget
+                 stopped the search before the target length; the route is empty when the driver's routes have no
+                 trips
+        """
+        if not profile.starts:
+            return [], 0.0, True
+
+        deadline = None if self.time_budget is None else time.perf_counter() + self.time_budget
+        length = self.route_length or profile.route_length
+        candidates = {}  # city -> candidates, computed once per city
+
+        total_starts = sum(profile.starts.values())
+        beam = heapq.nlargest(self.beam_width, (
+            (math.log(count / total_starts), (city,)) for city, count in profile.starts.items()
+        ))
+
+        for _ in range(length):
+            if deadline is not None and time.perf_counter() > deadline:
+                return list(beam[0][1]), beam[0][0], False
+
+            extended = []
+            for score, cities in beam:
+                last = cities[-1]
+                if last not in candidates:
+                    candidates[last] = self.candidates(profile, last)
+                taken = set(zip(cities, cities[1:]))
+                extended.extend(
+                    (score + step, cities + (n,)) for step, n in candidates[last] if (last, n) not in taken
+                )
+            if not extended:
+                break
+            beam = heapq.nlargest(self.beam_width, extended)
+
+        return list(beam[0][1]), beam[0][0], True
+
+    def perfect_route(self, profile):
+        """
+        Get the perfect route of a driver in the results/perfectRoute.json schema.
+
+        :param profile: the driver profile
+        :return: {"driver", "route"} dictionary, the cities being normalized (see normalize_city_name()), with an empty
+                 route when the driver's routes have no trips
+        """
+        return self.route_dictionary(profile, self.solve(profile)[0])
+
+    def route_dictionary(self, profile, route):
+        """
+        Get a route of a driver found by solve() in the results/perfectRoute.json schema (see perfect_route()).
+
+        :param profile: the driver profile
+        :param route: the city ids of the route
+        :return: {"driver", "route"} dictionary
+        """
+        cities = profile.cities
+
+        return {
+            "driver": profile.driver,
+            "route": [
+                {
+                    "from": normalize_city_name(cities[a]),
+                    "to": normalize_city_name(cities[b]),
+                    "merchandise": dict(profile.trip_merchandise.get((a, b), profile.default_merchandise)),
+                }
+                for a, b in zip(route, route[1:])
+            ],
+        }
+
+
+def _solve_profiles(args):
+    """
+    Solve the perfect routes of a batch of driver profiles (run in the worker processes).
+
+    :return: list of (perfect route, complete) tuples, complete being False when the time budget stopped the search
+    """
+    solver, profiles = args
+    results = []
+    for profile in profiles:
+        route, _, complete = solver.solve(profile)
+        results.append((solver.route_dictionary(profile, route), complete))
+
+    return results
+
+
+def driver_profiles(routes):
+    """
+    Build the profiles of all the drivers of a set of actual routes.
+
+    :param routes: RouteTable or iterable of actual routes
+    :return: list of driver profiles, in the order of DRIVERS (then of the names of the other drivers)
+    """
+    return [DriverProfile.from_table(driver_table, driver) for driver, driver_table in driver_tables(routes)]
+
+
+def driver_sort_key(driver):
+    """
+    Get the sort key of a driver in the outputs: the drivers of DRIVERS first, in that order, then the other drivers
+    by name.
+
+    :param driver: driver id
+    :return: the sort key
+    """
+    return _DRIVER_ORDER.get(driver, len(_DRIVER_ORDER)), driver
+
+
+_DRIVER_ORDER = {driver: i for i, driver in enumerate(DRIVERS)}
+
+
+def driver_tables(routes):
+    """
+    Split a set of actual routes by driver.
+
+    :param routes: RouteTable or iterable of actual routes
+    :return: list of (driver name, RouteTable of the driver's routes) tuples, in the order of DRIVERS (then of the
+        names of the other drivers)
+    """
+    table = routes if isinstance(routes, RouteTable) else RouteTable.from_routes(routes)
+    drivers = sorted(np.unique(table.drivers[table.drivers >= 0]).tolist(),
+                     key=lambda i: driver_sort_key(table.driver_names[i]))
+
+    return [(table.driver_names[driver], table.select(table.drivers == driver)) for driver in drivers]
+
+
+def _solve(solver, profiles, workers):
+    """
+    Solve the perfect routes of driver profiles, in parallel when workers > 1.
+
+    :return: list of (perfect route, complete) tuples, in the order of the profiles
+    """
+    if workers == 1 or len(profiles) <= 1:
+        return _solve_profiles((solver, profiles))
+
+    batches = [(solver, profiles[i::workers]) for i in range(workers)]
+    with ProcessPoolExecutor(max_workers=workers, initializer=set_data_context,
+                             initargs=(get_data_context(),)) as executor:
+        results = list(executor.map(_solve_profiles, batches))
+
+    # undo the round-robin split of the profiles
+    return [results[i % workers][i // workers] for i in range(len(profiles))]
+
+
+def generate_perfect_routes(routes, solver=None, workers=None, cache=None):
+    """
+    Generate the perfect route of every driver of a set of actual routes, the drivers being solved in parallel.
+
+    With an ArtifactCache, the perfect route of a driver is cached under the hash of the driver's routes, the solver
+    parameters and the city data (see DataContext.fingerprint), so only the drivers whose routes changed are solved
+    again. A route whose search was stopped by the time budget depends on the timing of the run and is not cached, so
+    the cached routes do not depend on the time budget, which is left out of the key.
+
+    :param routes: RouteTable or iterable of actual routes
+    :param solver: the PerfectRouteSolver (default: default parameters)
+    :param workers: number of worker processes (default: 1, 0 for one per CPU core)
+    :param cache: ArtifactCache of the perfect routes (None to disable caching)
+    :return: list of {"driver", "route"} dictionaries, in the order of driver_profiles()
+    """
+    solver = solver or PerfectRouteSolver()
+    if workers is None:
+        workers = 1
+    elif workers == 0:
+        workers = os.cpu_count() or 1
+
+    # load the city data once so that forked workers inherit it
+    data_context = get_data_context()
+    data_context.warm()
+    if cache is None:
+        return [perfect_route for perfect_route, _ in _solve(solver, driver_profiles(routes), workers)]
+
+    tables = driver_tables(routes)
+    params = {name: value for name, value in vars(solver).items() if name != "time_budget"}
+    keys = [cache.key("perfect_route", params, data_context.fingerprint, table_hash(driver_table))
+            for _, driver_table in tables]
+    perfect_routes = [cache.get("perfect_route", key) for key in keys]
+
+    missing = [i for i, perfect_route in enumerate(perfect_routes) if perfect_route is None]
+    profiles = [DriverProfile.from_table(tables[i][1], tables[i][0]) for i in missing]
+    for i, (perfect_route, complete) in zip(missing, _solve(solver, profiles, workers)):
+        if complete:
+            cache.put("perfect_route", keys[i], perfect_route)
+        perfect_routes[i] = perfect_route
+
+    return perfect_routes
@@ -0,0 +1,280 @@
+import hashlib
+
+import numpy as np
+
+
+def path_fingerprint(route):
+    """
+    Get the fingerprint of the path of a route: a stable hash of its sequence of (from, to) cities, equal for all the
+    routes following the same cities whatever their merchandise.
+
+    :param route: the route (dictionary with a "route" list of trips)
+    :return: hex digest
+    """
+    path = "\x1e".join([trip["from"] + "\x1f" + trip["to"] for trip in route["route"]])
+    return hashlib.blake2b(path.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def route_fingerprint(route):
+    """
+    Get the fingerprint of a route: a stable hash of its cities and merchandise (the order of the items of a trip
+    does not matter), equal for the exact duplicates whatever their id, driver or standard route.
+
+    :param route: the route
+    :return: hex digest
+    """
+    trips = "\x1e".join([
+        trip["from"] + "\x1f" + trip["to"] + "\x1f" + ",".join([f"{item}={quantity}" for item, quantity
+                                                               in sorted(trip["merchandise"].items())])
+        for trip in route["route"]
+    ])
+    return hashlib.blake2b(trips.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def merchandise_delta(base_trips, trips):
+    """
+    Get the merchandise of the trips of a route as deltas from the merchandise of the trips of another route following
+    the same path: per trip, the quantity differences of the items that changed, None for the items removed.
+
+    :param base_trips: the trips of the base route
+    :param trips: the trips of the route
+    :return: list of {item: delta} dictionaries (one per trip), or None when the merchandise is the same
+    """
+    deltas = []
+    for base_trip, trip in zip(base_trips, trips):
+        base, merchandise = base_trip["merchandise"], trip["merchandise"]
+        delta = {item: quantity - base.get(item, 0) for item, quantity in merchandise.items()
+                 if quantity != base.get(item)}
+        delta.update({item: None for item in base if item not in merchandise})
+        deltas.append(delta)
+
+    return deltas if any(deltas) else None
+
+
+def apply_merchandise_delta(base_trips, deltas):
+    """
+    Rebuild the trips of a route from the trips of the base route of its path and its merchandise deltas (see
+    merchandise_delta()).
+
+    :param base_trips: the trips of the base route
+    :param deltas: the merchandise deltas, or None
+    :return: list of trips
+    """
+    if deltas is None:
+        return [{"from": trip["from"], "to": trip["to"], "merchandise": dict(trip["merchandise"])}
+                for trip in base_trips]
+
+    trips = []
+    for base_trip, delta in zip(base_trips, deltas):
+        merchandise = {}
+        for item, quantity in base_trip["merchandise"].items():
+            change = delta.get(item, 0)
+            if change is not None:
+                merchandise[item] = quantity + change
+        merchandise.update({item: change for item, change in delta.items() if item not in base_trip["merchandise"]})
+        trips.append({"from": base_trip["from"], "to": base_trip["to"], "merchandise": merchandise})
+
+    return trips
+
+
+class RouteInterner:
+    """
+    Canonical form of a set of routes: every distinct path (sequence of cities, see path_fingerprint()) is stored once
+    with the trips of the first route following it, and every route refers to its path by id, with its merchandise
+    as deltas from the merchandise of the path (see merchandise_delta()):
+
+    - path record: {"path": "p<n>", "route": [trips...]}
+    - route record: {"id", "path": "p<n>", "delta": [{item: delta}...] or None, "sroute", "driver"}
+
+    The repeated variations of the generator (SAME_VARIED_ROUTE_PROB, SAME_STD_ROUTE_PROB) follow the same paths, so
+    storage and path-level analysis work shrink in proportion to the duplication rate, which stats() reports. The
+    conversion is lossless up to the order of the items of the trips.
+    """
+
+    def __init__(self):
+        """
+        Initialize the RouteInterner class.
+        """
+        self.paths = {}  # path fingerprint -> (path id, trips of the first route following the path)
+        self.trips = {}  # path id -> trips
+        self.path_fingerprints = set()
+        self.route_fingerprints = set()
+        self.num_routes = 0
+
+    def intern(self, route):
+        """
+        Get the records of a route in the canonical form.
+
+        :param route: the route
+        :return: list with the record of the path of the route first if the path is new, then the record of the route
+        """
+        self.num_routes += 1
+        self.route_fingerprints.add(route_fingerprint(route))
+
+        records = []
+        fingerprint = path_fingerprint(route)
+        self.path_fingerprints.add(fingerprint)
+        try:
+            path_id, base_trips = self.paths[fingerprint]
+        except KeyError:
+            path_id, base_trips = f"p{len(self.paths) + 1}", route["route"]
+            self.paths[fingerprint] = path_id, base_trips
+            self.trips[path_id] = base_trips
+            records.append({"path": path_id, "route": base_trips})
+
+        record = {"id": route["id"], "path": path_id, "delta": merchandise_delta(base_trips, route["route"])}
+        record.update({key: value for key, value in route.items() if key not in ("id", "route")})
+        records.append(record)
+
+        return records
+
+    def add_path(self, record):
+        """
+        Register a path record read back from a canonical file.
+
+        :param record: the path record
+        """
+        self.trips[record["path"]] = record["route"]
+
+    def expand(self, record):
+        """
+        Rebuild a route from its record.
+
+        :param record: the route record
+        :return: the route
+        """
+        try:
+            base_trips = self.trips[record["path"]]
+        except KeyError:
+            raise ValueError(f"route {record.get('id')!r} refers to the unknown path {record['path']!r}") from None
+
+        route = {"id": record["id"], "route": apply_merchandise_delta(base_trips, record.get("delta"))}
+        route.update({key: value for key, value in record.items() if key not in ("id", "path", "delta")})
+        return route
+
+    def track(self, routes):
+        """
+        Iterate over routes unchanged, only counting them in the duplication statistics (no path is stored).
+
+        :param routes: iterable of routes
+        :return: generator of the same routes
+        """
+        for route in routes:
+            self.num_routes += 1
+            self.route_fingerprints.add(route_fingerprint(route))
+            self.path_fingerprints.add(path_fingerprint(route))
+            yield route
+
+    def stats(self):
+        """
+        Get the duplication statistics of the routes interned or tracked.
+
+        :return: dictionary with the numbers of routes, of distinct paths and of distinct routes, and the path and
+            route duplication rates (shares of the routes whose path, or whole route, was seen before)
+        """
+        routes = self.num_routes
+        return {
+            "routes": routes,
+            "unique_paths": len(self.path_fingerprints),
+            "unique_routes": len(self.route_fingerprints),
+            "path_duplication_rate": 1 - len(self.path_fingerprints) / routes if routes else 0.0,
+            "route_duplication_rate": 1 - len(self.route_fingerprints) / routes if routes else 0.0,
+        }
+
+
+def format_duplication_stats(stats):
+    """
+    Format duplication statistics (see RouteInterner.stats()) on one line.
+    """
+    return ("{routes} routes, {unique_paths} distinct paths ({path_duplication_rate:.1%} duplicated), "
+            "{unique_routes} distinct routes ({route_duplication_rate:.1%} exact duplicates)").format(**stats)
+
+
+def intern_routes(routes, interner=None):
+    """
+    Convert routes to the canonical form.
+
+    :param routes: iterable of routes
+    :param interner: the RouteInterner (default: a new one), whose stats() describe the routes afterwards
+    :return: generator of path and route records
+    """
+    interner = interner or RouteInterner()
+    for route in routes:
+        yield from interner.intern(route)
+
+
+def expand_routes(records):
+    """
+    Convert records in the canonical form back to routes. Records of plain routes (without a "path" reference) are
+    passed through, so any JSON Lines routes file can be read with this function.
+
+    :param records: iterable of path and route records
+    :return: generator of routes
+    """
+    interner = RouteInterner()
+    for record in records:
+        if "path" not in record:
+            yield record
+        elif "route" in record:
+            interner.add_path(record)
+        else:
+            yield interner.expand(record)
+
+
+# odd 64-bit constants of the vectorized path hashes (splitmix64)
+_GOLDEN = np.uint64(0x9E3779B97F4A7C15)
+_MIX1 = np.uint64(0xBF58476D1CE4E5B9)
+_MIX2 = np.uint64(0x94D049BB133111EB)
+
+
+def _mix(values):
+    """
+    splitmix64 finalizer, vectorized over a uint64 array.
+    """
+    values = values ^ (values >> np.uint64(30))
+    values = values * _MIX1
+    values = values ^ (values >> np.uint64(27))
+    values = values * _MIX2
+    return values ^ (values >> np.uint64(31))
+
+
+def table_path_ids(table):
+    """
+    Get the path of every route of a RouteTable, vectorized: routes following the same sequence of cities get the same
+    path id. A path is identified by two independent 64-bit hashes of its (position, city pair) sequence and its
+    number of trips, so distinct paths practically never collide.
+
+    :param table: the RouteTable
+    :return: ((R,) path id of every route, (P,) index of the first route of every path) arrays
+    """
+    pairs = table.city_pair_ids().astype(np.uint64)
+    route_index = table.trip_route_index()
+    positions = (np.arange(table.num_trips) - table.trip_offsets[route_index]).astype(np.uint64)
+    trip_counts = table.trips_per_route()
+
+    keys = np.zeros((len(table), 3), dtype=np.uint64)
+    keys[:, 2] = trip_counts
+    with np.errstate(over="ignore"):
+        for k, seed in enumerate((np.uint64(1), np.uint64(2))):
+            # sum of the hashes of the trips of every route (wrapping around), the routes without trips keeping 0
+            trip_hashes = _mix(_mix(pairs * _GOLDEN + seed) + positions)
+            nonempty = trip_counts > 0
+            keys[nonempty, k] = np.add.reduceat(trip_hashes, table.trip_offsets[:-1][nonempty]) if len(pairs) else 0
+
+    _, first, path_ids = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+    return path_ids.reshape(-1), first
+
+
+def table_duplication_stats(table):
+    """
+    Get the path duplication statistics of a RouteTable (vectorized, see table_path_ids()).
+
+    :param table: the RouteTable
+    :return: dictionary with the numbers of routes and of distinct paths and the path duplication rate
+    """
+    _, first = table_path_ids(table)
+    return {
+        "routes": len(table),
+        "unique_paths": len(first),
+        "path_duplication_rate": 1 - len(first) / len(table) if len(table) else 0.0,
+    }
@@ -0,0 +1,235 @@
+import numpy as np
+from scipy.sparse import csr_matrix
+
+from .route_table import RouteTable, _ranges
+
+
+# base of the integer keys of the (from, to) city pairs and of the (pair, item) merchandise features
+_CITY_KEY_BASE = 1 << 24
+_ITEM_KEY_BASE = 1 << 8
+
+
+class RouteDistanceKernel:
+    """
+    A batched distance kernel between actual routes and a fixed set of standard routes. The distance between two
+    routes combines:
+
+    - the Jaccard distance between the sets of (from, to) city pairs of their trips
+    - the normalized L1 distance between their per-trip merchandise quantities: the quantities of each (city pair,
+      item) are compared, and the L1 distance is divided by the total quantity of both routes, so it is in [0, 1]
+
+    Both are computed with sparse matrix products: a route is a binary vector over the city pairs, and its merchandise
+    a "thermometer" vector with one entry per quantity level (quantity q sets levels 1..q), so that the dot product of
+    two thermometer vectors is the sum of min(a, b) and L1(a, b) = |a| + |b| - 2 * sum(min(a, b)). With quantity_step
+    > 1, quantities are counted in steps of that size (rounded up), which shrinks the vectors at the cost of an error
+    below one step per compared item.
+
+    Actual routes are processed in chunks of chunk_size routes, so the memory only depends on the chunk size and on the
+    number of standard routes.
+    """
+
+    def __init__(self, standard_routes, city_weight=0.5, quantity_step=5, chunk_size=4096):
+        """
+        Initialize the RouteDistanceKernel class.
+
+        :param standard_routes: the standard routes, as a RouteTable or an iterable of route dictionaries
+        :param city_weight: weight of the city-pair Jaccard distance, the merchandise distance gets 1 - city_weight
+        :param quantity_step: size of the quantity steps of the merchandise vectors (1 for an exact L1 distance)
+        :param chunk_size: number of actual routes processed at once
+        """
+        if not 0 < chunk_size < 1 << 15:
+            raise ValueError(f"chunk_size must be in [1, {(1 << 15) - 1}], got {chunk_size}")
+        if not isinstance(standard_routes, RouteTable):
+            standard_routes = RouteTable.from_routes(standard_routes)
+
+        self.standard_routes = standard_routes
+        self.city_weight = city_weight
+        self.quantity_step = quantity_step
+        self.chunk_size = chunk_size
+
+        self.cities = list(standard_routes.cities)
+        self.merchandise = list(standard_routes.merchandise)
+
+        pair_rows, pair_keys, merch_rows, merch_keys, merch_levels = self._features(standard_routes, 0,
+                                                                                    len(standard_routes))
+        self.pair_keys, pair_columns = np.unique(pair_keys, return_inverse=True)
+        self.merch_keys = np.unique(merch_keys)
+
+        self._std_pairs = csr_matrix((np.ones(len(pair_rows), dtype=np.float32), (pair_rows, pair_columns)),
+                                     shape=(len(standard_routes), len(self.pair_keys))).T.tocsr()
+        self._std_pair_counts = np.bincount(pair_rows, minlength=len(standard_routes)).astype(np.float32)
+
+        # quantity levels the standard routes never reach cannot match, the thermometer vectors stop there
+        self.max_levels = max(int(merch_levels.max()) if len(merch_levels) else 1, 1)
+        self._std_merch = self._thermometer(merch_rows, merch_keys, merch_levels, len(standard_routes)).T.tocsr()
+        self._std_merch_totals = np.bincount(merch_rows, weights=merch_levels,
+                                             minlength=len(standard_routes)).astype(np.float32)
+
+    def __len__(self):
+        return len(self.standard_routes)
+
+    def _table(self, actual_routes):
+        """
+        Get the actual routes as a RouteTable sharing the vocabularies of the standard routes.
+        """
+        if isinstance(actual_routes, RouteTable):
+            return actual_routes
+
+        return RouteTable.from_routes(actual_routes, self.cities, self.merchandise)
+
+    def _features(self, table, start, stop):
+        """
+        Get the features of routes start:stop of a table, with rows relative to start: the distinct (route, city pair)
+        entries, and the (route, city pair, item) merchandise entries with their quantity levels (summed when a
+        route goes twice through the same pair).
+
+        :return: (pair rows, pair keys, merchandise rows, merchandise keys, merchandise levels) arrays
+        """
+        # city ids of the table translated to the ids of the kernel (unknown cities get ids past the known ones)
+        city_map = np.array([self._city_id(city, i, table) for i, city in enumerate(table.cities)], dtype=np.int64)
+        item_map = np.array([self._item_id(item, i, table) for i, item in enumerate(table.merchandise)], dtype=np.int64)
+
+        t0, t1 = table.trip_offsets[start], table.trip_offsets[stop]
+        trip_rows = np.repeat(np.arange(stop - start, dtype=np.int64), np.diff(table.trip_offsets[start:stop + 1]))
+        trip_pairs = city_map[table.trip_from[t0:t1]] * _CITY_KEY_BASE + city_map[table.trip_to[t0:t1]]
+
+        # distinct pairs of every route (rows < 2^15 and pair keys < 2^48 fit together in an int64)
+        row_pairs = np.unique((trip_rows << 48) | trip_pairs)
+        pair_rows, pair_keys = row_pairs >> 48, row_pairs & ((1 << 48) - 1)
+
+        # merchandise entries of the trips, summed per (route, pair, item)
+        m0, m1 = table.merch_offsets[t0], table.merch_offsets[t1]
+        merch_trips = np.repeat(np.arange(t1 - t0, dtype=np.int64), np.diff(table.merch_offsets[t0:t1 + 1]))
+        keys = trip_pairs[merch_trips] * _ITEM_KEY_BASE + item_map[table.merch_items[m0:m1]]
+        row_keys, inverse = np.unique((trip_rows[merch_trips] << 48) | keys, return_inverse=True)
+        quantities = np.bincount(inverse.ravel(), weights=table.merch_quantities[m0:m1], minlength=len(row_keys))
+        levels = np.ceil(quantities / self.quantity_step).astype(np.int64)
+
+        return pair_rows, pair_keys, row_keys >> 48, row_keys & ((1 << 48) - 1), levels
+
+    def _city_id(self, city, table_id, table):
+        if table is self.standard_routes:
+            return table_id
+        try:
+            return self.standard_routes.city2id[city]
+        except KeyError:
+            return len(self.cities) + table_id
+
+    def _item_id(self, item, table_id, table):
+        if table is self.standard_routes:
+            return table_id
+        try:
+            return self.standard_routes.merchandise2id[item]
+        except KeyError:
+            return len(self.merchandise) + table_id
+
+    def _thermometer(self, rows, keys, levels, num_rows):
+        """
+        Build the thermometer matrix of merchandise entries, keeping only the features the standard routes have
+        (the others never contribute to a min(), only to the totals).
+        """
+        columns = np.searchsorted(self.merch_keys, keys)
+        columns[columns == len(self.merch_keys)] = 0
+        known = self.merch_keys[columns] == keys if len(self.merch_keys) else np.zeros(len(keys), dtype=bool)
+        rows, columns, levels = rows[known], columns[known], levels[known]
+
+        # one entry per level: column * max_levels + level
+        max_levels = self.max_levels
+        level_index = _ranges(np.zeros(len(levels), dtype=np.int64), levels)
+        entry_rows = np.repeat(rows, levels)
+        entry_columns = np.repeat(columns, levels) * max_levels + level_index
+        keep = level_index < max_levels
+
+        return csr_matrix((np.ones(int(keep.sum()), dtype=np.float32), (entry_rows[keep], entry_columns[keep])),
+                          shape=(num_rows, len(self.merch_keys) * max_levels))
+
+    def block(self, table, start, stop):
+        """
+        Compute the distances between routes start:stop of a table and all the standard routes.
+
+        :param table: the actual routes as a RouteTable sharing the vocabularies of the kernel (see distances())
+        :param start: first route of the block
+        :param stop: end of the block (excluded)
+        :return: (stop - start, S) float32 distance matrix
+        """
+        num_rows = stop - start
+        pair_rows, pair_keys, merch_rows, merch_keys, merch_levels = self._features(table, start, stop)
+
+        # city pairs: |A & S| from a sparse product, |A| and |S| from the counts
+        columns = np.searchsorted(self.pair_keys, pair_keys)
+        columns[columns == len(self.pair_keys)] = 0
+        known = self.pair_keys[columns] == pair_keys if len(self.pair_keys) else np.zeros(len(pair_keys), dtype=bool)
+        pairs = csr_matrix((np.ones(int(known.sum()), dtype=np.float32), (pair_rows[known], columns[known])),
+                           shape=(num_rows, len(self.pair_keys)))
+        intersection = (pairs @ self._std_pairs).toarray()
+        pair_counts = np.bincount(pair_rows, minlength=num_rows).astype(np.float32)
+        union = pair_counts[:, None] + self._std_pair_counts[None, :] - intersection
+        with np.errstate(divide="ignore", invalid="ignore"):
+            city_distance = np.where(union > 0, 1 - intersection / union, 0).astype(np.float32)
+
+        # merchandise: sum(min(a, s)) from a product of thermometer matrices, totals from the levels
+        sum_min = (self._thermometer(merch_rows, merch_keys, merch_levels, num_rows) @ self._std_merch).toarray()
+        totals = np.bincount(merch_rows, weights=merch_levels, minlength=num_rows).astype(np.float32)
+        total = totals[:, None] + self._std_merch_totals[None, :]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            merch_distance = np.where(total > 0, (total - 2 * sum_min) / total, 0).astype(np.float32)
+
+        return self.city_weight * city_distance + (1 - self.city_weight) * merch_distance
+
+    def iter_blocks(self, actual_routes):
+        """
+        Compute the distances between the actual routes and the standard routes, chunk by chunk.
+
+        :param actual_routes: the actual routes, as a RouteTable or an iterable of route dictionaries
+        :return: generator of (start, block) tuples, block being the (chunk, S) distances of routes start:start+chunk
+        """
+        table = self._table(actual_routes)
+        for start in range(0, len(table), self.chunk_size):
+            stop = min(start + self.chunk_size, len(table))
+            yield start, self.block(table, start, stop)
+
+    def distances(self, actual_routes):
+        """
+        Compute the full (R, S) distance matrix between the actual routes and the standard routes.
+
+        :param actual_routes: the actual routes, as a RouteTable or an iterable of route dictionaries
+        :return: (R, S) float32 distance matrix
+        """
+        table = self._table(actual_routes)
+        matrix = np.empty((len(table), len(self)), dtype=np.float32)
+        for start, block in self.iter_blocks(table):
+            matrix[start:start + len(block)] = block
+
+        return matrix
+
+    def nearest(self, actual_routes):
+        """
+        Get the closest standard route of every actual route, without materializing the full distance matrix.
+
+        :param actual_routes: the actual routes, as a RouteTable or an iterable of route dictionaries
+        :return: (indices, distances) arrays of length R, indices into the standard routes
+        """
+        table = self._table(actual_routes)
+        indices = np.empty(len(table), dtype=np.int64)
+        distances = np.empty(len(table), dtype=np.float32)
+        for start, block in self.iter_blocks(table):
+            stop = start + len(block)
+            indices[start:stop] = block.argmin(axis=1)
+            distances[start:stop] = block[np.arange(len(block)), indices[start:stop]]
+
+        return indices, distances
+
+
+def route_distance_matrix(actual_routes, standard_routes, city_weight=0.5, quantity_step=5, chunk_size=4096):
+    """
+    Compute the (R, S) distance matrix between actual routes and standard routes (see RouteDistanceKernel).
+
+    :param actual_routes: the actual routes, as a RouteTable or an iterable of route dictionaries
+    :param standard_routes: the standard routes, as a RouteTable or an iterable of route dictionaries
+    :param city_weight: weight of the city-pair Jaccard distance, the merchandise distance gets 1 - city_weight
+    :param quantity_step: size of the quantity steps of the merchandise vectors (1 for an exact L1 distance)
+    :param chunk_size: number of actual routes processed at once
+    :return: (R, S) float32 distance matrix
+    """
+    kernel = RouteDistanceKernel(standard_routes, city_weight, quantity_step, chunk_size)
+    return kernel.distances(actual_routes)
@@ -0,0 +1,118 @@
+import re
+
+
+# bits of the shard and of the counter in the integer key of an id
+SHARD_BITS = 32
+COUNTER_BITS = 24
+
+# prefixes of the ids of the standard and actual routes
+STD_ROUTE_ID_PREFIX = "s"
+ACT_ROUTE_ID_PREFIX = "a"
+
+# hex digits of the key in the text form of an id
+_KEY_DIGITS = (SHARD_BITS + COUNTER_BITS + 3) // 4
+_ID_PATTERN = re.compile(rf"([a-z]+)([0-9a-f]{{{_KEY_DIGITS}}})")
+
+
+class RouteIdAllocator:
+    """
+    Allocate unique, sortable route ids without any coordination between processes: an id is a prefix followed by
+    the fixed-width hex form of a 56-bit integer key, shard << COUNTER_BITS | counter, e.g. "a0000002a000007" for the
+    8th id of shard 42. Each process (or unit of work, e.g. a standard route) allocates from its own shard, and the
+    counter of a shard only increases, so:
+
+    - two allocators on different shards never return the same id
+    - the ids of a shard are monotonic, and the text order of the ids is the order of their integer keys, so stores
+      can index the routes on the integer keys (dense within a shard) and scan ranges of ids
+    """
+
+    def __init__(self, prefix=ACT_ROUTE_ID_PREFIX, shard=0, start=0):
+        """
+        Initialize the RouteIdAllocator class.
+
+        :param prefix: prefix of the ids (lower case letters)
+        :param shard: shard of the allocator, in [0, 2 ** SHARD_BITS)
+        :param start: first counter value
+        """
+        if not re.fullmatch("[a-z]+", prefix):
+            raise ValueError(f"invalid route id prefix {prefix!r}, expected lower case letters")
+        if not 0 <= shard < 1 << SHARD_BITS:
+            raise ValueError(f"shard {shard} out of range [0, {1 << SHARD_BITS})")
+
+        self.prefix = prefix
+        self.shard = shard
+        self.counter = start
+
+    def __call__(self):
+        """
+        Allocate the next id.
+
+        :return: the id
+        """
+        return format_route_id(self.prefix, self.next_key())
+
+    def next_key(self):
+        """
+        Allocate the integer key of the next id.
+
+        :return: the key
+        """
+        if self.counter >= 1 << COUNTER_BITS:
+            raise ValueError(f"shard {self.shard} of the route ids is exhausted ({1 << COUNTER_BITS} ids)")
+
+        key = self.shard << COUNTER_BITS | self.counter
+        self.counter += 1
+        return key
+
+    def allocate(self, n):
+        """
+        Allocate n consecutive ids at once.
+
+        :param n: number of ids
+        :return: list of ids
+        """
+        if self.counter + n > 1 << COUNTER_BITS:
+            raise ValueError(f"shard {self.shard} of the route ids is exhausted ({1 << COUNTER_BITS} ids)")
+
+        base = self.shard << COUNTER_BITS
+        ids = [format_route_id(self.prefix, base | counter) for counter in range(self.counter, self.counter + n)]
+        self.counter += n
+        return ids
+
+
+def format_route_id(prefix, key):
+    """
+    Get the text form of a route id.
+
+    :param prefix: prefix of the id
+    :param key: integer key of the id
+    :return: the id
+    """
+    return f"{prefix}{key:0{_KEY_DIGITS}x}"
+
+
+def parse_route_id(route_id):
+    """
+    Split a route id allocated by RouteIdAllocator.
+
+    :param route_id: the id
+    :return: (prefix, shard, counter) tuple
+    :raise ValueError: if the id was not allocated by RouteIdAllocator
+    """
+    match = _ID_PATTERN.fullmatch(route_id)
+    if match is None:
+        raise ValueError(f"{route_id!r} is not an allocated route id")
+
+    key = int(match.group(2), 16)
+    return match.group(1), key >> COUNTER_BITS, key & ((1 << COUNTER_BITS) - 1)
+
+
+def route_id_key(route_id):
+    """
+    Get the integer key of a route id allocated by RouteIdAllocator.
+
+    :param route_id: the id
+    :return: the key
+    """
+    _, shard, counter = parse_route_id(route_id)
+    return shard << COUNTER_BITS | counter
@@ -0,0 +1,142 @@
+import gzip
+import io
+import json
+
+
+# file name suffix -> compression
+COMPRESSION_SUFFIXES = {".gz": "gzip", ".zst": "zstd"}
+
+
+def routes_file_compression(path):
+    """
+    Get the compression of a routes file from its name: "gzip" for .gz, "zstd" for .zst, None otherwise.
+
+    :param path: path of the file
+    :return: the compression name or None
+    """
+    for suffix, compression in COMPRESSION_SUFFIXES.items():
+        if str(path).endswith(suffix):
+            return compression
+
+    return None
+
+
+def open_routes_file(path, mode="r"):
+    """
+    Open a routes file in text mode, transparently (de)compressing it according to its name (.gz or .zst). zstd needs
+    the optional zstandard package.
+
+    :param path: path of the file
+    :param mode: "r", "w" or "a"
+    :return: a text file object
+    """
+    compression = routes_file_compression(path)
+
+    if compression == "gzip":
+        return gzip.open(path, mode + "t", encoding="utf-8")
+
+    if compression == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError("zstd compressed routes files need the zstandard package (pip install zstandard)")
+
+        return io.TextIOWrapper(zstandard.open(path, mode + "b"), encoding="utf-8")
+
+    return open(path, mode, encoding="utf-8")
+
+
+def write_routes_ndjson(routes, path, mode="w"):
+    """
+    Stream routes to a JSON Lines (NDJSON) file, one compact JSON object per line. The routes can come from any
+    iterable, e.g. a generator, and are never held in memory together.
+
+    :param routes: iterable of routes (dictionaries)
+    :param path: path of the file (.gz or .zst to compress it)
+    :param mode: "w" to overwrite the file or "a" to append to it
+    :return: the number of routes written
+    """
+    count = 0
+    with open_routes_file(path, mode) as f:
+        for route in routes:
+            f.write(json.dumps(route, ensure_ascii=False, separators=(",", ":")))
+            f.write("\n")
+            count += 1
+
+    return count
+
+
+def write_routes_json(routes, path):
+    """
+    Stream routes to a JSON file holding one array, without building the whole array (or its text) in memory.
+
+    :param routes: iterable of routes (dictionaries)
+    :param path: path of the file (.gz or .zst to compress it)
+    :return: the number of routes written
+    """
+    count = 0
+    with open_routes_file(path, "w") as f:
+        f.write("[")
+        for route in routes:
+            f.write(",\n" if count else "\n")
+            f.write(json.dumps(route, ensure_ascii=False, separators=(",", ":")))
+            count += 1
+        f.write("\n]\n")
+
+    return count
+
+
+def iter_routes_ndjson(path, offset=0):
+    """
+    Iterate over the routes of a JSON Lines (NDJSON) file, one at a time. Blank lines are skipped.
+
+    :param path: path of the file (.gz or .zst if compressed)
+    :param offset: byte offset of the first line to read, e.g. the size of the file when its routes were last read,
+        to read only the routes appended since (uncompressed files only; the line numbers of the errors then start at
+        the offset)
+    :return: generator of routes
+    """
+    if offset and routes_file_compression(path) is not None:
+        raise ValueError(f"cannot read the compressed routes file {path} from an offset")
+
+    with open_routes_file(path, "r") as f:
+        if offset:
+            f.seek(offset)
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"{path}:{line_number}: invalid JSON line ({e})") from None
+
+
+def iter_routes(path):
+    """
+    Iterate over the routes of a routes file, either a JSON array (.json, loaded at once) or a JSON Lines file
+    (.ndjson / .jsonl, streamed), possibly compressed. JSON Lines files in the canonical form of route_canonical.py
+    (paths stored once) are expanded back to routes, and SQLite route stores (.sqlite, .sqlite3, .db, see
+    route_store.py) are read row by row.
+
+    :param path: path of the file
+    :return: generator of routes
+    """
+    from .route_store import is_route_store, iter_routes_sqlite
+
+    if is_route_store(path):
+        yield from iter_routes_sqlite(path)
+        return
+
+    name = str(path)
+    compression = routes_file_compression(name)
+    if compression is not None:
+        name = name[:name.rindex(".")]
+
+    if name.endswith(".json"):
+        with open_routes_file(path, "r") as f:
+            yield from json.load(f)
+    else:
+        from .route_canonical import expand_routes
+
+        yield from expand_routes(iter_routes_ndjson(path))
@@ -0,0 +1,91 @@
+class Trip:
+    """
+    An immutable trip: departure city, arrival city and merchandise. Variations never modify a trip, they build a new
+    one (replace()) sharing the unchanged fields, so routes made of trips can share them without aliasing problems.
+    The merchandise dictionary belongs to the trip and must not be modified either.
+    """
+
+    __slots__ = ("from_city", "to_city", "merchandise")
+
+    def __init__(self, from_city, to_city, merchandise):
+        """
+        Initialize the Trip class.
+
+        :param from_city: The departure city.
+        :param to_city: The arrival city.
+        :param merchandise: The merchandise dictionary (item -> quantity), owned by the trip from now on.
+        """
+        object.__setattr__(self, "from_city", from_city)
+        object.__setattr__(self, "to_city", to_city)
+        object.__setattr__(self, "merchandise", merchandise)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"Trip is immutable, use replace() to change {name!r}")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"Trip is immutable, use replace() to change {name!r}")
+
+    def __eq__(self, other):
+        if not isinstance(other, Trip):
+            return NotImplemented
+
+        return (self.from_city, self.to_city, self.merchandise) == (other.from_city, other.to_city, other.merchandise)
+
+    def __hash__(self):
+        return hash((self.from_city, self.to_city, tuple(self.merchandise.items())))
+
+    def __repr__(self):
+        return f"Trip({self.from_city!r}, {self.to_city!r}, {self.merchandise!r})"
+
+    def replace(self, from_city=None, to_city=None, merchandise=None):
+        """
+        Get a new trip with some fields replaced, sharing the others with this trip.
+
+        :param from_city: The new departure city (default: unchanged).
+        :param to_city: The new arrival city (default: unchanged).
+        :param merchandise: The new merchandise dictionary (default: unchanged, shared).
+        :return: The new trip.
+        """
+        return Trip(
+            self.from_city if from_city is None else from_city,
+            self.to_city if to_city is None else to_city,
+            self.merchandise if merchandise is None else merchandise,
+        )
+
+    @classmethod
+    def from_dict(cls, trip):
+        """
+        Build a trip from its JSON schema ({"from": ..., "to": ..., "merchandise": {...}}), copying the merchandise.
+
+        :param trip: The trip dictionary.
+        :return: The trip.
+        """
+        return cls(trip["from"], trip["to"], dict(trip["merchandise"]))
+
+    def to_dict(self):
+        """
+        Get the trip in its JSON schema. The merchandise is copied, so the dictionary can be modified freely.
+
+        :return: The trip dictionary.
+        """
+        return {"from": self.from_city, "to": self.to_city, "merchandise": dict(self.merchandise)}
+
+
+def route_from_dicts(trips):
+    """
+    Convert a route in the JSON schema (a list of trip dictionaries) to an immutable route (a tuple of trips).
+
+    :param trips: The list of trip dictionaries.
+    :return: The tuple of trips.
+    """
+    return tuple(Trip.from_dict(trip) for trip in trips)
+
+
+def route_to_dicts(route):
+    """
+    Convert an immutable route (a tuple of trips) to the JSON schema (a list of trip dictionaries).
+
+    :param route: The tuple of trips.
+    :return: The list of trip dictionaries.
+    """
+    return [trip.to_dict() for trip in route]
@@ -0,0 +1,186 @@
+import numpy as np
+from datasketch import LeanMinHash, MinHash, MinHashLSHForest
+
+
+# width of the quantity buckets of the merchandise shingles (1-10, 11-20, ...)
+QUANTITY_BUCKET = 10
+
+# routes added since the last re-index of the forest that queries compare one by one
+BUFFER_SIZE = 1024
+
+
+def route_shingles(route, quantity_bucket=QUANTITY_BUCKET):
+    """
+    Get the shingles of a route, the set of tokens its MinHash signature is built from:
+
+    - one "from>to" token per trip (the city bigrams of the route)
+    - one "item" token per merchandise item carried in the route
+    - one "from>to|item|bucket" token per item of each trip, with the quantity bucketed, so that routes through the
+      same cities carrying similar merchandise on the same trips are closer than routes sharing only the cities
+
+    :param route: a route dictionary ({"route": [trips...], ...}) or its list of trips
+    :param quantity_bucket: width of the quantity buckets (0 to ignore quantities)
+    :return: set of string tokens
+    """
+    trips = route["route"] if isinstance(route, dict) else route
+
+    shingles = set()
+    for trip in trips:
+        bigram = f"{trip['from']}>{trip['to']}"
+        shingles.add(bigram)
+        for item, quantity in trip["merchandise"].items():
+            shingles.add(item)
+            bucket = (quantity - 1) // quantity_bucket if quantity_bucket else 0
+            shingles.add(f"{bigram}|{item}|{bucket}")
+
+    return shingles
+
+
+def route_minhash(route, num_perm=128, seed=1):
+    """
+    Get the MinHash signature of a route's shingles.
+
+    :param route: a route dictionary or its list of trips
+    :param num_perm: number of permutations (signature length)
+    :param seed: seed of the permutations, must be the same for all the signatures compared together
+    :return: a LeanMinHash (compact and picklable)
+    """
+    minhash = MinHash(num_perm=num_perm, seed=seed)
+    minhash.update_batch([shingle.encode("utf-8") for shingle in route_shingles(route)])
+
+    return LeanMinHash(minhash)
+
+
+class RouteSimilarityIndex:
+    """
+    An index of routes by MinHash signature, answering "which indexed routes are the most similar to this route"
+    (estimated Jaccard similarity of their shingles) in sub-linear time with an LSH forest.
+
+    Routes can be added at any time. The forest needs its hash tables sorted before queries, so new routes first go
+    to a buffer of at most buffer_size routes, which queries compare exactly (one vectorized comparison of the
+    signatures). Only when the buffer is full are its routes moved to the forest, which is sorted again on the next
+    query: alternating additions and queries costs one sort of the forest per buffer_size additions instead of one
+    per query, and a query stays near-constant time.
+    """
+
+    def __init__(self, num_perm=128, num_trees=8, seed=1, buffer_size=BUFFER_SIZE):
+        """
+        Initialize the RouteSimilarityIndex class.
+
+        :param num_perm: number of permutations of the MinHash signatures
+        :param num_trees: number of prefix trees of the LSH forest (more trees: better recall, more memory)
+        :param seed: seed of the MinHash permutations
+        :param buffer_size: number of routes added since the last re-index of the forest that queries compare one by
+            one (more: fewer re-indexes, slower queries)
+        """
+        self.num_perm = num_perm
+        self.seed = seed
+        self.forest = MinHashLSHForest(num_perm=num_perm, l=num_trees)
+        self.signatures = {}
+        self.buffer_size = max(1, buffer_size)
+        self._buffer_keys = []
+        self._buffer_values = np.empty((self.buffer_size, num_perm), dtype=np.uint64)
+        self._dirty = False
+
+    def __len__(self):
+        return len(self.signatures)
+
+    def __contains__(self, key):
+        return key in self.signatures
+
+    def minhash(self, route):
+        """
+        Get the MinHash signature of a route with the parameters of this index.
+
+        :param route: a route dictionary or its list of trips
+        :return: the LeanMinHash signature
+        """
+        return route_minhash(route, self.num_perm, self.seed)
+
+    def add(self, key, route=None, minhash=None):
+        """
+        Add a route to the index.
+
+        :param key: the key returned by the queries for this route (usually its id)
+        :param route: the route, unless its signature is given
+        :param minhash: the precomputed signature of the route
+        """
+        if key in self.signatures:
+            raise ValueError(f"Route {key!r} is already in the index")
+
+        if minhash is None:
+            minhash = self.minhash(route)
+
+        if len(self._buffer_keys) == self.buffer_size:
+            self._flush()
+
+        self.signatures[key] = minhash
+        self._buffer_values[len(self._buffer_keys)] = minhash.hashvalues
+        self._buffer_keys.append(key)
+
+    def _flush(self):
+        """
+        Move the buffered routes to the forest, which is sorted again on the next query.
+        """
+        for key in self._buffer_keys:
+            self.forest.add(key, self.signatures[key])
+        self._buffer_keys = []
+        self._dirty = True
+
+    def add_routes(self, routes, key="id"):
+        """
+        Add routes to the index, keyed by one of their fields.
+
+        :param routes: iterable of route dictionaries
+        :param key: the field of the routes used as key
+        :return: the number of routes added
+        """
+        count = 0
+        for route in routes:
+            self.add(route[key], route)
+            count += 1
+
+        return count
+
+    def query(self, route=None, k=5, minhash=None, candidates_factor=4):
+        """
+        Get the k indexed routes most similar to a route. The LSH forest returns up to k * candidates_factor
+        candidates, which are re-ranked by the Jaccard similarity estimated from their signatures.
+
+        :param route: the route to look up, unless its signature is given
+        :param k: number of routes to return
+        :param minhash: the precomputed signature of the route
+        :param candidates_factor: number of candidates fetched from the forest per route returned
+        :return: list of (key, estimated Jaccard similarity) tuples, most similar first
+        """
+        if minhash is None:
+            minhash = self.minhash(route)
+
+        if self._dirty:
+            self.forest.index()
+            self._dirty = False
+
+        ranked = []
+        if len(self.signatures) > len(self._buffer_keys):
+            ranked.extend((key, minhash.jaccard(self.signatures[key]))
+                          for key in self.forest.query(minhash, k * candidates_factor))
+        if self._buffer_keys:
+            # the buffered routes are all compared, with the same estimate as LeanMinHash.jaccard()
+            buffered = self._buffer_values[:len(self._buffer_keys)]
+            similarities = np.count_nonzero(buffered == minhash.hashvalues, axis=1) / self.num_perm
+            ranked.extend(zip(self._buffer_keys, similarities.tolist()))
+        ranked.sort(key=lambda item: (-item[1], str(item[0])))
+
+        return ranked[:k]
+
+    def nearest(self, route=None, minhash=None):
+        """
+        Get the indexed route most similar to a route, e.g. the standard route an actual route most resembles when
+        the index holds the standard routes.
+
+        :param route: the route to look up, unless its signature is given
+        :param minhash: the precomputed signature of the route
+        :return: a (key, estimated Jaccard similarity) tuple, or None if the index is empty
+        """
+        ranked = self.query(route, 1, minhash)
+        return ranked[0] if ranked else None
@@ -0,0 +1,308 @@
+import itertools
+import json
+import os
+import sqlite3
+
+
+# file name suffixes of the SQLite route stores
+ROUTE_STORE_SUFFIXES = (".sqlite", ".sqlite3", ".db")
+
+# routes inserted per executemany() batch (and per transaction) when loading a store
+LOAD_BATCH_SIZE = 10000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cities (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS merchandise_types (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS routes (
+    key INTEGER PRIMARY KEY,
+    id TEXT NOT NULL,
+    sroute TEXT,
+    driver TEXT
+);
+CREATE TABLE IF NOT EXISTS trips (
+    route INTEGER NOT NULL REFERENCES routes (key),
+    position INTEGER NOT NULL,
+    from_city INTEGER NOT NULL REFERENCES cities (id),
+    to_city INTEGER NOT NULL REFERENCES cities (id),
+    PRIMARY KEY (route, position)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS merchandise (
+    route INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    item INTEGER NOT NULL REFERENCES merchandise_types (id),
+    quantity INTEGER NOT NULL,
+    PRIMARY KEY (route, position, seq),
+    FOREIGN KEY (route, position) REFERENCES trips (route, position)
+) WITHOUT ROWID;
+"""
+
+# created after the bulk load of a new store (maintaining them row by row is slower than building them at the end);
+# the trips and merchandise of a route are clustered by their primary keys, so they need no index to be joined
+INDEXES = """
+CREATE INDEX IF NOT EXISTS routes_id ON routes (id);
+CREATE INDEX IF NOT EXISTS routes_driver ON routes (driver, sroute);
+CREATE INDEX IF NOT EXISTS routes_sroute ON routes (sroute);
+CREATE INDEX IF NOT EXISTS trips_from ON trips (from_city);
+CREATE INDEX IF NOT EXISTS trips_to ON trips (to_city);
+"""
+
+# the trips of the route r in the JSON schema, as one JSON array built by SQLite, which is much cheaper than one
+# Python row per item; the aggregates read ordered subqueries, so the trips and their merchandise keep their order
+# whatever plan the scans follow (json() keeps the trip objects JSON through the subquery)
+ROUTE_TRIPS_JSON = """
+SELECT json_group_array(json(trip)) FROM (
+    SELECT json_object('from', cf.name, 'to', ct.name, 'merchandise', json((
+        SELECT json_group_object(name, quantity) FROM (
+            SELECT mt.name, m.quantity FROM merchandise m JOIN merchandise_types mt ON mt.id = m.item
+            WHERE m.route = t.route AND m.position = t.position ORDER BY m.route, m.position, m.seq
+        )
+    ))) AS trip
+    FROM trips t JOIN cities cf ON cf.id = t.from_city JOIN cities ct ON ct.id = t.to_city
+    WHERE t.route = r.key ORDER BY t.route, t.position
+)
+"""
+
+
+def is_route_store(path):
+    """
+    Tell whether a path names a SQLite route store, from its suffix (.sqlite, .sqlite3 or .db).
+
+    :param path: path of the file
+    :return: True for a route store
+    """
+    return str(path).endswith(ROUTE_STORE_SUFFIXES)
+
+
+class RouteStore:
+    """
+    Routes in a SQLite database (stdlib sqlite3), normalized into routes, trips and merchandise tables with the city
+    and merchandise names interned, and indexed on the driver, the standard route and the departure and arrival cities
+    of the trips, so that filtered queries ("the routes of D27 on s13", "the trips through Bologna") only read the
+    matching rows instead of parsing a whole JSON file.
+
+    Routes are loaded in bulk with add_routes(): batches of executemany() in WAL mode, one transaction per batch. The
+    conversion to and from the JSON schema of gen_routes.py is lossless. The store is a context manager closing the
+    connection.
+    """
+
+    def __init__(self, path, readonly=False):
+        """
+        Initialize the RouteStore class, creating the database when needed.
+
+        :param path: path of the database file
+        :param readonly: open an existing database for reading only
+        """
+        self.path = path
+        if readonly:
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"no route store at {path}")
+            self.connection = sqlite3.connect(f"file:{os.path.abspath(path)}?mode=ro", uri=True)
+        else:
+            self.connection = sqlite3.connect(path)
+            self.connection.execute("PRAGMA journal_mode = WAL")
+            self.connection.executescript(SCHEMA)
+
+        self.city2id = dict(self.connection.execute("SELECT name, id FROM cities"))
+        self.merchandise2id = dict(self.connection.execute("SELECT name, id FROM merchandise_types"))
+        self.cities = {i: name for name, i in self.city2id.items()}
+        self.merchandise = {i: name for name, i in self.merchandise2id.items()}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """
+        Close the connection to the database.
+        """
+        self.connection.close()
+
+    def __len__(self):
+        return self.connection.execute("SELECT count(*) FROM routes").fetchone()[0]
+
+    def _intern(self, vocabulary, names, name, rows):
+        """
+        Get the id of a city or merchandise name, allocating it (and queueing its row in rows) when it is new.
+        """
+        try:
+            return vocabulary[name]
+        except KeyError:
+            vocabulary[name] = len(vocabulary) + 1
+            names[vocabulary[name]] = name
+            rows.append((vocabulary[name], name))
+            return vocabulary[name]
+
+    def add_routes(self, routes, batch_size=LOAD_BATCH_SIZE, create_indexes=True):
+        """
+        Insert routes in the JSON schema, consuming them one at a time (routes can be a generator, e.g. of the
+        generator or over a JSON Lines file). The rows are inserted with executemany() by batches of batch_size
+        routes, one transaction per batch, so that a store being loaded can already be queried.
+
+        :param routes: iterable of routes
+        :param batch_size: routes per batch
+        :param create_indexes: create the indexes after the load when they do not exist yet (leave False to load
+            several iterables first)
+        :return: the number of routes inserted
+        """
+        connection = self.connection
+        # route keys are allocated here, so the trips and merchandise rows can refer to them without a query per route
+        route_key = connection.execute("SELECT coalesce(max(key), 0) FROM routes").fetchone()[0]
+
+        # the load does not wait for every write to reach the disk: a crash can only lose the last batches
+        connection.execute("PRAGMA synchronous = OFF")
+        count = 0
+        routes = iter(routes)
+        for batch in iter(lambda: list(itertools.islice(routes, batch_size)), []):
+            city_rows, merchandise_type_rows, route_rows, trip_rows, merchandise_rows = [], [], [], [], []
+            for route in batch:
+                route_key += 1
+                route_rows.append((route_key, route["id"], route.get("sroute"), route.get("driver")))
+                for position, trip in enumerate(route["route"]):
+                    trip_rows.append((
+                        route_key, position,
+                        self._intern(self.city2id, self.cities, trip["from"], city_rows),
+                        self._intern(self.city2id, self.cities, trip["to"], city_rows),
+                    ))
+                    merchandise_rows.extend(
+                        (route_key, position, seq,
+                         self._intern(self.merchandise2id, self.merchandise, item, merchandise_type_rows), quantity)
+                        for seq, (item, quantity) in enumerate(trip["merchandise"].items())
+                    )
+
+            with connection:
+                connection.executemany("INSERT INTO cities VALUES (?, ?)", city_rows)
+                connection.executemany("INSERT INTO merchandise_types VALUES (?, ?)", merchandise_type_rows)
+                connection.executemany("INSERT INTO routes VALUES (?, ?, ?, ?)", route_rows)
+                connection.executemany("INSERT INTO trips VALUES (?, ?, ?, ?)", trip_rows)
+                connection.executemany("INSERT INTO merchandise VALUES (?, ?, ?, ?, ?)", merchandise_rows)
+            count += len(batch)
+
+        connection.execute("PRAGMA synchronous = NORMAL")
+        if create_indexes:
+            self.create_indexes()
+
+        return count
+
+    def create_indexes(self):
+        """
+        Create the indexes of the store when they do not exist yet, and update the statistics of the query planner.
+        """
+        self.connection.executescript(INDEXES)
+        self.connection.execute("ANALYZE")
+
+    def _where(self, driver, sroute, city):
+        """
+        Build the WHERE clause (on the routes table r) and the parameters of a route filter.
+        """
+        clauses, params = [], []
+        if driver is not None:
+            clauses.append("r.driver = ?")
+            params.append(driver)
+        if sroute is not None:
+            clauses.append("r.sroute = ?")
+            params.append(sroute)
+        if city is not None:
+            clauses.append("r.key IN (SELECT route FROM trips WHERE from_city = ? "
+                           "UNION SELECT route FROM trips WHERE to_city = ?)")
+            params.extend([self.city2id.get(city, -1)] * 2)
+
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def count(self, driver=None, sroute=None, city=None):
+        """
+        Count the routes matching a filter (see routes()).
+
+        :return: the number of routes
+        """
+        where, params = self._where(driver, sroute, city)
+        return self.connection.execute(f"SELECT count(*) FROM routes r{where}", params).fetchone()[0]
+
+    def routes(self, driver=None, sroute=None, city=None):
+        """
+        Iterate over the routes matching a filter, in insertion order, rebuilt in the JSON schema. The filters left
+        to None match every route.
+
+        :param driver: the driver of the routes
+        :param sroute: the standard route of the routes
+        :param city: a city the routes pass through (as departure or arrival of a trip)
+        :return: generator of routes
+        """
+        where, params = self._where(driver, sroute, city)
+        rows = self.connection.execute(
+            f"SELECT r.id, r.sroute, r.driver, ({ROUTE_TRIPS_JSON}) FROM routes r{where} ORDER BY r.key", params
+        )
+
+        for route_id, sroute_, driver_, trips in rows:
+            route = {"id": route_id, "route": json.loads(trips)}
+            if sroute_ is not None:
+                route["sroute"] = sroute_
+            if driver_ is not None:
+                route["driver"] = driver_
+            yield route
+
+    def trips(self, city, direction="any"):
+        """
+        Get the trips departing from and / or arriving in a city.
+
+        :param city: the city
+        :param direction: "from" (trips departing from the city), "to" (arriving in it) or "any"
+        :return: list of (route id, position of the trip in the route, from city, to city) tuples
+        """
+        if direction not in ("from", "to", "any"):
+            raise ValueError(f"invalid trip direction {direction!r}, expected 'from', 'to' or 'any'")
+
+        city_id = self.city2id.get(city, -1)
+        selects = [f"SELECT route, position, from_city, to_city FROM trips WHERE {column} = ?"
+                   for column, name in (("from_city", "from"), ("to_city", "to")) if direction in (name, "any")]
+        rows = self.connection.execute(
+            "SELECT r.id, t.position, t.from_city, t.to_city "
+            f"FROM ({' UNION '.join(selects)}) t JOIN routes r ON r.key = t.route ORDER BY t.route, t.position",
+            [city_id] * len(selects)
+        )
+
+        return [(route_id, position, self.cities[from_city], self.cities[to_city])
+                for route_id, position, from_city, to_city in rows]
+
+
+def remove_route_store(path):
+    """
+    Delete a route store with its write-ahead log files, if it exists.
+
+    :param path: path of the database file
+    """
+    for name in (path, f"{path}-wal", f"{path}-shm"):
+        try:
+            os.unlink(name)
+        except FileNotFoundError:
+            pass
+
+
+def write_routes_sqlite(routes, path, mode="w", batch_size=LOAD_BATCH_SIZE):
+    """
+    Stream routes to a SQLite route store (see RouteStore), the routes are never held in memory together.
+
+    :param routes: iterable of routes (dictionaries)
+    :param path: path of the database file
+    :param mode: "w" to overwrite the store or "a" to append to it
+    :param batch_size: routes inserted per batch
+    :return: the number of routes written
+    """
+    if mode == "w":
+        remove_route_store(path)
+
+    with RouteStore(path) as store:
+        return store.add_routes(routes, batch_size)
+
+
+def iter_routes_sqlite(path, driver=None, sroute=None, city=None):
+    """
+    Iterate over the routes of a SQLite route store, optionally filtered (see RouteStore.routes()).
+
+    :param path: path of the database file
+    :return: generator of routes
+    """
+    with RouteStore(path, readonly=True) as store:
+        yield from store.routes(driver, sroute, city)
@@ -0,0 +1,342 @@
+from array import array
+
+import numpy as np
+from src.constants import *
+
+
+class RouteTable:
+    """
+    A compact, columnar representation of a set of routes. City, merchandise, driver and standard route names are
+    interned to int ids, and the routes are stored as flat int arrays:
+
+    - trip_offsets (R + 1): the trips of route r are trips trip_offsets[r]:trip_offsets[r + 1]
+    - trip_from, trip_to (T): city ids of the trips
+    - merch_offsets (T + 1), merch_items, merch_quantities: the merchandise of each trip in CSR layout, in the order
+      of the original dictionaries (merchandise_matrix() gives the scipy.sparse trips x merchandise matrix)
+
+    The conversion to and from the JSON schema of gen_routes.py (id, route, sroute, driver) is lossless.
+    """
+
+    def __init__(self, ids, sroutes, drivers, trip_offsets, trip_from, trip_to, merch_offsets, merch_items,
+                 merch_quantities, cities, merchandise, sroute_names, driver_names):
+        """
+        Initialize the RouteTable class. Use from_routes() or from_file() to build one.
+
+        :param ids: (R,) array of route ids
+        :param sroutes: (R,) int array of standard route ids, -1 when the route has no "sroute"
+        :param drivers: (R,) int array of driver ids, -1 when the route has no "driver"
+        :param trip_offsets: (R + 1,) int array of trip offsets
+        :param trip_from: (T,) int array of departure city ids
+        :param trip_to: (T,) int array of arrival city ids
+        :param merch_offsets: (T + 1,) int array of merchandise offsets
+        :param merch_items: (Q,) int array of merchandise ids
+        :param merch_quantities: (Q,) int array of quantities
+        :param cities: city names, indexed by city id
+        :param merchandise: merchandise names, indexed by merchandise id
+        :param sroute_names: standard route names, indexed by standard route id
+        :param driver_names: driver names, indexed by driver id
+        """
+        self.ids = ids
+        self.sroutes = sroutes
+        self.drivers = drivers
+        self.trip_offsets = trip_offsets
+        self.trip_from = trip_from
+        self.trip_to = trip_to
+        self.merch_offsets = merch_offsets
+        self.merch_items = merch_items
+        self.merch_quantities = merch_quantities
+
+        self.cities = list(cities)
+        self.merchandise = list(merchandise)
+        self.sroute_names = list(sroute_names)
+        self.driver_names = list(driver_names)
+
+        self.city2id = {city: i for i, city in enumerate(self.cities)}
+        self.merchandise2id = {item: i for i, item in enumerate(self.merchandise)}
+        self.sroute2id = {sroute: i for i, sroute in enumerate(self.sroute_names)}
+        self.driver2id = {driver: i for i, driver in enumerate(self.driver_names)}
+
+    @classmethod
+    def from_routes(cls, routes, cities=None, merchandise=None, sroute_names=None, driver_names=None):
+        """
+        Build a route table from routes in the JSON schema, consuming them one at a time (routes can be a generator
+        over a JSON Lines file, the dictionaries are never held in memory together).
+
+        :param routes: iterable of routes
+        :param cities: initial city vocabulary (default: CITIES), extended with the unknown cities met
+        :param merchandise: initial merchandise vocabulary (default: MERCHANDISE_TYPES), extended likewise
+        :param sroute_names: initial standard route vocabulary (default: empty), extended likewise
+        :param driver_names: initial driver vocabulary (default: empty), extended likewise
+        :return: the route table
+        """
+        cities = list(CITIES if cities is None else cities)
+        merchandise = list(MERCHANDISE_TYPES if merchandise is None else merchandise)
+        city2id = {city: i for i, city in enumerate(cities)}
+        merchandise2id = {item: i for i, item in enumerate(merchandise)}
+        sroute2id = {sroute: i for i, sroute in enumerate(sroute_names or [])}
+        driver2id = {driver: i for i, driver in enumerate(driver_names or [])}
+
+        def intern(vocabulary, value):
+            try:
+                return vocabulary[value]
+            except KeyError:
+                vocabulary[value] = len(vocabulary)
+                return vocabulary[value]
+
+        ids = []
+        sroutes, drivers = array("i"), array("i")
+        trip_offsets, trip_from, trip_to = array("q", [0]), array("i"), array("i")
+        merch_offsets, merch_items, merch_quantities = array("q", [0]), array("h"), array("i")
+
+        for route in routes:
+            ids.append(route["id"])
+            sroutes.append(intern(sroute2id, route["sroute"]) if "sroute" in route else -1)
+            drivers.append(intern(driver2id, route["driver"]) if "driver" in route else -1)
+
+            for trip in route["route"]:
+                trip_from.append(intern(city2id, trip["from"]))
+                trip_to.append(intern(city2id, trip["to"]))
+                for item, quantity in trip["merchandise"].items():
+                    merch_items.append(intern(merchandise2id, item))
+                    merch_quantities.append(quantity)
+                merch_offsets.append(len(merch_items))
+
+            trip_offsets.append(len(trip_from))
+
+        return cls(
+            ids=np.array(ids, dtype=str),
+            sroutes=np.frombuffer(sroutes, dtype=np.int32),
+            drivers=np.frombuffer(drivers, dtype=np.int32),
+            trip_offsets=np.frombuffer(trip_offsets, dtype=np.int64),
+            trip_from=np.frombuffer(trip_from, dtype=np.int32),
+            trip_to=np.frombuffer(trip_to, dtype=np.int32),
+            merch_offsets=np.frombuffer(merch_offsets, dtype=np.int64),
+            merch_items=np.frombuffer(merch_items, dtype=np.int16),
+            merch_quantities=np.frombuffer(merch_quantities, dtype=np.int32),
+            cities=_vocabulary_list(city2id),
+            merchandise=_vocabulary_list(merchandise2id),
+            sroute_names=_vocabulary_list(sroute2id),
+            driver_names=_vocabulary_list(driver2id),
+        )
+
+    @classmethod
+    def from_file(cls, path, cities=None, merchandise=None):
+        """
+        Build a route table from a routes file (JSON array or JSON Lines, possibly compressed).
+
+        :param path: path of the routes file
+        :param cities: initial city vocabulary (default: CITIES)
+        :param merchandise: initial merchandise vocabulary (default: MERCHANDISE_TYPES)
+        :return: the route table
+        """
+        from .route_io import iter_routes
+
+        return cls.from_routes(iter_routes(path), cities, merchandise)
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def num_trips(self):
+        """
+        Total number of trips over all the routes.
+        """
+        return len(self.trip_from)
+
+    @property
+    def nbytes(self):
+        """
+        Memory used by the arrays of the table, in bytes (the small vocabularies are not counted).
+        """
+        return sum(
+            a.nbytes for a in (self.ids, self.sroutes, self.drivers, self.trip_offsets, self.trip_from, self.trip_to,
+                               self.merch_offsets, self.merch_items, self.merch_quantities)
+        )
+
+    def route(self, index):
+        """
+        Get a route back in the JSON schema.
+
+        :param index: index of the route in the table
+        :return: the route dictionary
+        """
+        trips = []
+        for t in range(self.trip_offsets[index], self.trip_offsets[index + 1]):
+            start, stop = self.merch_offsets[t], self.merch_offsets[t + 1]
+            trips.append({
+                "from": self.cities[self.trip_from[t]],
+                "to": self.cities[self.trip_to[t]],
+                "merchandise": {
+                    self.merchandise[item]: int(quantity)
+                    for item, quantity in zip(self.merch_items[start:stop], self.merch_quantities[start:stop])
+                }
+            })
+
+        route = {"id": str(self.ids[index]), "route": trips}
+        if self.sroutes[index] >= 0:
+            route["sroute"] = self.sroute_names[self.sroutes[index]]
+        if self.drivers[index] >= 0:
+            route["driver"] = self.driver_names[self.drivers[index]]
+
+        return route
+
+    def to_routes(self):
+        """
+        Iterate over the routes in the JSON schema.
+
+        :return: generator of route dictionaries
+        """
+        for index in range(len(self)):
+            yield self.route(index)
+
+    def trips_per_route(self):
+        """
+        Number of trips of every route, as a (R,) array.
+        """
+        return np.diff(self.trip_offsets)
+
+    def trip_route_index(self):
+        """
+        Index of the route of every trip, as a (T,) array.
+        """
+        return np.repeat(np.arange(len(self), dtype=np.int64), self.trips_per_route())
+
+    def merchandise_matrix(self):
+        """
+        The (T, M) sparse trips x merchandise matrix of quantities.
+
+        :return: scipy.sparse.csr_matrix
+        """
+        from scipy.sparse import csr_matrix
+
+        return csr_matrix((self.merch_quantities, self.merch_items, self.merch_offsets),
+                          shape=(self.num_trips, len(self.merchandise)))
+
+    def route_merchandise_matrix(self):
+        """
+        The (R, M) sparse routes x merchandise matrix of the quantities summed over the trips of each route.
+
+        :return: scipy.sparse.csr_matrix
+        """
+        from scipy.sparse import csr_matrix
+
+        # (R, T) indicator of the trips of every route: row r has ones on the columns of its trips
+        route_trips = csr_matrix(
+            (np.ones(self.num_trips, dtype=np.int32), np.arange(self.num_trips), self.trip_offsets),
+            shape=(len(self), self.num_trips)
+        )
+        return (route_trips @ self.merchandise_matrix()).tocsr()
+
+    def city_pair_ids(self):
+        """
+        Id of the (from, to) city pair of every trip, i.e. from * C + to with C the number of cities, as a (T,) array.
+        """
+        return self.trip_from.astype(np.int64) * len(self.cities) + self.trip_to
+
+    def city_pair_matrix(self):
+        """
+        The (R, C * C) sparse binary matrix of the city pairs (trips) each route goes through.
+
+        :return: scipy.sparse.csr_matrix
+        """
+        from scipy.sparse import csr_matrix
+
+        matrix = csr_matrix(
+            (np.ones(self.num_trips, dtype=np.int8), self.city_pair_ids(), self.trip_offsets),
+            shape=(len(self), len(self.cities) ** 2)
+        )
+        # a route going twice through the same pair counts once
+        matrix.sum_duplicates()
+        matrix.data[:] = 1
+
+        return matrix
+
+    def driver_sroute_counts(self):
+        """
+        Number of routes of every (driver, standard route) pair, as a (D, S) int array (routes without a driver or a
+        standard route are ignored).
+        """
+        mask = (self.drivers >= 0) & (self.sroutes >= 0)
+        num_sroutes = len(self.sroute_names)
+        counts = np.bincount(self.drivers[mask].astype(np.int64) * num_sroutes + self.sroutes[mask],
+                             minlength=len(self.driver_names) * num_sroutes)
+
+        return counts.reshape(len(self.driver_names), num_sroutes)
+
+    def concatenate(self, other):
+        """
+        Get a new table with the routes of this table followed by the routes of another one, whose vocabularies
+        extend the vocabularies of this table (e.g. a table of appended routes built with from_routes() from the
+        vocabularies of this one).
+
+        :param other: the route table of the routes to append
+        :return: the route table of all the routes
+        """
+        for name in ("cities", "merchandise", "sroute_names", "driver_names"):
+            mine, theirs = getattr(self, name), getattr(other, name)
+            if theirs[:len(mine)] != mine:
+                raise ValueError(f"the {name} vocabulary of the appended table does not extend the vocabulary of the "
+                                 f"table")
+
+        return RouteTable(
+            ids=np.concatenate([self.ids, other.ids]), sroutes=np.concatenate([self.sroutes, other.sroutes]),
+            drivers=np.concatenate([self.drivers, other.drivers]),
+            trip_offsets=np.concatenate([self.trip_offsets, other.trip_offsets[1:] + self.trip_offsets[-1]]),
+            trip_from=np.concatenate([self.trip_from, other.trip_from]),
+            trip_to=np.concatenate([self.trip_to, other.trip_to]),
+            merch_offsets=np.concatenate([self.merch_offsets, other.merch_offsets[1:] + self.merch_offsets[-1]]),
+            merch_items=np.concatenate([self.merch_items, other.merch_items]),
+            merch_quantities=np.concatenate([self.merch_quantities, other.merch_quantities]),
+            cities=other.cities, merchandise=other.merchandise, sroute_names=other.sroute_names,
+            driver_names=other.driver_names,
+        )
+
+    def select(self, mask_or_indices):
+        """
+        Get a new table with a subset of the routes (e.g. the routes of one driver), keeping the vocabularies.
+
+        :param mask_or_indices: boolean mask or array of route indices
+        :return: the route table of the selected routes
+        """
+        indices = np.arange(len(self))[mask_or_indices]
+        trip_counts = self.trips_per_route()[indices]
+        trip_index = _ranges(self.trip_offsets[indices], trip_counts)
+        merch_counts = np.diff(self.merch_offsets)[trip_index]
+        merch_index = _ranges(self.merch_offsets[trip_index], merch_counts)
+
+        return RouteTable(
+            ids=self.ids[indices], sroutes=self.sroutes[indices], drivers=self.drivers[indices],
+            trip_offsets=np.concatenate([[0], np.cumsum(trip_counts)]).astype(np.int64),
+            trip_from=self.trip_from[trip_index], trip_to=self.trip_to[trip_index],
+            merch_offsets=np.concatenate([[0], np.cumsum(merch_counts)]).astype(np.int64),
+            merch_items=self.merch_items[merch_index], merch_quantities=self.merch_quantities[merch_index],
+            cities=self.cities, merchandise=self.merchandise, sroute_names=self.sroute_names,
+            driver_names=self.driver_names,
+        )
+
+
+def _vocabulary_list(vocabulary):
+    """
+    Names of an interning dictionary (name -> id), indexed by id.
+    """
+    names = [None] * len(vocabulary)
+    for name, i in vocabulary.items():
+        names[i] = name
+
+    return names
+
+
+def _ranges(starts, counts):
+    """
+    Concatenation of the ranges [start, start + count) for each (start, count) pair, vectorized.
+    """
+    counts = np.asarray(counts, dtype=np.int64)
+    total = int(counts.sum())
+    if total == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    ends = np.cumsum(counts)
+    # position of every element inside its own range, plus the start of that range
+    offsets = np.arange(total, dtype=np.int64) - np.repeat(ends - counts, counts)
+
+    return np.repeat(np.asarray(starts, dtype=np.int64), counts) + offsets
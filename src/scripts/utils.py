@@ -1,32 +1,48 @@
-import pandas as pd
-from geopy import distance
+import numpy as np
 from src.constants import *
+from .data_context import get_data_context
+from .distance_store import export_distance_matrix_csv, save_distance_matrix
 
 
-IT_CITIES_DF = pd.read_csv(ITALIAN_CITIES_DB_CSV_FILE)
+def __getattr__(name):
+    # IT_CITIES_DF is kept for compatibility, it is now read lazily through the data context
+    if name == "IT_CITIES_DF":
+        return get_data_context().cities_df
 
-# rename so that the column names are shorter and comply with PEP-8
-IT_CITIES_DF.rename(
-    columns={"CountryName": "Country", "CapitalName": "capital", "CapitalLatitude": "lat",
-             "CapitalLongitude": "lon", "CountryCode": "code", "ContinentName": "continent"},
-    inplace=True
-)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# mean earth radius (IUGG) in km, used by the haversine formula
+EARTH_MEAN_RADIUS_KM = 6371.0088
+
+# WGS-84 ellipsoid (the same one geopy.distance.distance uses by default)
+WGS84_A_KM = 6378.137
+WGS84_F = 1 / 298.257223563
+
+# distance methods supported by pairwise_distances()
+DISTANCE_METHODS = ("haversine", "ellipsoidal")
+
+# number of matrix rows computed at once by pairwise_distances(), bounds the temporary memory to about
+# DISTANCE_BLOCK_ROWS * N * 8 bytes per intermediate array
+DISTANCE_BLOCK_ROWS = 256
 
 
 # Function to calculate the distance between two cities
 def calculate_distance(city1_, city2_):
     """
     Calculate the distance between two cities in km using the geopy library. Note that first the coordinates of the two
-    cities are retrieved from the IT_CITIES_DF dataframe, then the distance is calculated. If the two cities are the
-    same, the distance is set to NaN. If one of the two cities is not in the IT_CITIES_DF dataframe, then there will be
-    a KeyError exception. So it is important to make sure that the selected cities are in the IT_CITIES_DF dataframe.
+    cities are retrieved from the cities dataframe of the data context (IT_CITIES_DF), then the distance is calculated.
+    If one of the two cities is not in the dataframe, then there will be a KeyError exception. So it is important to
+    make sure that the selected cities are in the cities dataframe.
 
     @param city1_: the first city
     @param city2_: the second city
 
     @return: the distance between the two cities
     """
-    global IT_CITIES_DF
+    from geopy import distance
+
+    IT_CITIES_DF = get_data_context().cities_df
 
     # Get the coordinates of the two cities
     city1_coords = IT_CITIES_DF[IT_CITIES_DF["city"] == city1_].reset_index()
@@ -41,24 +57,139 @@ def calculate_distance(city1_, city2_):
     return d_.km
 
 
-def gen_cities_distance_matrix():
+def get_cities_coordinates(cities, cities_df=None):
+    """
+    Get the (lat, lng) coordinates of the given cities as a (N, 2) array in degrees, in the same order as the cities.
+    The cities dataframe is indexed once instead of being filtered for every city.
+
+    @param cities: list of city names
+    @param cities_df: dataframe with "city", "lat" and "lng" columns (default: IT_CITIES_DF)
+
+    @return: (N, 2) float64 array of latitudes and longitudes
+    """
+    if cities_df is None:
+        cities_df = get_data_context().cities_df
+
+    coords = cities_df.drop_duplicates("city").set_index("city")[["lat", "lng"]]
+    missing = [city for city in cities if city not in coords.index]
+    if missing:
+        raise KeyError(f"Cities not found in the cities database: {missing}")
+
+    return coords.loc[list(cities)].to_numpy(dtype=np.float64)
+
+
+def _central_angle(lat1, lon1, lat2, lon2):
+    """
+    Central angle (in radians) between points given in radians, using the haversine formula. Inputs broadcast.
+    """
+    sin_dlat = np.sin((lat2 - lat1) / 2)
+    sin_dlon = np.sin((lon2 - lon1) / 2)
+    h = sin_dlat * sin_dlat + np.cos(lat1) * np.cos(lat2) * sin_dlon * sin_dlon
+
+    return 2 * np.arcsin(np.sqrt(np.clip(h, 0.0, 1.0)))
+
+
+def _haversine_km(lat1, lon1, lat2, lon2):
+    """
+    Great-circle distance in km on a sphere of mean earth radius. Inputs are in radians and broadcast.
+    """
+    return EARTH_MEAN_RADIUS_KM * _central_angle(lat1, lon1, lat2, lon2)
+
+
+def _ellipsoidal_km(lat1, lon1, lat2, lon2):
+    """
+    Distance in km on the WGS-84 ellipsoid using Lambert's formula for long lines. Inputs are in radians and broadcast.
+    Lambert's formula stays within about 10 m of the exact geodesic (geopy.distance.distance) for the distances found
+    in a national road network (at most 2 m, i.e. 0.0002%, between the cities in the CITIES list).
+    """
+    # reduced latitudes
+    beta1 = np.arctan((1 - WGS84_F) * np.tan(lat1))
+    beta2 = np.arctan((1 - WGS84_F) * np.tan(lat2))
+
+    sigma = _central_angle(beta1, lon1, beta2, lon2)
+
+    p = (beta1 + beta2) / 2
+    q = (beta2 - beta1) / 2
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        x = (sigma - np.sin(sigma)) * np.sin(p) ** 2 * np.cos(q) ** 2 / np.cos(sigma / 2) ** 2
+        y = (sigma + np.sin(sigma)) * np.cos(p) ** 2 * np.sin(q) ** 2 / np.sin(sigma / 2) ** 2
+        d_ = WGS84_A_KM * (sigma - WGS84_F / 2 * (x + y))
+
+    # coincident points give 0/0 in the correction terms
+    return np.where(sigma == 0, 0.0, d_)
+
+
+def pairwise_distances(coords, method="haversine", block_rows=DISTANCE_BLOCK_ROWS):
+    """
+    Compute the full distance matrix (in km) between all the given coordinates in one vectorized pass. Only the upper
+    triangle is computed, block of rows by block of rows, and it is then mirrored to the lower triangle. The diagonal
+    is set to NaN, as in the distance matrix produced by gen_cities_distance_matrix().
+
+    @param coords: (N, 2) array of (lat, lng) coordinates in degrees
+    @param method: "haversine" (spherical earth) or "ellipsoidal" (WGS-84, Lambert's formula)
+    @param block_rows: number of rows computed at once, bounds the temporary memory
+
+    @return: (N, N) float64 distance matrix
+    """
+    if method == "haversine":
+        kernel = _haversine_km
+    elif method == "ellipsoidal":
+        kernel = _ellipsoidal_km
+    else:
+        raise ValueError(f"Invalid method value. Valid values are {DISTANCE_METHODS}")
+
+    coords = np.radians(np.asarray(coords, dtype=np.float64))
+    if coords.ndim != 2 or coords.shape[1] != 2:
+        raise ValueError("coords must be a (N, 2) array of (lat, lng) coordinates")
+
+    n = coords.shape[0]
+    lat, lon = coords[:, 0], coords[:, 1]
+    matrix = np.empty((n, n), dtype=np.float64)
+
+    for start in range(0, n, block_rows):
+        stop = min(start + block_rows, n)
+        # rows [start, stop) against columns [start, n): the strict upper triangle plus the diagonal block
+        block = kernel(lat[start:stop, None], lon[start:stop, None], lat[None, start:], lon[None, start:])
+        matrix[start:stop, start:] = block
+
+    # mirror the upper triangle to the lower triangle
+    lower = np.tril_indices(n, -1)
+    matrix[lower] = matrix.T[lower]
+    np.fill_diagonal(matrix, np.nan)
+
+    return matrix
+
+
+def gen_cities_distance_matrix(cities=None, method="ellipsoidal", cities_df=None,
+                               matrix_path=CITIES_DISTANCE_MATRIX_NPY_FILE, csv_path=CITIES_DISTANCE_MATRIX_CSV_FILE):
     """
     Generate a distance matrix for the cities in the CITIES list. The distance matrix is a pandas dataframe with the
-    cities in the CITIES list as both row and column indexes. The distance between two cities is calculated using the
-    calculate_distance() function. The distance matrix is saved to a CSV file.
+    cities in the CITIES list as both row and column indexes. The distances are computed for all the pairs at once by
+    pairwise_distances() from the coordinates in the cities database. The distance matrix is saved both to the binary
+    (memory-mappable) store and to a CSV file with the city names as row labels.
+    :param cities: the cities to include in the matrix (default: CITIES)
+    :param method: distance method passed to pairwise_distances() ("ellipsoidal" matches geopy within a few meters)
+    :param cities_df: the cities database (default: IT_CITIES_DF)
+    :param matrix_path: path of the binary distance matrix to write (None to skip it)
+    :param csv_path: path of the CSV distance matrix to write (None to skip it)
     :return: the distance matrix as a pandas dataframe
     """
-    # Create a distance matrix for the cities
-    distance_matrix = pd.DataFrame(index=CITIES, columns=CITIES)
-    for city1 in CITIES:
-        print(f"Calculating distances from {city1}...")
-        for city2 in CITIES:
-            if city1 == city2:
-                continue
-            distance_matrix.loc[city1, city2] = calculate_distance(city1, city2)
-
-    # Save the distance matrix to a CSV file
-    distance_matrix.to_csv(CITIES_DISTANCE_MATRIX_CSV_FILE, index=False)
-    print(f"Distance matrix saved to {CITIES_DISTANCE_MATRIX_CSV_FILE}")
+    import pandas as pd
+
+    if cities is None:
+        cities = CITIES
+
+    print(f"Calculating distances between {len(cities)} cities...")
+    matrix = pairwise_distances(get_cities_coordinates(cities, cities_df), method=method)
+    distance_matrix = pd.DataFrame(matrix, index=list(cities), columns=list(cities))
+
+    # Save the distance matrix to the binary store and to a CSV file
+    if matrix_path is not None:
+        save_distance_matrix(matrix, cities, matrix_path)
+        print(f"Distance matrix saved to {matrix_path}")
+    if csv_path is not None:
+        export_distance_matrix_csv(matrix, cities, csv_path)
+        print(f"Distance matrix saved to {csv_path}")
 
     return distance_matrix
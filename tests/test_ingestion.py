@@ -0,0 +1,89 @@
+import asyncio
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from src.constants import *
+from src.scripts.ingestion import RouteIngestionService, validate_route
+
+
+HOME_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def valid_route(route_id="a1"):
+    return {"id": route_id, "sroute": "s1", "driver": "D1",
+            "route": [{"from": CITIES[0], "to": CITIES[1], "merchandise": {MERCHANDISE_TYPES[0]: 3}}]}
+
+
+@pytest.mark.parametrize("trip", [
+    {"from": ["x"], "to": CITIES[1], "merchandise": {}},
+    {"from": CITIES[0], "to": {"city": CITIES[1]}, "merchandise": {}},
+    {"from": CITIES[0], "to": CITIES[1], "merchandise": {MERCHANDISE_TYPES[0]: [1]}},
+])
+def test_validate_route_rejects_unhashable_values(trip):
+    route = dict(valid_route(), route=[trip])
+    with pytest.raises(ValueError):
+        validate_route(route)
+
+
+def test_malformed_record_does_not_stop_the_service(tmp_path):
+    output = tmp_path / "routes.ndjson"
+    bad = dict(valid_route("bad"), route=[{"from": ["x"], "to": CITIES[1], "merchandise": {}}])
+    records = json.dumps(bad) + "\n" + json.dumps(valid_route("good")) + "\n"
+
+    result = subprocess.run([sys.executable, "-m", "src.ingest_routes", "--output", str(output)], input=records,
+                            capture_output=True, text=True, cwd=HOME_DIR, timeout=60)
+
+    assert result.returncode == 0, result.stderr
+    assert [json.loads(line)["id"] for line in output.read_text().splitlines()] == ["good"]
+
+
+def test_sink_errors_are_counted_and_batching_goes_on():
+    batches = []
+
+    def sink(routes):
+        if not batches:
+            batches.append(None)
+            raise OSError("disk full")
+        batches.append([route["id"] for route in routes])
+
+    async def run():
+        service = RouteIngestionService(sink, batch_size=1, queue_size=1)
+        await service.start()
+        for i in range(4):
+            await service.ingest_line(json.dumps(valid_route(f"a{i}")).encode("utf-8"))
+        await service.close()
+        return service.stats()
+
+    stats = asyncio.run(run())
+    assert stats["sink_errors"] == 1 and stats["failed"] == 1 and stats["processed"] == 3
+    assert batches[1:] == [["a1"], ["a2"], ["a3"]]
+
+
+@pytest.mark.parametrize("chunk_size", [None, 4096])
+def test_overlong_and_deeply_nested_lines_are_rejected(chunk_size):
+    records = (b"[" * 50000 + b"\n" + b'{"id": "' + b"x" * 200000 + b'"}\n'
+               + json.dumps(valid_route("good")).encode("utf-8") + b"\n")
+    routes = []
+
+    async def feed(reader):
+        # all at once (the newline of the long line is already buffered) or in chunks (it is not yet)
+        for start in range(0, len(records), chunk_size or len(records)):
+            reader.feed_data(records[start:start + (chunk_size or len(records))])
+            await asyncio.sleep(0)
+        reader.feed_eof()
+
+    async def run():
+        service = RouteIngestionService(routes.extend)
+        await service.start()
+        reader = asyncio.StreamReader(limit=1 << 16)
+        await asyncio.gather(feed(reader), service.handle_stream(reader))
+        await service.close()
+        return service.stats()
+
+    stats = asyncio.run(run())
+    assert stats["received"] == 3 and stats["invalid"] == 2 and stats["processed"] == 1
+    assert [route["id"] for route in routes] == ["good"]